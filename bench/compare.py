@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Throughput keys: bigger is better. Everything else numeric ending in _ms/_s: smaller is better.
+HIGHER_IS_BETTER = ("_per_s",)
+TRACKED = ("_per_s", "_ms", "_s")
+
+
+def flatten(report):
+    # {"results": {"chat": [{"name": "x", "latency": {"p50_ms": 1}}]}} -> {"chat/x/latency.p50_ms": 1}
+    flat = {}
+
+    def walk(prefix, value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                walk(f"{prefix}.{key}", item)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix] = value
+
+    for scenario, rows in report.get("results", {}).items():
+        for row in rows:
+            for key, value in row.items():
+                if key != "name":
+                    walk(f"{scenario}/{row.get('name', '')}/{key}", value)
+    return flat
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="比较两次基准测试结果")
+    parser.add_argument("base", type=Path, help="基线结果 JSON")
+    parser.add_argument("head", type=Path, help="新结果 JSON")
+    parser.add_argument("--threshold", type=float, default=10.0, help="变差超过此百分比视为退化，默认 10")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    base = flatten(json.loads(args.base.read_text(encoding="utf-8")))
+    head = flatten(json.loads(args.head.read_text(encoding="utf-8")))
+    regressions = 0
+    for key in sorted(set(base) & set(head)):
+        if not key.endswith(TRACKED) or not base[key]:
+            continue
+        change = (head[key] - base[key]) / base[key] * 100
+        worse = -change if key.endswith(HIGHER_IS_BETTER) else change
+        flag = ""
+        if worse > args.threshold:
+            flag = "  <- 退化"
+            regressions += 1
+        print(f"{key:<70} {base[key]:>12} -> {head[key]:>12}  {change:+7.1f}%{flag}")
+    print(f"\n共 {regressions} 项退化（阈值 {args.threshold:g}%）")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
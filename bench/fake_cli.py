@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+import sys
+import time
+
+# Stand-in advisor CLI for benchmarks. Reads the prompt from stdin (or argv for the arg transport),
+# sleeps, and streams its reply as Qwen-style stream-json events, one per line:
+#   {"type": "assistant", "message": {"content": [{"type": "text", "text": "..."}]}}
+# With --session it speaks the session transport protocol instead ({"id", "prompt"} -> {"id", "text"}).
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="基准测试用的假军师 CLI")
+    parser.add_argument("--sleep", type=float, default=0.05, help="首个片段前的等待秒数")
+    parser.add_argument("--jitter", type=float, default=0.0, help="等待时间的随机浮动（秒，均匀分布 ±jitter）")
+    parser.add_argument("--chunks", type=int, default=5, help="回复分成多少个流式片段")
+    parser.add_argument("--chunk-chars", type=int, default=40, help="每个片段的字符数")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="片段之间的间隔秒数")
+    parser.add_argument("--format", choices=["stream-json", "text"], default="stream-json", help="输出格式")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="以此概率返回非零退出码")
+    parser.add_argument("--session", action="store_true", help="作为 session 传输的常驻工作进程运行")
+    parser.add_argument("prompt", nargs="?", help="arg 传输时的 prompt；缺省从 stdin 读取")
+    return parser.parse_args(argv)
+
+
+def reply_chunks(args, prompt: str):
+    for i in range(args.chunks):
+        body = ("军议" * args.chunk_chars)[:args.chunk_chars]
+        yield f"[{i + 1}/{args.chunks} prompt={len(prompt)}] {body}"
+
+
+def wait(args):
+    delay = args.sleep + (random.uniform(-args.jitter, args.jitter) if args.jitter else 0.0)
+    if delay > 0:
+        time.sleep(delay)
+
+
+def run_once(args):
+    prompt = args.prompt if args.prompt is not None else sys.stdin.read()
+    wait(args)
+    if args.fail_rate and random.random() < args.fail_rate:
+        print("fake_cli: 模拟失败", file=sys.stderr)
+        return 1
+    for i, chunk in enumerate(reply_chunks(args, prompt)):
+        if i and args.chunk_delay:
+            time.sleep(args.chunk_delay)
+        if args.format == "text":
+            print(chunk, flush=True)
+        else:
+            event = {"type": "assistant", "message": {"content": [{"type": "text", "text": chunk}]}}
+            print(json.dumps(event, ensure_ascii=False), flush=True)
+    if args.format == "stream-json":
+        print(json.dumps({"type": "turn.completed"}), flush=True)
+    return 0
+
+
+def run_session(args):
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+        wait(args)
+        if args.fail_rate and random.random() < args.fail_rate:
+            response = {"id": request.get("id"), "error": "模拟失败"}
+        else:
+            response = {"id": request.get("id"), "text": "\n".join(reply_chunks(args, request.get("prompt", "")))}
+        print(json.dumps(response, ensure_ascii=False), flush=True)
+    return 0
+
+
+def main():
+    args = parse_args()
+    sys.exit(run_session(args) if args.session else run_once(args))
+
+
+if __name__ == "__main__":
+    main()
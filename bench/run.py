@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT = BENCH_DIR.parent
+SRC = ROOT / "src"
+FAKE_CLI = BENCH_DIR / "fake_cli.py"
+RESULTS_DIR = BENCH_DIR / "results"
+sys.path.insert(0, str(SRC))
+
+from history_sqlite import SqliteHistoryStore  # noqa: E402
+from history_store import HistoryStore  # noqa: E402
+from war_council_core import WarCouncil  # noqa: E402
+
+SCENARIOS = ["chat", "cache", "recall", "search", "append", "server"]
+WORDS = [f"主题{i}" for i in range(150)] + [f"topic{i}" for i in range(150)]
+
+
+def _summary(samples):
+    # Latency samples in seconds -> milliseconds summary.
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": pick(50),
+        "p90_ms": pick(90),
+        "p99_ms": pick(99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+@contextmanager
+def _workdir():
+    # WarCouncil and the stores resolve data/ and models.json from the current directory.
+    previous = Path.cwd()
+    with tempfile.TemporaryDirectory(prefix="warcouncil-bench-") as tmp:
+        os.chdir(tmp)
+        try:
+            yield Path(tmp)
+        finally:
+            os.chdir(previous)
+
+
+def _write_models(path: Path, models, **config):
+    path.write_text(json.dumps({**config, "models": models}, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def _mock_models(count: int):
+    return [{"alias": f"军师{i}", "transport": "mock"} for i in range(1, count + 1)]
+
+
+def _fake_models(count: int, sleep: float, transport: str = "stdin"):
+    args = [str(FAKE_CLI), "--sleep", str(sleep)]
+    if transport == "session":
+        args.append("--session")
+    return [
+        {"alias": f"军师{i}", "transport": transport, "cmd": sys.executable, "args": list(args)}
+        for i in range(1, count + 1)
+    ]
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+# ---- chat rounds ----
+
+def _run_rounds(council: WarCouncil, rounds: int, collaborate: bool, use_async: bool):
+    latencies = []
+    mention = "" if collaborate else f"@{council.models[0]['alias']} "
+
+    async def run_async():
+        for i in range(rounds):
+            started = time.perf_counter()
+            await council.chat_async(f"{mention}第{i}轮 军情如何", collaborate=collaborate, use_cache=False)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    if use_async:
+        asyncio.run(run_async())
+    else:
+        for i in range(rounds):
+            began = time.perf_counter()
+            council.chat(f"{mention}第{i}轮 军情如何", collaborate=collaborate, use_cache=False)
+            latencies.append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - started
+    return {"rounds": rounds, "rounds_per_s": round(rounds / elapsed, 2), "latency": _summary(latencies)}
+
+
+def bench_chat(args):
+    cases = [
+        ("mock_single", _mock_models(1), False, False, args.rounds, {}),
+        ("mock_collaborate_5_sequential", _mock_models(5), True, False, args.rounds, {}),
+        ("mock_collaborate_5_parallel", _mock_models(5), True, False, args.rounds, {"dispatch": "parallel"}),
+        ("fake_cli_collaborate_3_parallel", _fake_models(3, args.cli_sleep), True, False, args.cli_rounds,
+         {"dispatch": "parallel"}),
+        ("fake_cli_collaborate_3_async", _fake_models(3, args.cli_sleep), True, True, args.cli_rounds,
+         {"dispatch": "parallel"}),
+        ("fake_session_collaborate_3_parallel", _fake_models(3, args.cli_sleep, "session"), True, False,
+         args.cli_rounds, {"dispatch": "parallel"}),
+    ]
+    results = []
+    for name, models, collaborate, use_async, rounds, config in cases:
+        with _workdir() as tmp:
+            _write_models(tmp / "models.json", models, **config)
+            council = WarCouncil(models_file=tmp / "models.json")
+            try:
+                row = {"name": name, **_run_rounds(council, rounds, collaborate, use_async)}
+            finally:
+                council.close()
+        print(f"  chat    {name:<40} {row['rounds_per_s']:>10} 轮/秒  p50={row['latency']['p50_ms']}ms")
+        results.append(row)
+    return results
+
+
+# ---- reply cache on repeated questions ----
+
+def bench_cache(args):
+    # The same question asked again (a retry after a UI refresh) must be served from the reply cache;
+    # distinct questions must not be.
+    cases = [
+        ("repeat_same_question", lambda i: "@军师1 粮草如何调度", args.cli_rounds - 1),
+        ("distinct_questions", lambda i: f"@军师1 第{i}问 粮草如何调度", 0),
+    ]
+    results = []
+    for name, question, expected_hits in cases:
+        models = _fake_models(1, args.cli_sleep)
+        models[0]["cache"] = {"ttl_s": 600}
+        with _workdir() as tmp:
+            _write_models(tmp / "models.json", models)
+            council = WarCouncil(models_file=tmp / "models.json")
+            latencies = []
+            try:
+                for i in range(args.cli_rounds):
+                    began = time.perf_counter()
+                    council.chat(question(i))
+                    latencies.append(time.perf_counter() - began)
+                stats = council.get_cache_stats()["models"]["军师1"]
+            finally:
+                council.close()
+        row = {
+            "name": name,
+            "rounds": args.cli_rounds,
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "expected_hits": expected_hits,
+            "latency": _summary(latencies),
+        }
+        flag = "" if stats["hits"] == expected_hits else f"  <- 预期命中 {expected_hits}"
+        print(f"  cache   {name:<40} 命中 {stats['hits']}/{args.cli_rounds}  p50={row['latency']['p50_ms']}ms{flag}")
+        results.append(row)
+    return results
+
+
+# ---- recall / search_dates scaling ----
+
+def _open_store(backend: str, tmp: Path):
+    if backend == "sqlite":
+        return SqliteHistoryStore(tmp / "history.sqlite3")
+    return HistoryStore(tmp / "history", flush_interval=3600)
+
+
+def _fill_days(store, days: int, rng: random.Random):
+    first = date(2000, 1, 1)
+    for d in range(days):
+        stamp = f"{(first + timedelta(days=d)).isoformat()}T12:00:00+00:00"
+        store.append_messages([
+            {"role": "user", "speaker": "主公", "text": _text(rng, 12), "time": stamp},
+            {"role": "assistant", "speaker": "军师1", "text": _text(rng, 40), "time": stamp},
+            {"role": "assistant", "speaker": "军师2", "text": _text(rng, 40), "time": stamp},
+        ])
+
+
+def bench_recall(args):
+    results = []
+    for backend in args.backends:
+        for days in args.days:
+            rng = random.Random(days)
+            queries = [_text(rng, 2) for _ in range(args.queries)]
+            with _workdir() as tmp:
+                store = _open_store(backend, tmp)
+                started = time.perf_counter()
+                _fill_days(store, days, rng)
+                store.close()
+                build_s = time.perf_counter() - started
+
+                started = time.perf_counter()
+                store = _open_store(backend, tmp)
+                open_s = time.perf_counter() - started
+                try:
+                    recall, search = [], []
+                    for query in queries:
+                        began = time.perf_counter()
+                        store.recall_notes_for_query(query, limit=3)
+                        recall.append(time.perf_counter() - began)
+                        began = time.perf_counter()
+                        store.search_dates(query)
+                        search.append(time.perf_counter() - began)
+                finally:
+                    store.close()
+            row = {
+                "name": f"{backend}_{days}_days",
+                "backend": backend,
+                "days": days,
+                "build_s": round(build_s, 3),
+                "open_s": round(open_s, 4),
+                "recall_notes_for_query": _summary(recall),
+                "search_dates": _summary(search),
+            }
+            print(
+                f"  recall  {row['name']:<40} recall p50={row['recall_notes_for_query']['p50_ms']}ms  "
+                f"search_dates p50={row['search_dates']['p50_ms']}ms"
+            )
+            results.append(row)
+    return results
+
+
+# ---- search_messages parity ----
+
+SEARCH_TEXTS = [
+    "Qwen 说 AI 兵法重在虚实", "claim: 先取荆州，再图西川", "QW-7 斥候回报，兵分两路", "粮草 ai-ops 已就绪",
+    "天时不如地利，地利不如人和", "mail 已送至东吴", "兵", "ai", "ab-cd 阵法", "x 字营列阵完毕",
+]
+SEARCH_QUERIES = ["ai", "qw", "兵", "兵法", "ai 兵", "claim", "ab-cd", "b-c", "x", "x 字营", "地利", "Qwen 虚实", "无此词"]
+
+
+def bench_search(args):
+    # Both backends must return the same messages for the same query, short (1-2 characters) ones included.
+    rng = random.Random(7)
+    first = date(2000, 1, 1)
+    messages = [
+        {
+            "role": "user" if i % 3 == 0 else "assistant",
+            "speaker": "主公" if i % 3 == 0 else "军师1",
+            "text": f"{rng.choice(SEARCH_TEXTS)} {_text(rng, 6)}",
+            "time": f"{(first + timedelta(days=i % 20)).isoformat()}T12:{i // 20 % 60:02d}:00+00:00",
+        }
+        for i in range(max(20, args.messages))
+    ]
+    found = {}
+    with _workdir() as tmp:
+        for backend in ("jsonl", "sqlite"):
+            store = _open_store(backend, tmp)
+            try:
+                store.append_messages(messages)
+                for query in SEARCH_QUERIES:
+                    began = time.perf_counter()
+                    page = store.search_messages(query, limit=len(messages))
+                    elapsed = time.perf_counter() - began
+                    rows = [(r["date"], r["time"], r["speaker"], r["snippet"]) for r in page["results"]]
+                    found.setdefault(query, {})[backend] = (rows, elapsed)
+            finally:
+                store.close()
+    results = []
+    for query in SEARCH_QUERIES:
+        (jsonl, jsonl_s), (sqlite, sqlite_s) = found[query]["jsonl"], found[query]["sqlite"]
+        row = {
+            "name": f"query_{query}",
+            "hits": len(jsonl),
+            "sqlite_hits": len(sqlite),
+            "parity": jsonl == sqlite,
+            "jsonl_ms": round(jsonl_s * 1000, 3),
+            "sqlite_ms": round(sqlite_s * 1000, 3),
+        }
+        flag = "" if row["parity"] else f"  <- 结果不一致（sqlite 命中 {len(sqlite)}）"
+        timing = f"jsonl={row['jsonl_ms']}ms  sqlite={row['sqlite_ms']}ms"
+        print(f"  search  {query!r:<40} 命中 {len(jsonl):>5}  {timing}{flag}")
+        results.append(row)
+    return results
+
+
+# ---- append_messages throughput ----
+
+def bench_append(args):
+    results = []
+    stamp = datetime.now().astimezone().isoformat()
+    for backend in args.backends:
+        for batch in (1, 4):
+            rng = random.Random(batch)
+            batches = [
+                [{"role": "assistant", "speaker": "军师1", "text": _text(rng, 30), "time": stamp} for _ in range(batch)]
+                for _ in range(max(1, args.messages // batch))
+            ]
+            with _workdir() as tmp:
+                store = _open_store(backend, tmp)
+                latencies = []
+                started = time.perf_counter()
+                for items in batches:
+                    began = time.perf_counter()
+                    store.append_messages(items)
+                    latencies.append(time.perf_counter() - began)
+                store.close()
+                elapsed = time.perf_counter() - started
+            total = batch * len(batches)
+            row = {
+                "name": f"{backend}_batch_{batch}",
+                "backend": backend,
+                "batch": batch,
+                "messages": total,
+                "messages_per_s": round(total / elapsed, 1),
+                "latency": _summary(latencies),
+            }
+            print(f"  append  {row['name']:<40} {row['messages_per_s']:>10} 条/秒")
+            results.append(row)
+    return results
+
+
+# ---- end-to-end HTTP ----
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _request(port: int, method: str, path: str, payload=None, timeout: float = 120):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def _wait_ready(port: int, proc, timeout: float = 15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server.py 提前退出（{proc.returncode}）")
+        try:
+            if _request(port, "GET", "/api/models", timeout=1) == 200:
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server.py 启动超时")
+
+
+def _load(port: int, clients: int, requests: int, alias: str):
+    latencies, errors = [], 0
+
+    def client(index: int):
+        samples, failed = [], 0
+        for i in range(requests):
+            began = time.perf_counter()
+            try:
+                status = _request(port, "POST", "/api/chat", {"text": f"@{alias} 客户{index} 第{i}问"})
+            except OSError:
+                status = 0
+            samples.append(time.perf_counter() - began)
+            failed += status != 200
+        return samples, failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for samples, failed in pool.map(client, range(clients)):
+            latencies.extend(samples)
+            errors += failed
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_s": round(len(latencies) / elapsed, 2),
+        "latency": _summary(latencies),
+    }
+
+
+def bench_server(args):
+    advisors = {"mock": _mock_models(1), "fake_cli": _fake_models(1, args.cli_sleep)}
+    results = []
+    for mode in args.modes:
+        for advisor, models in advisors.items():
+            for clients in args.clients:
+                with _workdir() as tmp:
+                    _write_models(tmp / "models.json", models, max_concurrency=64)
+                    port = _free_port()
+                    proc = subprocess.Popen(
+                        [sys.executable, str(SRC / "server.py"), "--mode", mode, "--port", str(port)],
+                        cwd=tmp,
+                        stdout=subprocess.DEVNULL,
+                        stderr=subprocess.DEVNULL,
+                    )
+                    try:
+                        _wait_ready(port, proc)
+                        row = {
+                            "name": f"{mode}_{advisor}_{clients}_clients",
+                            "mode": mode,
+                            "advisor": advisor,
+                            "clients": clients,
+                            **_load(port, clients, args.requests, models[0]["alias"]),
+                        }
+                    finally:
+                        proc.send_signal(signal.SIGINT)
+                        try:
+                            proc.wait(timeout=10)
+                        except subprocess.TimeoutExpired:
+                            proc.kill()
+                            proc.wait()
+                print(
+                    f"  server  {row['name']:<40} {row['requests_per_s']:>10} 请求/秒  "
+                    f"p50={row['latency']['p50_ms']}ms p99={row['latency']['p99_ms']}ms 错误={row['errors']}"
+                )
+                results.append(row)
+    return results
+
+
+# ---- driver ----
+
+def _git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="军议基准测试（mock 传输与假 CLI）")
+    parser.add_argument("scenarios", nargs="*", help=f"要运行的场景，默认全部：{' '.join(SCENARIOS)}")
+    parser.add_argument("--quick", action="store_true", help="缩小规模，用于快速自检")
+    parser.add_argument("--out", type=Path, default=None, help="结果 JSON 路径，默认 bench/results/<时间>-<提交>.json")
+    parser.add_argument("--rounds", type=int, default=200, help="mock 场景每组轮数")
+    parser.add_argument("--cli-rounds", type=int, default=20, help="假 CLI 场景每组轮数")
+    parser.add_argument("--cli-sleep", type=float, default=0.05, help="假 CLI 每次调用的等待秒数")
+    parser.add_argument("--days", type=int, nargs="+", default=[10, 100, 1000, 10000], help="合成历史的天数")
+    parser.add_argument("--queries", type=int, default=50, help="每种规模的检索次数")
+    parser.add_argument("--backends", nargs="+", choices=["jsonl", "sqlite"], default=["jsonl", "sqlite"])
+    parser.add_argument("--messages", type=int, default=2000, help="append 场景写入的消息数")
+    parser.add_argument("--modes", nargs="+", choices=["thread", "async"], default=["thread", "async"])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 8, 32], help="并发 HTTP 客户端数")
+    parser.add_argument("--requests", type=int, default=20, help="每个客户端发送的请求数")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景：{' '.join(unknown)}")
+    if args.quick:
+        args.rounds, args.cli_rounds, args.queries, args.messages, args.requests = 20, 3, 10, 200, 3
+        args.days = [d for d in args.days if d <= 100] or [10]
+        args.clients = [c for c in args.clients if c <= 8] or [1]
+    return args
+
+
+def main():
+    args = parse_args()
+    runners = {
+        "chat": bench_chat, "cache": bench_cache, "recall": bench_recall, "search": bench_search,
+        "append": bench_append, "server": bench_server,
+    }
+    commit, dirty = _git_commit()
+    report = {
+        "meta": {
+            "started_at": datetime.now().astimezone().isoformat(),
+            "commit": commit,
+            "dirty": dirty,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "results": {},
+    }
+    for name in args.scenarios or SCENARIOS:
+        print(f"[{name}]")
+        report["results"][name] = runners[name](args)
+
+    out = args.out
+    if out is None:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        out = RESULTS_DIR / f"{stamp}-{(commit or 'nogit')[:7]}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(f"结果已写入 {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+import json
+import shlex
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+try:
+    from history_archive import is_date
+    from http_cache import StaticCache, encode_json_body
+    from job_queue import QueueFull
+    from metrics import REGISTRY
+    from sessions import session_id
+except ImportError:
+    from .history_archive import is_date
+    from .http_cache import StaticCache, encode_json_body
+    from .job_queue import QueueFull
+    from .metrics import REGISTRY
+    from .sessions import session_id
+
+TRUE_VALUES = {"1", "true", "yes", "on"}
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".json": "application/json; charset=utf-8",
+}
+
+API_PATHS = {
+    "/api/models", "/api/models/refresh", "/api/history", "/api/chat", "/api/chat/stream", "/api/reset", "/api/jobs",
+    "/api/cache", "/api/sessions", "/api/metrics", "/api/memory/dates", "/api/memory/date", "/api/memory/search",
+}
+
+# (status, JSON payload, extra headers)
+ApiResult = Tuple[int, Dict, Dict[str, str]]
+
+
+def route_label(path: str) -> str:
+    # Bounded label set for per-route metrics: job ids and static paths are folded together.
+    if path in API_PATHS:
+        return path
+    if path.startswith("/api/jobs/"):
+        return "/api/jobs/:id"
+    return "/api/*" if path.startswith("/api/") else "static"
+
+
+def _parse_since(value):
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _first(params, name: str, default: str = "") -> str:
+    return params.get(name, [default])[0]
+
+
+def _ok(payload: Dict, status: int = 200, headers: Optional[Dict[str, str]] = None) -> ApiResult:
+    return status, payload, headers or {}
+
+
+def _error(message: str, status: int = 400) -> ApiResult:
+    return status, {"error": message}, {}
+
+
+class ApiRoutes:
+    # JSON routes shared by the threaded and the asyncio server. get()/post() return None for
+    # paths they do not own (static files, SSE); the servers handle those themselves.
+    def __init__(self, council, jobs, web_dir: Path):
+        self.council = council
+        self.jobs = jobs
+        self.web_dir = web_dir
+        self.static_cache = StaticCache()
+
+    @staticmethod
+    def chat_request(payload: Dict) -> Dict:
+        collaborate = payload.get("collaborate", False)
+        if not isinstance(collaborate, dict):
+            collaborate = bool(collaborate)
+        return {
+            "text": str(payload.get("text", "")),
+            "collaborate": collaborate,
+            "since": _parse_since(payload.get("since")),
+            "epoch": str(payload.get("epoch") or "") or None,
+            "use_cache": not payload.get("no_cache", False),
+            "session": str(payload.get("session") or "") or None,
+        }
+
+    @staticmethod
+    def stream_request(params) -> Dict:
+        collaborate = _first(params, "collaborate", "0").lower() in TRUE_VALUES
+        quorum = _first(params, "quorum")
+        deadline_ms = _first(params, "deadline_ms")
+        if collaborate and (quorum or deadline_ms):
+            collaborate = {"quorum": quorum or None, "deadline_ms": deadline_ms or None}
+        return {
+            "text": _first(params, "text"),
+            "collaborate": collaborate,
+            "since": _parse_since(_first(params, "since")),
+            "epoch": _first(params, "epoch") or None,
+            "use_cache": _first(params, "no_cache", "0").lower() not in TRUE_VALUES,
+            "session": _first(params, "session") or None,
+        }
+
+    def get(self, path: str, params) -> Optional[ApiResult]:
+        try:
+            return self._get(path, params)
+        except ValueError as exc:
+            return _error(str(exc))
+
+    def post(self, path: str, payload: Dict) -> Optional[ApiResult]:
+        try:
+            return self._post(path, payload)
+        except ValueError as exc:
+            return _error(str(exc))
+
+    def _get(self, path: str, params) -> Optional[ApiResult]:
+        council = self.council
+        # Every history/memory route accepts ?session=<id>; empty means the default session.
+        session = _first(params, "session") or None
+
+        if path == "/api/models":
+            return _ok({"models": council.get_models()})
+
+        if path == "/api/history" and "before" in params:
+            # Messages older than the in-memory window, paged from the session's store.
+            try:
+                limit = int(_first(params, "limit", "50"))
+            except ValueError:
+                return _error("limit 必须是整数")
+            before = _parse_since(_first(params, "before"))
+            return _ok(council.get_history_before(before, min(max(limit, 1), 500), session))
+
+        if path == "/api/history":
+            since = _parse_since(_first(params, "since"))
+            delta = council.get_history_since(since, _first(params, "epoch") or None, session)
+            if since is None:
+                # Legacy shape: the whole session under "history".
+                delta["history"] = delta.pop("messages")
+            return _ok(delta)
+
+        if path == "/api/cache":
+            return _ok({"cache": council.get_cache_stats()})
+
+        if path == "/api/sessions":
+            return _ok({"sessions": council.get_session_stats()})
+
+        if path == "/api/jobs":
+            return _ok({"jobs": self.jobs.stats()})
+
+        if path.startswith("/api/jobs/"):
+            job = self.jobs.get(path[len("/api/jobs/"):])
+            if job is None:
+                return _error("任务不存在或已过期", 404)
+            return _ok({"job": job})
+
+        if path == "/api/memory/dates":
+            query = _first(params, "q")
+            if query:
+                return _ok({"dates": council.search_memory_dates(query, session)})
+            return _ok({"dates": council.list_memory_dates(session)})
+
+        if path == "/api/memory/search":
+            query = _first(params, "q").strip()
+            if not query:
+                return _error("缺少 q 参数")
+            try:
+                limit = int(_first(params, "limit", "20"))
+                cursor = int(_first(params, "cursor", "0"))
+            except ValueError:
+                return _error("limit/cursor 必须是整数")
+            return _ok(council.search_memory_messages(
+                query,
+                session=session,
+                speaker=_first(params, "speaker").strip(),
+                date_from=_first(params, "from").strip(),
+                date_to=_first(params, "to").strip(),
+                limit=min(max(limit, 1), 100),
+                cursor=cursor,
+            ))
+
+        if path == "/api/memory/date":
+            date_value = _first(params, "date")
+            if not date_value:
+                return _error("缺少 date 参数")
+            if not is_date(date_value):
+                return _error("date 格式应为 YYYY-MM-DD")
+            try:
+                limit = int(_first(params, "limit", "100"))
+                cursor = int(_first(params, "cursor", "0"))
+                latest = int(_first(params, "latest", "0"))
+            except ValueError:
+                return _error("cursor/limit/latest 必须是整数")
+            if latest > 0:
+                return _ok(council.get_date_history_tail(date_value, min(latest, 1000), session))
+            if "cursor" in params or "limit" in params:
+                return _ok(council.get_date_history_page(date_value, cursor, min(max(limit, 1), 1000), session))
+            return _ok({"date": date_value, "history": council.get_date_history(date_value, session)})
+
+        return None
+
+    def _post(self, path: str, payload: Dict) -> Optional[ApiResult]:
+        council = self.council
+
+        if path == "/api/models":
+            try:
+                alias = str(payload.get("alias", "")).strip()
+                transport = str(payload.get("transport", "")).strip()
+                command = str(payload.get("command", "")).strip()
+                tokens = shlex.split(command) if command else []
+                model = council.add_model(alias, transport, tokens)
+                return _ok({"model": model, "models": council.get_models()})
+            except ValueError as exc:
+                return _error(str(exc))
+
+        if path == "/api/models/refresh":
+            return _ok({"models": council.refresh_models()})
+
+        if path == "/api/chat":
+            return _ok(council.chat(**self.chat_request(payload)))
+
+        if path == "/api/jobs":
+            request = self.chat_request(payload)
+            text = request["text"].strip()
+            if not text:
+                return _error("请输入要咨询的内容")
+            try:
+                priority = int(payload.get("priority", 0))
+            except (TypeError, ValueError):
+                return _error("priority 必须是整数")
+            try:
+                job = self.jobs.submit({
+                    "text": text,
+                    "collaborate": request["collaborate"],
+                    "no_cache": not request["use_cache"],
+                    "session": session_id(request["session"]),
+                }, priority)
+            except QueueFull as exc:
+                return _ok({"error": str(exc)}, 429, {"Retry-After": str(exc.retry_after)})
+            return _ok({"job": job.snapshot()}, 202, {"Location": f"/api/jobs/{job.id}"})
+
+        if path == "/api/reset":
+            state = council.reset_history(str(payload.get("session") or "") or None)
+            return _ok({"ok": True, "history": [], **state})
+
+        return None
+
+    @staticmethod
+    def metrics(params) -> Tuple[int, str, bytes]:
+        # Prometheus text format by default; ?format=json for the same data as JSON.
+        if _first(params, "format") == "json":
+            body = json.dumps({"metrics": REGISTRY.to_json()}, ensure_ascii=False).encode("utf-8")
+            return 200, "application/json; charset=utf-8", body
+        return 200, "text/plain; version=0.0.4; charset=utf-8", REGISTRY.render_prometheus().encode("utf-8")
+
+    @staticmethod
+    def json_body(payload, accept_encoding: str = "") -> Tuple[bytes, Dict[str, str]]:
+        # (body, extra headers); large bodies are gzip-compressed for clients that accept it.
+        return encode_json_body(json.dumps(payload, ensure_ascii=False).encode("utf-8"), accept_encoding)
+
+    def static_file(self, path: str, headers: Optional[Dict[str, str]] = None) -> Tuple[int, Dict[str, str], bytes]:
+        # (status, response headers, body). `headers` are the request headers with lower-case names and drive
+        # ETag/If-Modified-Since revalidation (304) and gzip negotiation. 403/404 carry no headers or body.
+        if path == "/":
+            path = "/index.html"
+        target = (self.web_dir / path.lstrip("/")).resolve()
+        if not str(target).startswith(str(self.web_dir.resolve())):
+            return 403, {}, b""
+        if not target.is_file():
+            return 404, {}, b""
+        content_type = CONTENT_TYPES.get(target.suffix.lower(), "text/plain; charset=utf-8")
+        asset = self.static_cache.load(target, content_type)
+        if asset is None:
+            return 404, {}, b""
+        return asset.respond(headers or {})
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+try:
+    from cli_output import DEFAULT_MAX_LINE_BYTES, DEFAULT_MAX_STDERR_BYTES, READ_CHUNK_BYTES, LineSplitter, TailBuffer
+    from resilience import kill_process_tree
+except ImportError:
+    from .cli_output import DEFAULT_MAX_LINE_BYTES, DEFAULT_MAX_STDERR_BYTES, READ_CHUNK_BYTES, LineSplitter, TailBuffer
+    from .resilience import kill_process_tree
+
+
+async def run_streaming_async(
+    run_args: List[str],
+    stdin_data: Optional[str],
+    on_line: Callable[[str], None],
+    timeout: Optional[float] = None,
+    stats: Optional[Dict] = None,
+    env: Optional[Dict[str, str]] = None,
+    limits: Optional[Dict] = None,
+) -> Tuple[int, str]:
+    # Event-loop twin of WarCouncil._run_streaming. The process group is killed on timeout
+    # (TimeoutError) or when the awaiting task is cancelled. `stats` receives spawn_s, run_s, stdout_bytes
+    # and dropped_lines; `limits` (output_options) caps a single stdout line and the stderr tail kept.
+    limits = limits or {}
+    started = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        *run_args,
+        stdin=asyncio.subprocess.PIPE if stdin_data is not None else asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        env=env,
+    )
+    spawned = time.perf_counter()
+    stdout_bytes = 0
+    splitter = LineSplitter(limits.get("max_line_bytes", DEFAULT_MAX_LINE_BYTES))
+    stderr_tail = TailBuffer(limits.get("max_stderr_bytes", DEFAULT_MAX_STDERR_BYTES))
+
+    async def feed_stdin():
+        if stdin_data is None:
+            return
+        try:
+            proc.stdin.write(stdin_data.encode("utf-8"))
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            proc.stdin.close()
+
+    async def pump_stdout():
+        nonlocal stdout_bytes
+        while True:
+            chunk = await proc.stdout.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            stdout_bytes += len(chunk)
+            for line in splitter.feed(chunk):
+                on_line(line)
+        for line in splitter.close():
+            on_line(line)
+
+    async def pump_stderr():
+        while True:
+            chunk = await proc.stderr.read(READ_CHUNK_BYTES)
+            if not chunk:
+                return
+            stderr_tail.add(chunk)
+
+    stderr_task = asyncio.ensure_future(pump_stderr())
+    tasks = [asyncio.ensure_future(feed_stdin()), asyncio.ensure_future(pump_stdout()), asyncio.ensure_future(proc.wait())]
+    finished = False
+    try:
+        _, pending = await asyncio.wait(tasks, timeout=timeout)
+        if pending:
+            raise TimeoutError(f"超过 {timeout:g} 秒")
+        for task in tasks:
+            task.result()
+        finished = True
+    finally:
+        if not finished:
+            kill_process_tree(proc)
+            for task in tasks + [stderr_task]:
+                task.cancel()
+        if stats is not None:
+            stats.update(
+                spawn_s=spawned - started,
+                run_s=time.perf_counter() - spawned,
+                stdout_bytes=stdout_bytes,
+                dropped_lines=splitter.dropped,
+            )
+    await stderr_task
+    return proc.returncode, stderr_tail.text()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+import asyncio
+import json
+import time
+from http import HTTPStatus
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+try:
+    from api_routes import route_label
+    from http_cache import encode_json_body
+    from metrics import HTTP_SECONDS
+except ImportError:
+    from .api_routes import route_label
+    from .http_cache import encode_json_body
+    from .metrics import HTTP_SECONDS
+
+KEEP_ALIVE_TIMEOUT = 15.0
+MAX_REQUESTS_PER_CONNECTION = 1000
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 10 * 1024 * 1024
+
+
+class BadRequest(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    __slots__ = ("method", "path", "params", "version", "headers", "body")
+
+    def __init__(self, method: str, target: str, version: str, headers: Dict[str, str], body: bytes):
+        parsed = urlparse(target)
+        self.method = method
+        self.path = parsed.path
+        self.params = parse_qs(parsed.query)
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    @property
+    def keep_alive(self) -> bool:
+        connection = self.headers.get("connection", "").lower()
+        if self.version == "HTTP/1.0":
+            return connection == "keep-alive"
+        return connection != "close"
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    # Minimal HTTP/1.1 parser: request line, headers, Content-Length body. None means the peer went away.
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+    except asyncio.LimitOverrunError:
+        raise BadRequest(431, "请求头过大")
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split(" ")
+    if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+        raise BadRequest(400, "请求行格式错误")
+    method, target, version = parts
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise BadRequest(411, "不支持分块请求体，请提供 Content-Length")
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise BadRequest(400, "Content-Length 无效")
+    if length < 0 or length > MAX_BODY_BYTES:
+        raise BadRequest(413, "请求体过大")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return Request(method, target, version, headers, body)
+
+
+def _head(status: int, headers: Dict[str, str], keep_alive: bool) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _response(status: int, body: bytes, content_type: str, keep_alive: bool, headers=None) -> bytes:
+    all_headers = {"Content-Type": content_type, "Content-Length": str(len(body)), **(headers or {})}
+    return _head(status, all_headers, keep_alive) + body
+
+
+def _json_response(payload, status: int, keep_alive: bool, headers=None, accept_encoding: str = "") -> bytes:
+    body, encoding = encode_json_body(json.dumps(payload, ensure_ascii=False).encode("utf-8"), accept_encoding)
+    return _response(status, body, "application/json; charset=utf-8", keep_alive, {**(headers or {}), **encoding})
+
+
+def _text_response(status: int, keep_alive: bool) -> bytes:
+    return _response(status, HTTPStatus(status).phrase.encode("utf-8"), "text/plain; charset=utf-8", keep_alive)
+
+
+class AsyncServer:
+    # One event loop multiplexes every connection; stdin/arg advisors run as asyncio subprocesses
+    # through WarCouncil.chat_async. Other routes are short and run on the default thread pool.
+    def __init__(self, routes):
+        self.routes = routes
+        self.council = routes.council
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            for _ in range(MAX_REQUESTS_PER_CONNECTION):
+                try:
+                    request = await _read_request(reader)
+                except BadRequest as exc:
+                    writer.write(_json_response({"error": str(exc)}, exc.status, False))
+                    await writer.drain()
+                    return
+                if request is None:
+                    return
+                keep_alive = await self.dispatch(request, writer)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request: Request, writer: asyncio.StreamWriter) -> bool:
+        started = time.perf_counter()
+        keep_alive, status = False, 0
+        try:
+            keep_alive, status = await self._dispatch(request, writer)
+        finally:
+            HTTP_SECONDS.observe(
+                time.perf_counter() - started, method=request.method, route=route_label(request.path), status=status
+            )
+        return keep_alive
+
+    async def _dispatch(self, request: Request, writer: asyncio.StreamWriter) -> Tuple[bool, int]:
+        # (keep connection open, response status)
+        keep_alive = request.keep_alive
+        accept_encoding = request.headers.get("accept-encoding", "")
+        if request.method == "GET":
+            if request.path == "/api/chat/stream":
+                return False, await self.stream_chat(request, writer)
+            if request.path == "/api/metrics":
+                status, content_type, data = self.routes.metrics(request.params)
+                response = _response(status, data, content_type, keep_alive)
+            else:
+                result = await asyncio.to_thread(self.routes.get, request.path, request.params)
+                if result is None:
+                    status, response = await self.static_response(request, keep_alive)
+                else:
+                    status, payload, headers = result
+                    response = _json_response(payload, status, keep_alive, headers, accept_encoding)
+        elif request.method == "POST":
+            status, response = await self.post_response(request, keep_alive)
+        else:
+            status, response = 501, _text_response(501, keep_alive)
+        writer.write(response)
+        await writer.drain()
+        return keep_alive, status
+
+    async def post_response(self, request: Request, keep_alive: bool) -> Tuple[int, bytes]:
+        try:
+            payload = json.loads(request.body.decode("utf-8")) if request.body else {}
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return 400, _json_response({"error": "JSON 格式错误"}, 400, keep_alive)
+
+        accept_encoding = request.headers.get("accept-encoding", "")
+        if request.path == "/api/chat":
+            try:
+                result = await self.council.chat_async(**self.routes.chat_request(payload))
+            except ValueError as exc:
+                return 400, _json_response({"error": str(exc)}, 400, keep_alive)
+            return 200, _json_response(result, 200, keep_alive, None, accept_encoding)
+
+        result = await asyncio.to_thread(self.routes.post, request.path, payload)
+        if result is None:
+            return 404, _text_response(404, keep_alive)
+        status, payload, headers = result
+        return status, _json_response(payload, status, keep_alive, headers, accept_encoding)
+
+    async def static_response(self, request: Request, keep_alive: bool) -> Tuple[int, bytes]:
+        status, headers, data = await asyncio.to_thread(self.routes.static_file, request.path, request.headers)
+        if status in (403, 404):
+            return status, _text_response(status, keep_alive)
+        if status == 304:
+            return 304, _head(304, headers, keep_alive)
+        return status, _response(status, data, headers.pop("Content-Type"), keep_alive, headers)
+
+    async def stream_chat(self, request: Request, writer: asyncio.StreamWriter) -> int:
+        # SSE responses have no length, so the connection closes when the round ends.
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+
+        def on_event(name, data):
+            loop.call_soon_threadsafe(events.put_nowait, (name, data))
+
+        task = asyncio.ensure_future(
+            self.council.chat_async(**self.routes.stream_request(request.params), on_event=on_event)
+        )
+        task.add_done_callback(lambda _: loop.call_soon_threadsafe(events.put_nowait, None))
+
+        # Validation errors surface before "start"; answer those as plain JSON.
+        item = await events.get()
+        if item is None:
+            exc = task.exception()
+            message = str(exc) if isinstance(exc, ValueError) else f"军议失败：{exc}" if exc else "军议未开始"
+            writer.write(_json_response({"error": message}, 400, False))
+            await writer.drain()
+            return 400
+
+        writer.write(_head(200, {
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        }, False))
+        connected = True
+        while item is not None:
+            name, data = item
+            if connected:
+                chunk = f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                try:
+                    writer.write(chunk.encode("utf-8"))
+                    await writer.drain()
+                except ConnectionError:
+                    # The round keeps running and is still committed to history.
+                    connected = False
+            item = await events.get()
+
+        exc = task.exception()
+        if exc and connected:
+            chunk = f"event: error\ndata: {json.dumps({'error': f'军议失败：{exc}'}, ensure_ascii=False)}\n\n"
+            try:
+                writer.write(chunk.encode("utf-8"))
+                await writer.drain()
+            except ConnectionError:
+                pass
+        return 200
+
+
+async def serve(routes, host: str, port: int):
+    server = AsyncServer(routes)
+    listener = await asyncio.start_server(server.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+    async with listener:
+        await listener.serve_forever()
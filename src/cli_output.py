@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+import json
+import logging
+import uuid
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List
+
+DEFAULT_MAX_REPLY_BYTES = 1024 * 1024
+DEFAULT_MAX_LINE_BYTES = 4 * 1024 * 1024
+DEFAULT_MAX_STDERR_BYTES = 64 * 1024
+READ_CHUNK_BYTES = 64 * 1024
+SPILL_MAX_BYTES = 10 * 1024 * 1024
+SPILL_BACKUPS = 3
+_SPILL_LOCK = Lock()
+
+
+def output_options(model) -> Dict:
+    # models.json per model (all optional):
+    #   "output": {"max_reply_bytes": 1048576, "max_line_bytes": 4194304, "max_stderr_bytes": 65536, "spill": false}
+    options = model.get("output") if isinstance(model.get("output"), dict) else {}
+
+    def size(name: str, default: int) -> int:
+        try:
+            return max(1024, int(options.get(name, default)))
+        except (TypeError, ValueError):
+            return default
+
+    return {
+        "max_reply_bytes": size("max_reply_bytes", DEFAULT_MAX_REPLY_BYTES),
+        "max_line_bytes": size("max_line_bytes", DEFAULT_MAX_LINE_BYTES),
+        "max_stderr_bytes": size("max_stderr_bytes", DEFAULT_MAX_STDERR_BYTES),
+        "spill": bool(options.get("spill", False)),
+    }
+
+
+def _clip(text: str, room: int) -> str:
+    # Longest prefix of `text` that fits in `room` UTF-8 bytes.
+    return text.encode("utf-8")[:max(0, room)].decode("utf-8", errors="ignore")
+
+
+class CliOutputParser:
+    # Parses CLI stdout line by line so replies can be streamed while the process runs.
+    # feed() returns each newly extracted piece; result() matches the old whole-output parsing.
+    # Extracted text and the raw-line fallback are each capped at max_reply_bytes; a CLI dumping
+    # verbose stream-json traces therefore costs at most that much per call, not its whole output.
+    def __init__(self, max_reply_bytes: int = DEFAULT_MAX_REPLY_BYTES):
+        self.max_reply_bytes = max_reply_bytes
+        self.pieces: List[str] = []
+        self.raw_lines: List[str] = []
+        self.saw_json = False
+        self.dropped_lines = 0
+        self._seen = set()
+        self._piece_bytes = 0
+        self._raw_bytes = 0
+        self._pieces_truncated = False
+        self._raw_truncated = False
+
+    def _keep_raw(self, raw: str) -> str:
+        if self._raw_truncated:
+            return ""
+        size = len(raw.encode("utf-8")) + 1
+        if self._raw_bytes + size > self.max_reply_bytes:
+            raw = _clip(raw, self.max_reply_bytes - self._raw_bytes)
+            self._raw_truncated = True
+        self.raw_lines.append(raw)
+        self._raw_bytes += size
+        return raw
+
+    def feed(self, line: str) -> str:
+        raw = line.rstrip("\r\n")
+        stripped = raw.strip()
+        kept = self._keep_raw(raw)
+        if not stripped:
+            return ""
+
+        obj = None
+        try:
+            obj = json.loads(stripped)
+        except Exception:
+            pass
+        if not isinstance(obj, dict):
+            # Plain-text CLIs stream line by line until a JSON event shows up.
+            return "" if self.saw_json else kept.strip()
+        self.saw_json = True
+
+        # Keep order but remove duplicates commonly seen in stream-json + final result events.
+        text = extract_text_from_json_obj(obj).strip()
+        if not text or text in self._seen or self._pieces_truncated:
+            return ""
+        self._seen.add(text)
+        size = len(text.encode("utf-8")) + 1
+        if self._piece_bytes + size > self.max_reply_bytes:
+            text = _clip(text, self.max_reply_bytes - self._piece_bytes)
+            self._pieces_truncated = True
+        self._piece_bytes += size
+        self.pieces.append(text)
+        return text
+
+    def result(self) -> str:
+        cleaned = "\n".join(self.pieces).strip() if self.saw_json else ""
+        if cleaned:
+            text, truncated = cleaned, self._pieces_truncated
+        else:
+            text, truncated = "\n".join(self.raw_lines).strip(), self._raw_truncated
+        notes = []
+        if truncated:
+            notes.append(f"…（输出超过 {self.max_reply_bytes} 字节，已截断）")
+        if self.dropped_lines:
+            notes.append(f"…（另有 {self.dropped_lines} 行超长输出已丢弃）")
+        return "\n".join([text] + notes).strip() if notes else text
+
+
+def normalize_cli_output(out: str, max_reply_bytes: int = DEFAULT_MAX_REPLY_BYTES) -> str:
+    if not out:
+        return ""
+    parser = CliOutputParser(max_reply_bytes)
+    for line in out.splitlines():
+        parser.feed(line)
+    return parser.result()
+
+
+class LineSplitter:
+    # Splits a byte stream into decoded lines while holding at most max_line_bytes of any one line.
+    # Longer lines are skipped through their newline and counted in `dropped`.
+    def __init__(self, max_line_bytes: int = DEFAULT_MAX_LINE_BYTES):
+        self.max_line_bytes = max_line_bytes
+        self.dropped = 0
+        self._buffer = bytearray()
+        self._skipping = False
+
+    def feed(self, chunk: bytes) -> List[str]:
+        scan = len(self._buffer)
+        self._buffer += chunk
+        lines = []
+        start = 0
+        while True:
+            end = self._buffer.find(b"\n", scan)
+            if end < 0:
+                break
+            if self._skipping:
+                self._skipping = False
+            elif end + 1 - start > self.max_line_bytes:
+                self.dropped += 1
+            else:
+                lines.append(self._buffer[start:end + 1].decode("utf-8", errors="replace"))
+            start = scan = end + 1
+        del self._buffer[:start]
+        if len(self._buffer) > self.max_line_bytes:
+            if not self._skipping:
+                self.dropped += 1
+            self._skipping = True
+            self._buffer.clear()
+        return lines
+
+    def close(self) -> List[str]:
+        rest = bytes(self._buffer)
+        self._buffer.clear()
+        if not rest or self._skipping:
+            return []
+        return [rest.decode("utf-8", errors="replace")]
+
+
+class TailBuffer:
+    # Keeps the last `limit` bytes of a stream (stderr: the error message is usually at the end).
+    def __init__(self, limit: int = DEFAULT_MAX_STDERR_BYTES):
+        self.limit = limit
+        self.skipped = 0
+        self._data = bytearray()
+
+    def add(self, chunk: bytes):
+        self._data += chunk
+        if len(self._data) > self.limit:
+            excess = len(self._data) - self.limit
+            del self._data[:excess]
+            self.skipped += excess
+
+    def text(self) -> str:
+        text = self._data.decode("utf-8", errors="replace")
+        return f"…（前 {self.skipped} 字节已省略）{text}" if self.skipped else text
+
+
+def open_spill(path: Path, header: str) -> Callable[[str], None]:
+    # Appends one call's raw output to a size-rotated debug log. Lines are tagged per call because
+    # concurrent calls of the same advisor share the file.
+    logger = logging.getLogger(f"warcouncil.spill.{path}")
+    with _SPILL_LOCK:
+        if not logger.handlers:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            handler = RotatingFileHandler(path, maxBytes=SPILL_MAX_BYTES, backupCount=SPILL_BACKUPS, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+    tag = uuid.uuid4().hex[:8]
+    logger.info("[%s] === %s", tag, header)
+    return lambda line: logger.info("[%s] %s", tag, line.rstrip("\r\n"))
+
+
+def extract_text_from_json_obj(obj):
+    if not isinstance(obj, dict):
+        return ""
+
+    event_type = obj.get("type")
+    if isinstance(event_type, str):
+        if event_type == "item.completed":
+            item = obj.get("item")
+            if isinstance(item, dict):
+                item_type = item.get("type")
+                # Ignore internal reasoning traces; only surface assistant-facing text.
+                if item_type in {"reasoning", "tool_call", "tool_result"}:
+                    return ""
+                if item_type in {"agent_message", "assistant_message", "message"}:
+                    return stringify_text_value(item.get("text") or item.get("content"))
+        if event_type in {"response.output_text.delta", "response.output_text"}:
+            return stringify_text_value(obj.get("delta") or obj.get("text") or obj.get("output_text"))
+        if event_type in {"thread.started", "turn.started", "turn.completed"}:
+            return ""
+        # Qwen stream-json events
+        if event_type == "assistant":
+            message = obj.get("message")
+            if isinstance(message, dict):
+                return extract_message_content_text(message)
+            return ""
+        if event_type == "result":
+            return stringify_text_value(obj.get("result"))
+        if event_type == "system":
+            return ""
+
+    candidates = []
+    preferred_keys = ["output_text", "text", "message", "content", "delta", "result", "output", "final"]
+    for key in preferred_keys:
+        if key in obj:
+            value = obj.get(key)
+            text = stringify_text_value(value)
+            if text:
+                candidates.append(text)
+
+    if candidates:
+        return "\n".join(candidates).strip()
+
+    return ""
+
+
+def extract_message_content_text(message):
+    content = message.get("content")
+    if not isinstance(content, list):
+        return ""
+
+    parts = []
+    for item in content:
+        if not isinstance(item, dict):
+            continue
+        item_type = item.get("type")
+        if item_type == "text":
+            text = stringify_text_value(item.get("text"))
+            if text:
+                parts.append(text)
+        # Explicitly ignore thinking blocks from providers like Qwen/Codex.
+        if item_type == "thinking":
+            continue
+
+    return "\n".join(parts).strip()
+
+
+def stringify_text_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list):
+        parts = []
+        for item in value:
+            text = stringify_text_value(item)
+            if text:
+                parts.append(text)
+        return "\n".join(parts).strip()
+    if isinstance(value, dict):
+        for key in ["text", "content", "message", "output_text", "delta"]:
+            if key in value:
+                text = stringify_text_value(value.get(key))
+                if text:
+                    return text
+        for nested in value.values():
+            text = stringify_text_value(nested)
+            if text:
+                return text
+        return ""
+    return ""
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+LOGIN_SHELL_TIMEOUT = 10
+ENV_MARKER = "__WARCOUNCIL_LOGIN_ENV__"
+# Fields added to in-memory model records; never written back to models.json.
+RESOLVED_FIELDS = ("resolved_cmd", "resolved_via")
+
+
+def _login_shell() -> Optional[str]:
+    for shell in (os.environ.get("SHELL"), "/bin/zsh", "/bin/bash", "/bin/sh"):
+        if shell and os.access(shell, os.X_OK):
+            return shell
+    return None
+
+
+def _executable(path: str) -> bool:
+    return os.path.isfile(path) and os.access(path, os.X_OK)
+
+
+class CommandResolver:
+    # Resolves model `cmd`s to absolute paths once, when models are loaded or added, instead of falling
+    # back to a `zsh -lc` wrapper on every call. Lookup order: the service's own PATH, then the PATH of
+    # a login shell, captured once (with the rest of its environment) and cached until refresh().
+    # Commands found only through the login shell are spawned with that environment, so shebangs such
+    # as `#!/usr/bin/env node` still find their interpreter.
+    def __init__(self):
+        self._login_env: Optional[Dict[str, str]] = None
+        self._resolved: Dict[str, Tuple[str, str]] = {}
+        self._generation = 0
+        self._lock = Lock()
+        self._capture_lock = Lock()
+
+    def _capture_login_env(self) -> Dict[str, str]:
+        shell = _login_shell()
+        if not shell:
+            return {}
+        # Profiles may print banners, so the environment is emitted as one marked JSON line.
+        script = f"import json, os; print({ENV_MARKER!r} + json.dumps(dict(os.environ)))"
+        try:
+            out = subprocess.run(
+                [shell, "-lc", f"exec {shlex.quote(sys.executable)} -c {shlex.quote(script)}"],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+                timeout=LOGIN_SHELL_TIMEOUT,
+                check=False,
+            ).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            return {}
+        for line in reversed(out.splitlines()):
+            if line.startswith(ENV_MARKER):
+                try:
+                    env = json.loads(line[len(ENV_MARKER):])
+                except ValueError:
+                    break
+                return {str(k): str(v) for k, v in env.items()} if isinstance(env, dict) else {}
+        return {}
+
+    def login_env(self) -> Dict[str, str]:
+        # The login shell can take seconds, so it runs under its own lock: concurrent first callers wait for
+        # one capture, while resolve() cache hits only ever take the short _lock.
+        with self._lock:
+            if self._login_env is not None:
+                return self._login_env
+        with self._capture_lock:
+            with self._lock:
+                if self._login_env is not None:
+                    return self._login_env
+                generation = self._generation
+            env = self._capture_login_env()
+            with self._lock:
+                # A refresh() during the capture makes this snapshot stale for caching, not for this caller.
+                if self._generation == generation:
+                    self._login_env = env
+            return env
+
+    def _lookup(self, cmd: str) -> Tuple[Optional[str], str]:
+        if os.sep in cmd:
+            path = os.path.abspath(os.path.expanduser(cmd))
+            return (path, "path") if _executable(path) else (None, "")
+        found = shutil.which(cmd)
+        if found:
+            return os.path.abspath(found), "path"
+        login_path = self.login_env().get("PATH")
+        found = shutil.which(cmd, path=login_path) if login_path else None
+        if found:
+            return os.path.abspath(found), "login"
+        return None, ""
+
+    def resolve(self, cmd: str) -> Tuple[Optional[str], str]:
+        # (absolute path or None, "path" | "login" | ""). Hits are cached per cmd; a cached path that is no
+        # longer an executable file (uninstalled, moved by an upgrade) is looked up again.
+        if not cmd:
+            return None, ""
+        with self._lock:
+            cached = self._resolved.get(cmd)
+        if cached and _executable(cached[0]):
+            return cached
+        result = self._lookup(cmd)
+        with self._lock:
+            if result[0]:
+                self._resolved[cmd] = result
+            else:
+                self._resolved.pop(cmd, None)
+        return result
+
+    def refresh(self):
+        # Drops the login-shell snapshot and every resolution; the next resolve() starts over.
+        with self._lock:
+            self._login_env = None
+            self._resolved.clear()
+            self._generation += 1
+
+    def annotate(self, model: Dict) -> Dict:
+        # Sets resolved_cmd/resolved_via on a model record in place.
+        for field in RESOLVED_FIELDS:
+            model.pop(field, None)
+        if model.get("transport", "mock") != "mock" and model.get("cmd"):
+            path, via = self.resolve(model["cmd"])
+            if path:
+                model["resolved_cmd"], model["resolved_via"] = path, via
+        return model
+
+    def env_for(self, via: str) -> Optional[Dict[str, str]]:
+        # Environment for spawning a command resolved `via`; None inherits the service's own.
+        if via != "login":
+            return None
+        return {**os.environ, **self.login_env()}
+
@@ -0,0 +1,403 @@
+#!/usr/bin/env python3
+import argparse
+import bisect
+import gzip
+import hashlib
+import json
+import lzma
+import os
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from threading import Event, Lock, RLock, Thread
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Raw bytes per compressed block: a page or a search hit decompresses one or two blocks, not the day.
+BLOCK_BYTES = 64 * 1024
+CACHED_BLOCKS = 8
+DEFAULT_CODEC = "gzip"
+# Today and yesterday stay plain JSONL: day files are named by UTC date and a round can straddle midnight.
+DEFAULT_KEEP_DAYS = 2
+DEFAULT_INTERVAL = 3600.0
+INDEX_SUFFIX = ".blocks.json"
+DAY_GLOB = "????-??-??.jsonl"
+DATE_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}")
+# codec -> (data file suffix, compress, decompress). Blocks are whole gzip members / xz streams, so the
+# concatenated data file is still a valid .gz/.xz and `zcat 2026-01-01.jsonl.gz` prints the day.
+CODECS: Dict[str, Tuple[str, Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "gzip": (".jsonl.gz", lambda data: gzip.compress(data, 6, mtime=0), gzip.decompress),
+    "lzma": (".jsonl.xz", lambda data: lzma.compress(data, preset=6), lzma.decompress),
+}
+
+
+def is_date(date_str) -> bool:
+    return isinstance(date_str, str) and DATE_RE.fullmatch(date_str) is not None
+
+
+def check_date(date_str: str) -> str:
+    # Dates become file names under a history root; anything else (e.g. "../x") never reaches the filesystem.
+    if not is_date(date_str):
+        raise ValueError(f"无效的日期: {date_str!r}，应为 YYYY-MM-DD")
+    return date_str
+
+
+def segment_index_file(root: Path, date_str: str) -> Path:
+    return root / f"{check_date(date_str)}{INDEX_SUFFIX}"
+
+
+def archived_days(root: Path) -> List[str]:
+    return sorted(d for d in (f.name[:-len(INDEX_SUFFIX)] for f in root.glob(f"*{INDEX_SUFFIX}")) if is_date(d))
+
+
+class RootGuard:
+    # Shared by the HistoryStore writing a root and the compactor: appends, and the compactor's final
+    # check-and-unlink, run under `lock`; `busy` holds days with appends the store has not flushed yet.
+    def __init__(self):
+        self.lock = RLock()
+        self.busy: Set[str] = set()
+
+
+_GUARDS: Dict[str, RootGuard] = {}
+_GUARDS_LOCK = Lock()
+
+
+def root_guard(root: Path) -> RootGuard:
+    key = os.path.realpath(root)
+    with _GUARDS_LOCK:
+        guard = _GUARDS.get(key)
+        if guard is None:
+            guard = _GUARDS[key] = RootGuard()
+        return guard
+
+
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(f".{path.name}.{os.getpid()}.tmp")
+
+
+class Segment:
+    # An archived day: YYYY-MM-DD.jsonl.gz (or .xz) holding independently compressed blocks of whole lines,
+    # described by YYYY-MM-DD.blocks.json with one [raw offset, packed offset, packed length, first line]
+    # per block. Offsets are those of the original .jsonl, so message-index offsets and recall sizes stay
+    # valid; line numbers count non-empty lines, like the LineOffsets sidecar of a plain day file.
+    def __init__(self, index_file: Path, meta: Dict):
+        self.index_file = index_file
+        self.data_file = index_file.with_name(meta["file"])
+        self.codec = meta["codec"]
+        self.raw_size = int(meta["raw_size"])
+        self.lines = int(meta["lines"])
+        self.packed_size = int(meta.get("packed_size", 0))
+        blocks = meta["blocks"]
+        self.raw_starts = [int(b[0]) for b in blocks]
+        self.packed = [(int(b[1]), int(b[2])) for b in blocks]
+        self.first_lines = [int(b[3]) for b in blocks]
+        self._decompress = CODECS[self.codec][2]
+        self._cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = Lock()
+
+    @classmethod
+    def open(cls, index_file: Path) -> Optional["Segment"]:
+        # None when the day is not archived (or its index is unreadable).
+        try:
+            meta = json.loads(index_file.read_text(encoding="utf-8"))
+            return cls(index_file, meta)
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            return None
+
+    def _read_block(self, i: int) -> bytes:
+        start, length = self.packed[i]
+        with self.data_file.open("rb") as f:
+            f.seek(start)
+            return self._decompress(f.read(length))
+
+    def _block(self, i: int) -> bytes:
+        with self._lock:
+            data = self._cache.get(i)
+            if data is not None:
+                self._cache.move_to_end(i)
+                return data
+        data = self._read_block(i)
+        with self._lock:
+            self._cache[i] = data
+            while len(self._cache) > CACHED_BLOCKS:
+                self._cache.popitem(last=False)
+        return data
+
+    def read_line_at(self, offset: int) -> bytes:
+        # The line starting at raw byte `offset`; blocks end on line boundaries.
+        i = bisect.bisect_right(self.raw_starts, offset) - 1
+        if i < 0 or offset >= self.raw_size:
+            return b""
+        data = self._block(i)
+        start = offset - self.raw_starts[i]
+        end = data.find(b"\n", start)
+        return data[start:] if end < 0 else data[start:end + 1]
+
+    def iter_lines(self, start: int = 0) -> Iterator[Tuple[int, bytes]]:
+        # (raw offset, line) from raw offset `start`, which must be a line start, block by block.
+        i = max(0, bisect.bisect_right(self.raw_starts, start) - 1)
+        for j in range(i, len(self.raw_starts)):
+            data = self._block(j)
+            pos = self.raw_starts[j]
+            skip = max(0, start - pos)
+            while skip < len(data):
+                end = data.find(b"\n", skip)
+                end = len(data) if end < 0 else end + 1
+                yield pos + skip, data[skip:end]
+                skip = end
+
+    def read_lines(self, start: int, stop: int) -> List[bytes]:
+        # Non-empty lines [start, stop); only the blocks covering them are decompressed.
+        start = max(0, min(start, self.lines))
+        stop = max(start, min(stop, self.lines))
+        out: List[bytes] = []
+        i = max(0, bisect.bisect_right(self.first_lines, start) - 1)
+        while i < len(self.first_lines) and len(out) < stop - start:
+            rows = [line for line in self._block(i).split(b"\n") if line.strip()]
+            skip = max(0, start - self.first_lines[i])
+            out.extend(rows[skip:skip + stop - start - len(out)])
+            i += 1
+        return out
+
+    def iter_blocks(self) -> Iterator[bytes]:
+        # Whole-day reads bypass the block cache so they do not evict blocks that pages and searches reuse.
+        for i in range(len(self.packed)):
+            yield self._read_block(i)
+
+    def read_all(self) -> bytes:
+        return b"".join(self.iter_blocks())
+
+    def remove(self):
+        # The index goes first: without it the day no longer counts as archived.
+        self.index_file.unlink(missing_ok=True)
+        self.data_file.unlink(missing_ok=True)
+
+
+def _split_blocks(f, block_bytes: int) -> Iterator[Tuple[bytes, int]]:
+    # (block, number of non-empty lines); a block is cut after the line that reaches block_bytes.
+    buf: List[bytes] = []
+    size = lines = 0
+    for line in f:
+        buf.append(line)
+        size += len(line)
+        if line.strip():
+            lines += 1
+        if size >= block_bytes:
+            yield b"".join(buf), lines
+            buf, size, lines = [], 0, 0
+    if buf:
+        yield b"".join(buf), lines
+
+
+def _unchanged(src: Path, before: os.stat_result, size: int) -> bool:
+    after = src.stat()
+    return (after.st_size, after.st_mtime_ns) == (before.st_size, before.st_mtime_ns) and after.st_size == size
+
+
+def compact_day(root: Path, date_str: str, codec: str = DEFAULT_CODEC, block_bytes: int = BLOCK_BYTES) -> Dict:
+    # Compresses root/<date>.jsonl into a segment, verifies it by reading it back, then removes the .jsonl
+    # and its .idx sidecar. A day file that changes while being compacted is left as it is; the last check
+    # and the removal hold the root's guard lock, so an append cannot land in between.
+    if codec not in CODECS:
+        raise ValueError(f"未知的压缩格式: {codec}")
+    suffix, compress, decompress = CODECS[codec]
+    src = root / f"{date_str}.jsonl"
+    index_file = segment_index_file(root, date_str)
+    data_file = root / f"{date_str}{suffix}"
+    guard = root_guard(root)
+    before = src.stat()
+    done = Segment.open(index_file)
+    if done is not None and done.raw_size == before.st_size:
+        # An earlier run stopped after its commit point; only the cleanup is left.
+        with guard.lock:
+            if src.stat().st_size != done.raw_size:
+                raise RuntimeError(f"{src.name} 在压缩期间被修改")
+            src.with_suffix(".idx").unlink(missing_ok=True)
+            src.unlink()
+        return {"date": date_str, "raw_bytes": done.raw_size, "packed_bytes": done.packed_size,
+                "blocks": len(done.packed)}
+    blocks: List[List[int]] = []
+    raw_pos = packed_pos = lines = 0
+    digest = hashlib.sha1()
+    tmp_data = _tmp_path(data_file)
+    try:
+        with src.open("rb") as f, tmp_data.open("wb") as out:
+            for block, count in _split_blocks(f, max(1, block_bytes)):
+                packed = compress(block)
+                out.write(packed)
+                blocks.append([raw_pos, packed_pos, len(packed), lines])
+                digest.update(block)
+                raw_pos += len(block)
+                packed_pos += len(packed)
+                lines += count
+            out.flush()
+            os.fsync(out.fileno())
+        if not _unchanged(src, before, raw_pos):
+            raise RuntimeError(f"{src.name} 在压缩期间被修改")
+        check = hashlib.sha1()
+        with tmp_data.open("rb") as f:
+            for _, start, length, _ in blocks:
+                f.seek(start)
+                check.update(decompress(f.read(length)))
+        if check.digest() != digest.digest():
+            raise RuntimeError(f"{data_file.name} 校验失败")
+        os.replace(tmp_data, data_file)
+    finally:
+        tmp_data.unlink(missing_ok=True)
+
+    meta = {
+        "version": 1,
+        "codec": codec,
+        "file": data_file.name,
+        "raw_size": raw_pos,
+        "packed_size": packed_pos,
+        "lines": lines,
+        "sha1": digest.hexdigest(),
+        "blocks": blocks,
+    }
+    tmp_index = _tmp_path(index_file)
+    tmp_index.write_text(json.dumps(meta, separators=(",", ":")) + "\n", encoding="utf-8")
+    with guard.lock:
+        if not _unchanged(src, before, raw_pos):
+            tmp_index.unlink(missing_ok=True)
+            if not index_file.exists():
+                data_file.unlink(missing_ok=True)
+            raise RuntimeError(f"{src.name} 在压缩期间被修改")
+        # Commit point: once the index exists readers use the segment, so the plain files can go.
+        os.replace(tmp_index, index_file)
+        src.with_suffix(".idx").unlink(missing_ok=True)
+        src.unlink()
+    return {"date": date_str, "raw_bytes": raw_pos, "packed_bytes": packed_pos, "blocks": len(blocks)}
+
+
+def restore_day(root: Path, date_str: str) -> bool:
+    # Turns a segment back into a plain root/<date>.jsonl; False if the day is not archived.
+    segment = Segment.open(segment_index_file(root, date_str))
+    if segment is None:
+        return False
+    dst = root / f"{date_str}.jsonl"
+    if not dst.exists():
+        tmp = _tmp_path(dst)
+        try:
+            with tmp.open("wb") as out:
+                for block in segment.iter_blocks():
+                    out.write(block)
+            os.replace(tmp, dst)
+        finally:
+            tmp.unlink(missing_ok=True)
+    segment.remove()
+    return True
+
+
+def closed_days(root: Path, keep_days: int = DEFAULT_KEEP_DAYS, today: Optional[str] = None) -> List[str]:
+    # Days with a plain file older than the newest `keep_days` UTC days.
+    today = today or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    cutoff = (datetime.strptime(today, "%Y-%m-%d") - timedelta(days=max(1, keep_days) - 1)).strftime("%Y-%m-%d")
+    days = []
+    for file in sorted(root.glob(DAY_GLOB)):
+        if is_date(file.stem) and file.stem < cutoff:
+            days.append(file.stem)
+    return days
+
+
+def compact_root(root: Path, keep_days: int = DEFAULT_KEEP_DAYS, codec: str = DEFAULT_CODEC,
+                 block_bytes: int = BLOCK_BYTES) -> Dict:
+    report = {"root": str(root), "days": 0, "raw_bytes": 0, "packed_bytes": 0, "failed": {}}
+    if not root.is_dir():
+        return report
+    guard = root_guard(root)
+    for date_str in closed_days(root, keep_days):
+        if date_str in guard.busy:
+            # The store still has unflushed appends for the day; a later pass picks it up.
+            continue
+        try:
+            done = compact_day(root, date_str, codec, block_bytes)
+        except (OSError, RuntimeError) as exc:
+            report["failed"][date_str] = str(exc)
+            continue
+        report["days"] += 1
+        report["raw_bytes"] += done["raw_bytes"]
+        report["packed_bytes"] += done["packed_bytes"]
+    return report
+
+
+class ArchiveTask:
+    # Service-side compaction loop: one pass shortly after start, then every `interval` seconds.
+    # roots() is called on every pass so session directories created meanwhile are included.
+    def __init__(
+        self,
+        roots: Callable[[], Iterable[Path]],
+        keep_days: int = DEFAULT_KEEP_DAYS,
+        codec: str = DEFAULT_CODEC,
+        interval: float = DEFAULT_INTERVAL,
+    ):
+        if codec not in CODECS:
+            raise ValueError(f"未知的压缩格式: {codec}")
+        self.roots = roots
+        self.keep_days = keep_days
+        self.codec = codec
+        self.interval = max(1.0, interval)
+        self.last_reports: List[Dict] = []
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def run_once(self) -> List[Dict]:
+        reports = [compact_root(root, self.keep_days, self.codec) for root in self.roots()]
+        self.last_reports = reports
+        return reports
+
+    def _run(self):
+        delay = min(60.0, self.interval)
+        while not self._stop.wait(delay):
+            try:
+                self.run_once()
+            except Exception:
+                pass
+            delay = self.interval
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=5)
+
+
+def _format_bytes(n: int) -> str:
+    return f"{n / 1024 / 1024:.1f} MB" if n >= 1024 * 1024 else f"{n / 1024:.1f} KB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="军议历史归档工具（把已结束的日期文件压缩为分块段）")
+    sub = parser.add_subparsers(dest="command", required=True)
+    comp = sub.add_parser("compact", help="压缩已结束的日期文件")
+    comp.add_argument("--root", action="append", default=None, help="JSONL 历史目录，可重复；默认 data/history")
+    comp.add_argument("--sessions", action="store_true", help="同时处理 data/sessions/*/history")
+    comp.add_argument("--keep-days", type=int, default=DEFAULT_KEEP_DAYS, help="保留为明文的最近天数（按 UTC 日期）")
+    comp.add_argument("--codec", choices=sorted(CODECS), default=DEFAULT_CODEC, help="压缩格式")
+    rest = sub.add_parser("restore", help="把已归档的日期还原为 JSONL")
+    rest.add_argument("--root", default="data/history", help="JSONL 历史目录")
+    rest.add_argument("dates", nargs="+", help="要还原的日期 YYYY-MM-DD")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        roots = [Path(r) for r in (args.root or ["data/history"])]
+        if args.sessions:
+            roots.extend(sorted(Path("data/sessions").glob("*/history")))
+        for root in roots:
+            report = compact_root(root, args.keep_days, args.codec)
+            print(
+                f"{root}: 归档 {report['days']} 天，"
+                f"{_format_bytes(report['raw_bytes'])} -> {_format_bytes(report['packed_bytes'])}"
+            )
+            for date_str, error in report["failed"].items():
+                print(f"  {date_str} 失败：{error}")
+    elif args.command == "restore":
+        for date_str in args.dates:
+            ok = restore_day(Path(args.root), date_str)
+            print(f"{date_str}: {'已还原' if ok else '未归档，跳过'}")
+
+
+if __name__ == "__main__":
+    main()
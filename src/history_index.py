@@ -0,0 +1,569 @@
+#!/usr/bin/env python3
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+try:
+    from metrics import INDEX_REBUILD_SECONDS
+except ImportError:
+    from .metrics import INDEX_REBUILD_SECONDS
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Rough CPython cost of one term in a postings dict and of one (date -> tf) entry under it.
+TERM_BYTES = 300
+ENTRY_BYTES = 100
+# An append-only log is folded into its compacted file once it outgrows this share of it, within these bounds.
+COMPACT_RATIO = 4
+COMPACT_MIN_BYTES = 2 * 1024 * 1024
+COMPACT_MAX_BYTES = 16 * 1024 * 1024
+
+
+def _atomic_write_json(path: Path, data):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def bm25_top_dates(
+    postings: Dict[str, Dict[str, int]],
+    doc_len: Dict[str, int],
+    n_docs: int,
+    total_len: int,
+    terms: Iterable[str],
+    limit: int,
+) -> List[Tuple[float, str]]:
+    # doc_len only needs entries for dates that appear in postings.
+    if not n_docs or limit <= 0:
+        return []
+    avgdl = (total_len / n_docs) or 1.0
+    scores: Dict[str, float] = {}
+    for term in set(terms):
+        docs = postings.get(term)
+        if not docs:
+            continue
+        df = len(docs)
+        idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+        for date_str, tf in docs.items():
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len.get(date_str, 0) / avgdl)
+            scores[date_str] = scores.get(date_str, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+    # Ties on score fall back to the more recent date.
+    top = heapq.nlargest(limit, scores.items(), key=lambda kv: (kv[1], kv[0]))
+    return [(score, date_str) for date_str, score in top]
+
+
+class RecallIndex:
+    # Inverted index over each day's user-message tokens: term -> {date: term frequency}.
+    # `sizes` records how many bytes of each day file are indexed so stale days can catch up.
+    # Changes since the last snapshot go to `<name>.log` as `["add", date, {term: tf}, n]` and
+    # `["size", date, bytes]` lines, so a flush costs O(batch); the JSON snapshot is rewritten only when
+    # the log outgrows a share of it. Both carry a generation, and a log from another one is ignored,
+    # so a crash between rewriting the snapshot and resetting the log never counts a batch twice.
+    def __init__(self, file: Path):
+        self.file = file
+        self.log_file = file.with_suffix(".log")
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_len: Dict[str, int] = {}
+        self.sizes: Dict[str, int] = {}
+        self.total_len = 0
+        self.entries = 0
+        self.generation = 0
+        self._pending: List[str] = []
+        self._log_bytes = 0
+        self._snapshot_bytes = 0
+        self._rewrite = False
+        self._load()
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending) or self._rewrite
+
+    def _load(self):
+        if not self.file.exists():
+            return
+        try:
+            data = json.loads(self.file.read_text(encoding="utf-8"))
+        except Exception:
+            return
+        if not isinstance(data, dict):
+            return
+        self.postings = data.get("postings") or {}
+        self.doc_len = data.get("doc_len") or {}
+        self.sizes = data.get("sizes") or {}
+        self.generation = data.get("generation", 0)
+        self.total_len = sum(self.doc_len.values())
+        self.entries = sum(len(docs) for docs in self.postings.values())
+        self._snapshot_bytes = self.file.stat().st_size
+        self._replay()
+
+    def _replay(self):
+        try:
+            f = self.log_file.open("r", encoding="utf-8", errors="replace")
+        except OSError:
+            return
+        with f:
+            header = f.readline()
+            try:
+                if json.loads(header) != ["generation", self.generation]:
+                    return
+            except ValueError:
+                return
+            self._log_bytes = len(header)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    if record[0] == "add":
+                        self._add_counts(record[1], record[2], record[3])
+                    elif record[0] == "size":
+                        self._set_size(record[1], record[2])
+                except Exception:
+                    continue
+                self._log_bytes += len(line)
+
+    def reset(self):
+        self.postings = {}
+        self.doc_len = {}
+        self.sizes = {}
+        self.total_len = 0
+        self.entries = 0
+        self._pending = []
+        self._rewrite = True
+
+    def _add_counts(self, date_str: str, counts: Dict[str, int], n: int):
+        for term, tf in counts.items():
+            docs = self.postings.setdefault(term, {})
+            if date_str not in docs:
+                self.entries += 1
+            docs[date_str] = docs.get(date_str, 0) + tf
+        self.doc_len[date_str] = self.doc_len.get(date_str, 0) + n
+        self.total_len += n
+
+    def _set_size(self, date_str: str, size: int):
+        # A day with a known size is a document, even one without user tokens.
+        self.sizes[date_str] = size
+        self.doc_len.setdefault(date_str, 0)
+
+    def add(self, date_str: str, tokens: List[str]):
+        if not tokens:
+            self.doc_len.setdefault(date_str, 0)
+            return
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            term = token.lower()
+            counts[term] = counts.get(term, 0) + 1
+        self._add_counts(date_str, counts, len(tokens))
+        self._pending.append(json.dumps(["add", date_str, counts, len(tokens)], ensure_ascii=False))
+
+    def mark_size(self, date_str: str, size: int):
+        if self.sizes.get(date_str) != size:
+            self._set_size(date_str, size)
+            self._pending.append(json.dumps(["size", date_str, size]))
+
+    def memory_bytes(self) -> int:
+        return len(self.postings) * TERM_BYTES + (self.entries + len(self.doc_len) + len(self.sizes)) * ENTRY_BYTES
+
+    def top_dates(self, terms: Iterable[str], limit: int) -> List[Tuple[float, str]]:
+        terms = [t.lower() for t in terms]
+        return bm25_top_dates(self.postings, self.doc_len, len(self.doc_len), self.total_len, terms, limit)
+
+    def save(self):
+        if not self.dirty:
+            return
+        batch = "".join(line + "\n" for line in self._pending).encode("utf-8")
+        self._pending = []
+        limit = min(max(self._snapshot_bytes // COMPACT_RATIO, COMPACT_MIN_BYTES), COMPACT_MAX_BYTES)
+        if self._rewrite or not self._log_bytes or self._log_bytes + len(batch) > limit:
+            self._save_snapshot()
+            return
+        with self.log_file.open("ab") as f:
+            f.write(batch)
+        self._log_bytes += len(batch)
+
+    def _save_snapshot(self):
+        self.generation += 1
+        _atomic_write_json(self.file, {
+            "version": 1,
+            "generation": self.generation,
+            "postings": self.postings,
+            "doc_len": self.doc_len,
+            "sizes": self.sizes,
+        })
+        self._snapshot_bytes = self.file.stat().st_size
+        header = json.dumps(["generation", self.generation]) + "\n"
+        tmp = self.log_file.with_name(f".{self.log_file.name}.{os.getpid()}.tmp")
+        tmp.write_text(header, encoding="utf-8")
+        os.replace(tmp, self.log_file)
+        self._log_bytes = len(header)
+        self._rewrite = False
+
+
+_LATIN_RUN = re.compile(r"[a-z0-9]+")
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def _ngrams(run: str, n: int) -> List[str]:
+    if len(run) <= n:
+        return [run]
+    return [run[i:i + n] for i in range(len(run) - n + 1)]
+
+
+def message_terms(text: str) -> List[str]:
+    # Latin trigrams plus CJK bigrams, so any substring of a word or of unsegmented Chinese can be found.
+    lowered = (text or "").lower()
+    terms = set()
+    for run in _LATIN_RUN.findall(lowered):
+        if len(run) >= 2:
+            terms.update(_ngrams(run, 3))
+    for run in _CJK_RUN.findall(lowered):
+        terms.update(_ngrams(run, 2))
+    return sorted(terms)
+
+
+def query_terms(text: str) -> Tuple[List[str], List[str]]:
+    # Terms every match has indexed, plus fragments too short to be a term of their own (a 2-letter
+    # Latin run, a single CJK character): every match has some indexed term that contains each fragment.
+    # Single Latin letters constrain nothing; the caller's substring check covers them.
+    lowered = (text or "").lower()
+    terms, fragments = set(), set()
+    for run in _LATIN_RUN.findall(lowered):
+        if len(run) >= 3:
+            terms.update(_ngrams(run, 3))
+        elif len(run) == 2:
+            fragments.add(run)
+    for run in _CJK_RUN.findall(lowered):
+        if len(run) >= 2:
+            terms.update(_ngrams(run, 2))
+        else:
+            fragments.add(run)
+    return sorted(terms), sorted(fragments)
+
+
+# A posting packs the day as YYYYMMDD above a 36-bit byte offset, so keys sort by (date, offset).
+OFFSET_BITS = 36
+DIRECTORY_STRIDE = 64
+
+
+def posting_key(date_str: str, offset: int) -> int:
+    return int(date_str.replace("-", "")) << OFFSET_BITS | offset
+
+
+def posting_location(key: int) -> Tuple[str, int]:
+    ymd = key >> OFFSET_BITS
+    return f"{ymd // 10000:04d}-{ymd // 100 % 100:02d}-{ymd % 100:02d}", key & ((1 << OFFSET_BITS) - 1)
+
+
+class PostingsFile:
+    # Compacted message postings: every term's sorted uint64 keys back to back, then the sorted term
+    # table (`term<TAB>first<TAB>count` lines), then a JSON footer and its 8-byte length. Only the footer
+    # is loaded; it holds every DIRECTORY_STRIDE-th term, so a lookup reads one table block and one run.
+    ITEM = 8
+
+    def __init__(self, file: Path):
+        self.file = file
+        self.size = 0
+        self.last_offsets: Dict[str, int] = {}
+        self._directory: List[str] = []
+        self._positions: List[int] = []
+        self._table_end = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with self.file.open("rb") as f:
+                f.seek(-self.ITEM, os.SEEK_END)
+                footer_len = int.from_bytes(f.read(self.ITEM), "little")
+                f.seek(-self.ITEM - footer_len, os.SEEK_END)
+                self._table_end = f.tell()
+                meta = json.loads(f.read(footer_len).decode("utf-8"))
+                self.size = f.seek(0, os.SEEK_END)
+        except (OSError, ValueError):
+            return
+        if not isinstance(meta, dict) or meta.get("version") != 1:
+            return
+        self.last_offsets = meta.get("last_offsets") or {}
+        self._directory = [term for term, _ in meta.get("directory", [])]
+        self._positions = [pos for _, pos in meta.get("directory", [])]
+        self._table_end = meta.get("table_end", self._table_end)
+
+    def open(self):
+        return self.file.open("rb") if self._directory else None
+
+    def lookup(self, f, term: str) -> array:
+        keys = array("Q")
+        i = bisect.bisect_right(self._directory, term) - 1
+        if f is None or i < 0:
+            return keys
+        start = self._positions[i]
+        end = self._positions[i + 1] if i + 1 < len(self._positions) else self._table_end
+        f.seek(start)
+        wanted = term.encode("utf-8") + b"\t"
+        for line in f.read(end - start).split(b"\n"):
+            if line.startswith(wanted):
+                _, first, count = line.split(b"\t")
+                f.seek(int(first) * self.ITEM)
+                keys.frombytes(f.read(int(count) * self.ITEM))
+                break
+        return keys
+
+    def lookup_containing(self, f, fragment: str) -> array:
+        # Keys of every term that contains `fragment`; scans the term table, not the postings.
+        keys = array("Q")
+        if f is None:
+            return keys
+        f.seek(self._positions[0])
+        wanted = fragment.encode("utf-8")
+        spans = []
+        for line in f.read(self._table_end - self._positions[0]).split(b"\n"):
+            term, _, rest = line.partition(b"\t")
+            if wanted in term:
+                first, count = rest.split(b"\t")
+                spans.append((int(first), int(count)))
+        for first, count in spans:
+            f.seek(first * self.ITEM)
+            keys.frombytes(f.read(count * self.ITEM))
+        return keys
+
+    def runs(self) -> Iterator[Tuple[str, array]]:
+        # (term, keys) in term order, for merging; the table is read once, the runs sequentially.
+        f = self.open()
+        if f is None:
+            return
+        with f:
+            f.seek(self._positions[0])
+            table = f.read(self._table_end - self._positions[0]).split(b"\n")
+            f.seek(0)
+            for line in table:
+                if not line:
+                    continue
+                term, _, count = line.split(b"\t")
+                keys = array("Q")
+                keys.frombytes(f.read(int(count) * self.ITEM))
+                yield term.decode("utf-8"), keys
+
+    def write(self, runs: Iterable[Tuple[str, array]], last_offsets: Dict[str, int]):
+        tmp = self.file.with_name(f".{self.file.name}.{os.getpid()}.tmp")
+        table, directory = [], []
+        with tmp.open("wb") as out:
+            first = 0
+            for term, keys in runs:
+                keys.tofile(out)
+                table.append(f"{term}\t{first}\t{len(keys)}\n".encode("utf-8"))
+                first += len(keys)
+            pos = out.tell()
+            for i, line in enumerate(table):
+                if i % DIRECTORY_STRIDE == 0:
+                    directory.append([line.split(b"\t", 1)[0].decode("utf-8"), pos])
+                pos += len(line)
+            out.write(b"".join(table))
+            footer = json.dumps({
+                "version": 1,
+                "table_end": pos,
+                "directory": directory,
+                "last_offsets": last_offsets,
+            }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            out.write(footer)
+            out.write(len(footer).to_bytes(self.ITEM, "little"))
+        os.replace(tmp, self.file)
+        self._load()
+
+
+class MessageIndex:
+    # Message-level postings: term -> [(date, byte offset of the line in the day file)].
+    # New postings are appended to a log of `[date, offset, [terms...]]` lines, so each flush costs
+    # O(batch); only the log is replayed on open. Once it outgrows the compacted PostingsFile beside it,
+    # the two are merged and the log truncated, so memory and open time stay bounded by the log.
+    def __init__(self, file: Path):
+        self.file = file
+        self.base = PostingsFile(file.with_suffix(".dat"))
+        self.last_offsets: Dict[str, int] = dict(self.base.last_offsets)
+        self._tail: Dict[str, array] = {}
+        self._tail_keys = 0
+        self._tail_bytes = 0
+        self._pending: List[str] = []
+        self._load()
+
+    def _load(self):
+        if not self.file.exists():
+            return
+        compacted = False
+        with self.file.open("r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    date_str, offset, terms = json.loads(line)
+                except Exception:
+                    continue
+                self._index(date_str, int(offset), terms)
+                self._tail_bytes += len(line)
+                if self._tail_bytes > self._compact_threshold():
+                    # An oversized log is folded in as it is read; it is only truncated once fully merged.
+                    self._merge()
+                    compacted = True
+        if compacted:
+            self._compact()
+
+    def _index(self, date_str: str, offset: int, terms: List[str]):
+        key = posting_key(date_str, offset)
+        for term in terms:
+            keys = self._tail.get(term)
+            if keys is None:
+                keys = self._tail[term] = array("Q")
+            keys.append(key)
+        self._tail_keys += len(terms)
+        if offset > self.last_offsets.get(date_str, -1):
+            self.last_offsets[date_str] = offset
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._pending)
+
+    def memory_bytes(self) -> int:
+        # The compacted postings stay on disk; only the log tail and the directory are held.
+        directory = len(self.base._directory) + len(self.last_offsets)
+        return len(self._tail) * TERM_BYTES + self._tail_keys * PostingsFile.ITEM + directory * ENTRY_BYTES
+
+    def add(self, date_str: str, offset: int, text: str):
+        terms = message_terms(text)
+        self._index(date_str, offset, terms)
+        line = json.dumps([date_str, offset, terms], ensure_ascii=False)
+        self._pending.append(line)
+        self._tail_bytes += len(line) + 1
+
+    def candidates(self, terms: List[str], fragments: Iterable[str] = ()) -> List[Tuple[str, int]]:
+        # Messages holding every term and, for each fragment, some term that contains it.
+        groups = [(term, False) for term in sorted(set(terms))] + [(frag, True) for frag in sorted(set(fragments))]
+        if not groups:
+            return []
+        hits = None
+        f = self.base.open()
+        try:
+            for term, fragment in groups:
+                if fragment:
+                    keys = set(self.base.lookup_containing(f, term))
+                    for name, more in self._tail.items():
+                        if term in name:
+                            keys.update(more)
+                else:
+                    keys = set(self.base.lookup(f, term))
+                    keys.update(self._tail.get(term, ()))
+                hits = keys if hits is None else hits & keys
+                if not hits:
+                    return []
+        finally:
+            if f is not None:
+                f.close()
+        return [posting_location(key) for key in sorted(hits, reverse=True)]
+
+    def save(self):
+        if not self._pending:
+            return
+        with self.file.open("a", encoding="utf-8") as f:
+            f.write("\n".join(self._pending) + "\n")
+        self._pending = []
+        if self._tail_bytes > self._compact_threshold():
+            self._compact()
+
+    def _compact_threshold(self) -> int:
+        return min(max(self.base.size // COMPACT_RATIO, COMPACT_MIN_BYTES), COMPACT_MAX_BYTES)
+
+    def _merge(self):
+        started = time.perf_counter()
+        tail, self._tail, self._tail_keys, self._tail_bytes = self._tail, {}, 0, 0
+
+        def merged():
+            extra = sorted(tail)
+            i = 0
+            for term, keys in self.base.runs():
+                while i < len(extra) and extra[i] < term:
+                    yield extra[i], array("Q", sorted(set(tail[extra[i]])))
+                    i += 1
+                if i < len(extra) and extra[i] == term:
+                    keys = array("Q", sorted(set(keys).union(tail[term])))
+                    i += 1
+                yield term, keys
+            for term in extra[i:]:
+                yield term, array("Q", sorted(set(tail[term])))
+
+        self.base.write(merged(), self.last_offsets)
+        INDEX_REBUILD_SECONDS.observe(time.perf_counter() - started, index="message_compact")
+
+    def _compact(self):
+        # Merge first, truncate after: a crash in between only replays postings the merge deduplicates.
+        self._merge()
+        with self.file.open("w", encoding="utf-8"):
+            pass
+        self._pending = []
+
+
+class LineOffsets:
+    # Sidecar `YYYY-MM-DD.idx` next to a day file: packed uint64 start offsets of every
+    # non-empty line, followed by the number of bytes covered. Pages cost O(limit).
+    ITEM = 8
+
+    def __init__(self, day_file: Path):
+        self.day_file = day_file
+        self.file = day_file.with_suffix(".idx")
+
+    def _covered(self) -> int:
+        if not self.file.exists() or self.file.stat().st_size < self.ITEM:
+            return -1
+        with self.file.open("rb") as f:
+            f.seek(-self.ITEM, os.SEEK_END)
+            return int.from_bytes(f.read(self.ITEM), "little")
+
+    def ensure(self) -> int:
+        # Day files are append-only: only bytes past the covered end are scanned. A trailing line without
+        # its newline is still being written, so coverage stops before it and the next call picks it up.
+        if not self.day_file.exists():
+            return 0
+        size = self.day_file.stat().st_size
+        covered = self._covered()
+        if covered > size:
+            self.file.unlink()
+            covered = -1
+        if covered == size:
+            return self.count()
+
+        started = time.perf_counter()
+        start = max(covered, 0)
+        offsets = array("Q")
+        with self.day_file.open("rb") as f:
+            f.seek(start)
+            pos = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                if line.strip():
+                    offsets.append(pos)
+                pos += len(line)
+        if pos == covered:
+            return self.count()
+        offsets.append(pos)
+        mode = "r+b" if covered >= 0 else "wb"
+        with self.file.open(mode) as f:
+            if covered >= 0:
+                f.seek(-self.ITEM, os.SEEK_END)
+            offsets.tofile(f)
+        INDEX_REBUILD_SECONDS.observe(time.perf_counter() - started, index="line_offsets")
+        return self.count()
+
+    def count(self) -> int:
+        if not self.file.exists():
+            return 0
+        return max(0, self.file.stat().st_size // self.ITEM - 1)
+
+    def read(self, start: int, stop: int) -> List[int]:
+        # Start offsets for lines [start, stop) plus the end of the last one.
+        total = self.count()
+        start = max(0, min(start, total))
+        stop = max(start, min(stop, total))
+        bounds = array("Q")
+        with self.file.open("rb") as f:
+            f.seek(start * self.ITEM)
+            bounds.frombytes(f.read((stop - start + 1) * self.ITEM))
+        return bounds.tolist()
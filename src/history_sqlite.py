@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import sqlite3
+from collections import Counter
+from pathlib import Path
+from threading import RLock
+from typing import Dict, List
+try:
+    from history_archive import DAY_GLOB, archived_days, is_date
+    from history_index import bm25_top_dates, message_terms
+    from history_store import DAY_PAGE_SIZE, SEARCH_PAGE_SIZE, HistoryStoreBase, _safe_read_json, read_day
+    from metrics import APPEND_SECONDS
+except ImportError:
+    from .history_archive import DAY_GLOB, archived_days, is_date
+    from .history_index import bm25_top_dates, message_terms
+    from .history_store import DAY_PAGE_SIZE, SEARCH_PAGE_SIZE, HistoryStoreBase, _safe_read_json, read_day
+    from .metrics import APPEND_SECONDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    date TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT '',
+    speaker TEXT NOT NULL DEFAULT '',
+    text TEXT NOT NULL DEFAULT '',
+    time TEXT NOT NULL DEFAULT '',
+    raw TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages(date, id);
+CREATE INDEX IF NOT EXISTS idx_messages_speaker ON messages(speaker, date, id);
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    topic_counts TEXT NOT NULL DEFAULT '{}',
+    doc_len INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS day_terms (
+    term TEXT NOT NULL,
+    date TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, date)
+) WITHOUT ROWID;
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, content='messages', content_rowid='id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+# The trigram tokenizer needs at least three characters per phrase.
+FTS_MIN_CHARS = 3
+
+
+class SqliteHistoryStore(HistoryStoreBase):
+    # Same public surface as HistoryStore, stored in one WAL-mode SQLite file so several
+    # server processes can write safely.
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = RLock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        try:
+            self.conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # Builds without FTS5/trigram fall back to instr() scans.
+            self.has_fts = False
+
+    def append_messages(self, messages: List[Dict]):
+        if not messages:
+            return
+
+        grouped: Dict[str, List[Dict]] = {}
+        for msg in messages:
+            grouped.setdefault(self._extract_date(msg.get("time", "")), []).append(msg)
+
+        with self._lock, APPEND_SECONDS.time(backend="sqlite"):
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for date_str, items in grouped.items():
+                    self._insert_day(date_str, items)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _insert_day(self, date_str: str, items: List[Dict], updated_at: str = ""):
+        self.conn.executemany(
+            "INSERT INTO messages(date, role, speaker, text, time, raw) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    date_str,
+                    str(item.get("role", "")),
+                    str(item.get("speaker", "")),
+                    str(item.get("text", "") or ""),
+                    str(item.get("time", "")),
+                    json.dumps(item, ensure_ascii=False),
+                )
+                for item in items
+            ],
+        )
+
+        row = self.conn.execute("SELECT meta, topic_counts, doc_len FROM days WHERE date = ?", (date_str,)).fetchone()
+        stats = self._new_day_stats()
+        doc_len = 0
+        if row:
+            meta = json.loads(row[0])
+            stats["topic_counts"] = Counter(json.loads(row[1]))
+            stats["highlights"] = list(meta.get("highlights", []))
+            stats["turns"] = int(meta.get("turns", 0))
+            stats["messages"] = int(meta.get("messages", 0))
+            doc_len = int(row[2])
+
+        term_counts: Counter = Counter()
+        for tokens in self._accumulate(stats, items):
+            term_counts.update(t.lower() for t in tokens)
+            doc_len += len(tokens)
+        meta = self._day_meta(stats)
+        if updated_at:
+            meta["updated_at"] = updated_at
+
+        self.conn.execute(
+            "INSERT INTO days(date, meta, topic_counts, doc_len) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(date) DO UPDATE SET meta = excluded.meta, topic_counts = excluded.topic_counts, "
+            "doc_len = excluded.doc_len",
+            (
+                date_str,
+                json.dumps(meta, ensure_ascii=False),
+                json.dumps(stats["topic_counts"], ensure_ascii=False),
+                doc_len,
+            ),
+        )
+        self.conn.executemany(
+            "INSERT INTO day_terms(term, date, tf) VALUES (?, ?, ?) "
+            "ON CONFLICT(term, date) DO UPDATE SET tf = tf + excluded.tf",
+            [(term, date_str, tf) for term, tf in term_counts.items()],
+        )
+
+    def flush(self):
+        return
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def load_date_history(self, date_str: str) -> List[Dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT raw FROM messages WHERE date = ? ORDER BY id", (date_str,)).fetchall()
+        return [json.loads(raw) for (raw,) in rows]
+
+    def load_date_page(self, date_str: str, cursor: int = 0, limit: int = DAY_PAGE_SIZE) -> Dict:
+        with self._lock:
+            total = self._count_date(date_str)
+            cursor = max(0, min(cursor, total))
+            stop = min(total, cursor + max(1, limit))
+            rows = self.conn.execute(
+                "SELECT raw FROM messages WHERE date = ? ORDER BY id LIMIT ? OFFSET ?",
+                (date_str, stop - cursor, cursor),
+            ).fetchall()
+        return self._page(date_str, [json.loads(raw) for (raw,) in rows], cursor, stop, total)
+
+    def load_date_tail(self, date_str: str, limit: int = DAY_PAGE_SIZE) -> Dict:
+        with self._lock:
+            total = self._count_date(date_str)
+            limit = max(1, limit)
+            rows = self.conn.execute(
+                "SELECT raw FROM messages WHERE date = ? ORDER BY id DESC LIMIT ?",
+                (date_str, limit),
+            ).fetchall()
+        messages = [json.loads(raw) for (raw,) in reversed(rows)]
+        return self._page(date_str, messages, total - len(messages), total, total)
+
+    def _count_date(self, date_str: str) -> int:
+        # Counted from the rows themselves: page bounds must match what SELECT ... OFFSET can return.
+        return self.conn.execute("SELECT COUNT(*) FROM messages WHERE date = ?", (date_str,)).fetchone()[0]
+
+    def list_dates(self) -> List[Dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT date, meta FROM days ORDER BY date DESC").fetchall()
+        items = []
+        for date_str, meta in rows:
+            row = {"date": date_str}
+            row.update(json.loads(meta))
+            items.append(row)
+        return items
+
+    def search_messages(
+        self,
+        query: str,
+        speaker: str = "",
+        date_from: str = "",
+        date_to: str = "",
+        limit: int = SEARCH_PAGE_SIZE,
+        cursor: int = 0,
+    ) -> Dict:
+        parts = [p for p in (query or "").lower().split() if p]
+        limit = max(1, limit)
+        cursor = max(0, cursor)
+        result = {"query": query, "results": [], "next_cursor": None}
+        if not any(message_terms(p) for p in parts):
+            return result
+
+        clauses, params = [], []
+        long_parts = [p for p in parts if len(p) >= FTS_MIN_CHARS]
+        if self.has_fts and long_parts:
+            phrase = " AND ".join('"' + p.replace('"', '""') + '"' for p in long_parts)
+            clauses.append("m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append(phrase)
+        for p in parts:
+            clauses.append("instr(lower(m.text), ?) > 0")
+            params.append(p)
+        if speaker:
+            clauses.append("m.speaker = ?")
+            params.append(speaker)
+        if date_from:
+            clauses.append("m.date >= ?")
+            params.append(date_from)
+        if date_to:
+            clauses.append("m.date <= ?")
+            params.append(date_to)
+
+        sql = (
+            "SELECT m.id, m.date, m.role, m.speaker, m.time, m.text FROM messages m "
+            f"WHERE {' AND '.join(clauses)} ORDER BY m.date DESC, m.id DESC LIMIT ? OFFSET ?"
+        )
+        with self._lock:
+            rows = self.conn.execute(sql, params + [limit + 1, cursor]).fetchall()
+
+        for msg_id, date_str, role, who, time, text in rows[:limit]:
+            result["results"].append({
+                "date": date_str,
+                "offset": msg_id,
+                "role": role,
+                "speaker": who,
+                "time": time,
+                "snippet": self._snippet(text, text.lower().find(parts[0]), len(parts[0])),
+            })
+        if len(rows) > limit:
+            result["next_cursor"] = cursor + limit
+        return result
+
+    def recall_rows_for_query(self, query: str, limit: int = 3) -> List[Dict]:
+        terms = sorted({t.lower() for t in self._extract_tokens(query)})
+        picked = []
+        with self._lock:
+            if terms:
+                marks = ",".join("?" for _ in terms)
+                postings: Dict[str, Dict[str, int]] = {}
+                for term, date_str, tf in self.conn.execute(
+                    f"SELECT term, date, tf FROM day_terms WHERE term IN ({marks})", terms
+                ):
+                    postings.setdefault(term, {})[date_str] = tf
+                dates = sorted({d for docs in postings.values() for d in docs})
+                doc_len = {}
+                if dates:
+                    marks = ",".join("?" for _ in dates)
+                    doc_len = dict(self.conn.execute(f"SELECT date, doc_len FROM days WHERE date IN ({marks})", dates))
+                n_docs, total_len = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(doc_len), 0) FROM days").fetchone()
+                picked = [d for _, d in bm25_top_dates(postings, doc_len, n_docs, total_len, terms, limit)]
+            # Top up with the most recent days, as the JSONL store does.
+            if len(picked) < limit:
+                for (date_str,) in self.conn.execute("SELECT date FROM days ORDER BY date DESC LIMIT ?", (limit,)):
+                    if date_str not in picked:
+                        picked.append(date_str)
+                    if len(picked) >= limit:
+                        break
+            metas = {}
+            if picked:
+                marks = ",".join("?" for _ in picked)
+                metas = dict(self.conn.execute(f"SELECT date, meta FROM days WHERE date IN ({marks})", picked))
+
+        rows = []
+        for date_str in picked:
+            row = {"date": date_str}
+            row.update(json.loads(metas.get(date_str, "{}")))
+            rows.append(row)
+        return rows
+
+    def has_date(self, date_str: str) -> bool:
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM messages WHERE date = ? LIMIT 1", (date_str,)).fetchone() is not None
+
+    def import_day(self, date_str: str, rows: List[Dict], updated_at: str = ""):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._insert_day(date_str, rows, updated_at)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+
+def migrate(root: Path, db_path: Path) -> Dict:
+    # One-shot import of data/history/*.jsonl (archived days included) and index.json; days already in the
+    # database are skipped, and so are index.json days whose messages are gone (a days row without
+    # rows would list a day whose pages are empty).
+    index = (_safe_read_json(root / "index.json") or {}).get("dates", {})
+    store = SqliteHistoryStore(db_path)
+    report = {"days": 0, "messages": 0, "skipped": 0, "meta_only": 0}
+    try:
+        seen = set()
+        plain = {f.stem for f in root.glob(DAY_GLOB) if is_date(f.stem)}
+        for date_str in sorted(plain | set(archived_days(root))):
+            seen.add(date_str)
+            if store.has_date(date_str):
+                report["skipped"] += 1
+                continue
+            rows = read_day(root, date_str)
+            meta = index.get(date_str) if isinstance(index.get(date_str), dict) else {}
+            store.import_day(date_str, rows, updated_at=meta.get("updated_at", ""))
+            report["days"] += 1
+            report["messages"] += len(rows)
+        report["meta_only"] = sum(1 for date_str in index if date_str not in seen)
+    finally:
+        store.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="军议历史 SQLite 存储工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="把 JSONL 历史与 index.json 导入 SQLite")
+    mig.add_argument("--root", default="data/history", help="JSONL 历史目录")
+    mig.add_argument("--db", default="data/history.sqlite3", help="SQLite 数据库文件")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        report = migrate(Path(args.root), Path(args.db))
+        print(
+            f"导入完成：{report['days']} 天 / {report['messages']} 条消息；"
+            f"跳过已存在 {report['skipped']} 天；未导入仅有摘要的 {report['meta_only']} 天"
+        )
+
+
+if __name__ == "__main__":
+    main()
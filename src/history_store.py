@@ -1,10 +1,33 @@
 #!/usr/bin/env python3
+import heapq
 import json
+import os
 import re
 from collections import Counter
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List
+from threading import Timer
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+try:
+    from history_archive import (
+        DAY_GLOB, Segment, archived_days, check_date, is_date, restore_day, root_guard, segment_index_file,
+    )
+    from history_index import LineOffsets, MessageIndex, RecallIndex, message_terms, query_terms
+    from metrics import APPEND_SECONDS, INDEX_REBUILD_SECONDS
+except ImportError:
+    from .history_archive import (
+        DAY_GLOB, Segment, archived_days, check_date, is_date, restore_day, root_guard, segment_index_file,
+    )
+    from .history_index import LineOffsets, MessageIndex, RecallIndex, message_terms, query_terms
+    from .metrics import APPEND_SECONDS, INDEX_REBUILD_SECONDS
+
+INDEX_FLUSH_INTERVAL = 2.0
+HIGHLIGHT_COUNT = 5
+SEARCH_PAGE_SIZE = 20
+DAY_PAGE_SIZE = 100
+SNIPPET_RADIUS = 40
+# Rough size of one day's index.json entry (topics, summary, counters) held in memory.
+DAY_META_BYTES = 600
 
 
 def _safe_read_json(path: Path):
@@ -16,65 +39,39 @@ def _safe_read_json(path: Path):
         return None
 
 
-class HistoryStore:
-    def __init__(self, root: Path):
-        self.root = root
-        self.root.mkdir(parents=True, exist_ok=True)
-        self.index_file = self.root / "index.json"
-        self.index = _safe_read_json(self.index_file) or {"dates": {}}
-
-    def _date_file(self, date_str: str) -> Path:
-        return self.root / f"{date_str}.jsonl"
+def read_jsonl(file: Path) -> List[Dict]:
+    if not file.exists():
+        return []
+    return parse_jsonl(file.read_text(encoding="utf-8"))
 
-    def append_messages(self, messages: List[Dict]):
-        if not messages:
-            return
-
-        grouped: Dict[str, List[Dict]] = {}
-        for msg in messages:
-            t = msg.get("time", "")
-            date_str = self._extract_date(t)
-            grouped.setdefault(date_str, []).append(msg)
 
-        for date_str, items in grouped.items():
-            file = self._date_file(date_str)
-            with file.open("a", encoding="utf-8") as f:
-                for item in items:
-                    f.write(json.dumps(item, ensure_ascii=False) + "\n")
-            self._rebuild_index_for_date(date_str)
+def parse_jsonl(text: str) -> List[Dict]:
+    rows = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+            if isinstance(obj, dict):
+                rows.append(obj)
+        except Exception:
+            continue
+    return rows
 
-        self._save_index()
 
-    def load_date_history(self, date_str: str) -> List[Dict]:
-        file = self._date_file(date_str)
-        if not file.exists():
-            return []
-        rows = []
-        for line in file.read_text(encoding="utf-8").splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                obj = json.loads(line)
-                if isinstance(obj, dict):
-                    rows.append(obj)
-            except Exception:
-                continue
-        return rows
+def read_day(root: Path, date_str: str) -> List[Dict]:
+    # Rows of a plain or archived day under root, without opening a HistoryStore.
+    segment = Segment.open(segment_index_file(root, date_str))
+    if segment is not None:
+        return parse_jsonl(segment.read_all().decode("utf-8"))
+    return read_jsonl(root / f"{check_date(date_str)}.jsonl")
 
-    def load_today_history(self) -> List[Dict]:
-        today = datetime.now().strftime("%Y-%m-%d")
-        return self.load_date_history(today)
 
+class HistoryStoreBase:
+    # Backend-independent pieces shared by the JSONL and SQLite stores.
     def list_dates(self) -> List[Dict]:
-        items = []
-        for date_str, meta in self.index.get("dates", {}).items():
-            row = {"date": date_str}
-            if isinstance(meta, dict):
-                row.update(meta)
-            items.append(row)
-        items.sort(key=lambda x: x.get("date", ""), reverse=True)
-        return items
+        raise NotImplementedError
 
     def search_dates(self, query: str) -> List[Dict]:
         q = (query or "").strip().lower()
@@ -90,52 +87,81 @@ class HistoryStore:
                 results.append(row)
         return results
 
+    def memory_bytes(self) -> int:
+        # Estimated memory held by the store's indexes, counted against the session memory budget.
+        return 0
+
+    def recall_rows_for_query(self, query: str, limit: int = 3) -> List[Dict]:
+        # Index rows ({"date", "topics", "summary", ...}) of the days most relevant to the query.
+        raise NotImplementedError
+
     def recall_notes_for_query(self, query: str, limit: int = 3) -> str:
-        query_tokens = self._extract_tokens(query)
-        if not query_tokens:
-            ranked = self.list_dates()[:limit]
-        else:
-            ranked = sorted(
-                self.list_dates(),
-                key=lambda row: self._score_row(row, query_tokens),
-                reverse=True,
-            )[:limit]
+        return self.format_notes(self.recall_rows_for_query(query, limit))
 
+    def format_notes(self, rows: List[Dict]) -> str:
         lines = []
-        for row in ranked:
+        for row in rows:
             topics = "、".join(row.get("topics", [])[:6]) or "无"
             summary = row.get("summary", "无摘要")
             lines.append(f"- {row.get('date')}: 话题[{topics}]；摘要：{summary}")
         return "\n".join(lines)
 
-    def _score_row(self, row: Dict, query_tokens: List[str]) -> int:
-        score = 0
-        topics = [x.lower() for x in row.get("topics", []) if isinstance(x, str)]
-        summary = (row.get("summary", "") or "").lower()
-        for token in query_tokens:
-            if token.lower() in topics:
-                score += 5
-            if token.lower() in summary:
-                score += 2
-        # Prefer recent rows when score ties.
-        return score
-
-    def _rebuild_index_for_date(self, date_str: str):
-        rows = self.load_date_history(date_str)
-        user_texts = [x.get("text", "") for x in rows if x.get("role") == "user"]
-        topics = self._extract_top_topics("\n".join(user_texts), topn=8)
-        highlights = [self._shorten(x) for x in user_texts[:5]]
-        summary = self._build_summary(topics, highlights)
-
-        self.index.setdefault("dates", {})[date_str] = {
+    def load_today_history(self) -> List[Dict]:
+        today = datetime.now().strftime("%Y-%m-%d")
+        return self.load_date_history(today)
+
+    def load_today_tail(self, limit: int) -> Dict:
+        # Page of the newest `limit` messages of today; sessions start from this rather than the whole day.
+        return self.load_date_tail(datetime.now().strftime("%Y-%m-%d"), limit)
+
+    def _page(self, date_str: str, messages: List[Dict], cursor: int, stop: int, total: int) -> Dict:
+        return {
+            "date": date_str,
+            "history": messages,
+            "cursor": cursor,
+            "next_cursor": stop if stop < total else None,
+            "total": total,
+        }
+
+    def _new_day_stats(self) -> Dict:
+        return {"topic_counts": Counter(), "highlights": [], "turns": 0, "messages": 0}
+
+    def _accumulate(self, stats: Dict, rows: List[Dict]) -> List[List[str]]:
+        # Folds rows into running day stats; returns the tokens of each user message.
+        user_tokens = []
+        for row in rows:
+            stats["messages"] += 1
+            if row.get("role") != "user":
+                continue
+            text = row.get("text", "")
+            tokens = self._extract_tokens(text)
+            user_tokens.append(tokens)
+            stats["turns"] += 1
+            stats["topic_counts"].update(tokens)
+            if len(stats["highlights"]) < HIGHLIGHT_COUNT:
+                stats["highlights"].append(self._shorten(text))
+        return user_tokens
+
+    def _day_meta(self, stats: Dict) -> Dict:
+        topics = [k for k, _ in stats["topic_counts"].most_common(8)]
+        highlights = list(stats["highlights"])
+        return {
             "topics": topics,
-            "summary": summary,
+            "summary": self._build_summary(topics, highlights),
             "highlights": highlights,
-            "turns": len(user_texts),
-            "messages": len(rows),
+            "turns": stats["turns"],
+            "messages": stats["messages"],
             "updated_at": datetime.now().isoformat(),
         }
 
+    def _snippet(self, text: str, pos: int, length: int) -> str:
+        flat = text.replace("\n", " ")
+        start = max(0, pos - SNIPPET_RADIUS)
+        end = min(len(flat), pos + length + SNIPPET_RADIUS)
+        prefix = "..." if start > 0 else ""
+        suffix = "..." if end < len(flat) else ""
+        return f"{prefix}{flat[start:end]}{suffix}"
+
     def _build_summary(self, topics: List[str], highlights: List[str]) -> str:
         topic_text = "、".join(topics[:5]) if topics else "未提取到明显主题"
         if highlights:
@@ -177,9 +203,366 @@ class HistoryStore:
             return t
         return t[:n] + "..."
 
+
+class HistoryStore(HistoryStoreBase):
+    def __init__(self, root: Path, flush_interval: float = INDEX_FLUSH_INTERVAL):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.root / "index.json"
+        self.index = _safe_read_json(self.index_file) or {"dates": {}}
+        self.flush_interval = flush_interval
+        # date -> (index mtime, Segment) for days compacted by history_archive.
+        self._segments: Dict[str, Tuple[int, Segment]] = {}
+        # Running per-day counters so appends only tokenize the new messages.
+        self._day_stats: Dict[str, Dict] = {}
+        # Shared with the background compactor, which must not remove a day file between two appends.
+        self._guard = root_guard(self.root)
+        self._lock = self._guard.lock
+        self._unflushed = set()
+        self._dirty = False
+        self._flush_timer = None
+        self.recall = RecallIndex(self.root / "recall_index.json")
+        with INDEX_REBUILD_SECONDS.time(index="recall"):
+            self._sync_recall_index()
+        self.messages_index = MessageIndex(self.root / "message_index.log")
+        with INDEX_REBUILD_SECONDS.time(index="message"):
+            self._sync_message_index()
+
+    def _date_file(self, date_str: str) -> Path:
+        return self.root / f"{check_date(date_str)}.jsonl"
+
+    def _segment(self, date_str: str) -> Optional[Segment]:
+        # Readers check for a segment before the plain file: compaction commits the segment index
+        # before it removes the .jsonl, so one of the two is always there.
+        index_file = segment_index_file(self.root, date_str)
+        try:
+            mtime = index_file.stat().st_mtime_ns
+        except OSError:
+            self._segments.pop(date_str, None)
+            return None
+        cached = self._segments.get(date_str)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        segment = Segment.open(index_file)
+        if segment is not None:
+            self._segments[date_str] = (mtime, segment)
+        return segment
+
+    def _day_sizes(self) -> Dict[str, int]:
+        # date -> bytes of the day as written, for plain day files and archived segments alike.
+        sizes = {}
+        for date_str in archived_days(self.root):
+            segment = self._segment(date_str)
+            if segment is not None:
+                sizes[date_str] = segment.raw_size
+        for file in self.root.glob(DAY_GLOB):
+            if is_date(file.stem) and file.stem not in sizes:
+                sizes[file.stem] = file.stat().st_size
+        return sizes
+
+    def _iter_day_lines(self, date_str: str, start: int = 0) -> Iterator[Tuple[int, bytes]]:
+        # (byte offset, line) of a day from offset `start`, which must be a line start.
+        segment = self._segment(date_str)
+        if segment is not None:
+            yield from segment.iter_lines(start)
+            return
+        with self._date_file(date_str).open("rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                yield offset, line
+                offset += len(line)
+
+    def append_messages(self, messages: List[Dict]):
+        if not messages:
+            return
+
+        grouped: Dict[str, List[Dict]] = {}
+        for msg in messages:
+            t = msg.get("time", "")
+            date_str = self._extract_date(t)
+            grouped.setdefault(date_str, []).append(msg)
+
+        with self._lock, APPEND_SECONDS.time(backend="jsonl"):
+            self._guard.busy.update(grouped)
+            self._unflushed.update(grouped)
+            for date_str, items in grouped.items():
+                if self._segment(date_str) is not None:
+                    # Late messages for an archived day: unpack it so the day stays a single appendable file.
+                    restore_day(self.root, date_str)
+                    self._segments.pop(date_str, None)
+                # Seed from disk before writing so the new batch is not counted twice.
+                stats = self._stats_for_date(date_str)
+                file = self._date_file(date_str)
+                with file.open("ab") as f:
+                    offset = f.tell()
+                    for item in items:
+                        line = (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8")
+                        f.write(line)
+                        self.messages_index.add(date_str, offset, item.get("text", ""))
+                        offset += len(line)
+                for tokens in self._accumulate(stats, items):
+                    self.recall.add(date_str, tokens)
+                self.recall.mark_size(date_str, file.stat().st_size)
+                self._publish_index_for_date(date_str)
+            self._schedule_flush()
+
+    def flush(self):
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            self.recall.save()
+            self.messages_index.save()
+            if self._dirty:
+                self._save_index()
+                self._dirty = False
+            self._guard.busy.difference_update(self._unflushed)
+            self._unflushed.clear()
+
+    def close(self):
+        self.flush()
+
+    def memory_bytes(self) -> int:
+        days = len(self.index.get("dates", {})) + len(self._day_stats)
+        return self.recall.memory_bytes() + self.messages_index.memory_bytes() + days * DAY_META_BYTES
+
+    def load_date_history(self, date_str: str) -> List[Dict]:
+        segment = self._segment(date_str)
+        if segment is not None:
+            return parse_jsonl(segment.read_all().decode("utf-8"))
+        return read_jsonl(self._date_file(date_str))
+
+    def _parse_lines(self, lines: Iterable[bytes]) -> List[Dict]:
+        messages = []
+        for line in lines:
+            try:
+                row = json.loads(line)
+            except Exception:
+                continue
+            if isinstance(row, dict):
+                messages.append(row)
+        return messages
+
+    def load_date_page(self, date_str: str, cursor: int = 0, limit: int = DAY_PAGE_SIZE) -> Dict:
+        segment = self._segment(date_str)
+        if segment is not None:
+            # Only the blocks holding lines [cursor, stop) are decompressed.
+            total = segment.lines
+            cursor = max(0, min(cursor, total))
+            stop = min(total, cursor + max(1, limit))
+            return self._page(date_str, self._parse_lines(segment.read_lines(cursor, stop)), cursor, stop, total)
+
+        file = self._date_file(date_str)
+        offsets = LineOffsets(file)
+        with self._lock:
+            total = offsets.ensure()
+        cursor = max(0, min(cursor, total))
+        stop = min(total, cursor + max(1, limit))
+        messages = []
+        if stop > cursor:
+            bounds = offsets.read(cursor, stop)
+            with file.open("rb") as f:
+                f.seek(bounds[0])
+                blob = f.read(bounds[-1] - bounds[0])
+            base = bounds[0]
+            messages = self._parse_lines(blob[start - base:end - base] for start, end in zip(bounds, bounds[1:]))
+        return self._page(date_str, messages, cursor, stop, total)
+
+    def load_date_tail(self, date_str: str, limit: int = DAY_PAGE_SIZE) -> Dict:
+        # Latest N messages: only the end of the sidecar and of the day file (or the last blocks) are read.
+        segment = self._segment(date_str)
+        if segment is not None:
+            total = segment.lines
+        else:
+            with self._lock:
+                total = LineOffsets(self._date_file(date_str)).ensure()
+        limit = max(1, limit)
+        return self.load_date_page(date_str, max(0, total - limit), limit)
+
+    def list_dates(self) -> List[Dict]:
+        items = []
+        for date_str, meta in self.index.get("dates", {}).items():
+            row = {"date": date_str}
+            if isinstance(meta, dict):
+                row.update(meta)
+            items.append(row)
+        items.sort(key=lambda x: x.get("date", ""), reverse=True)
+        return items
+
+    def search_messages(
+        self,
+        query: str,
+        speaker: str = "",
+        date_from: str = "",
+        date_to: str = "",
+        limit: int = SEARCH_PAGE_SIZE,
+        cursor: int = 0,
+    ) -> Dict:
+        # Same rule as SqliteHistoryStore: every part must occur as a substring, and a query whose parts
+        # yield no index term at all finds nothing. Parts too short for a term go through the term table.
+        parts = [p for p in (query or "").lower().split() if p]
+        limit = max(1, limit)
+        cursor = max(0, cursor)
+        result = {"query": query, "results": [], "next_cursor": None}
+        if not any(message_terms(p) for p in parts):
+            return result
+        terms, fragments = set(), set()
+        for p in parts:
+            more_terms, more_fragments = query_terms(p)
+            terms.update(more_terms)
+            fragments.update(more_fragments)
+
+        with self._lock:
+            candidates = self.messages_index.candidates(sorted(terms), sorted(fragments))
+
+        matched = 0
+        handles = {}
+        try:
+            for date_str, offset in candidates:
+                if (date_from and date_str < date_from) or (date_to and date_str > date_to):
+                    continue
+                row = self._read_row_at(handles, date_str, offset)
+                if not row or (speaker and row.get("speaker") != speaker):
+                    continue
+                text = row.get("text", "") or ""
+                lowered = text.lower()
+                # Postings are term-level; confirm the real substrings before counting a hit.
+                if not all(p in lowered for p in parts):
+                    continue
+                matched += 1
+                if matched <= cursor:
+                    continue
+                if len(result["results"]) >= limit:
+                    result["next_cursor"] = cursor + limit
+                    break
+                result["results"].append({
+                    "date": date_str,
+                    "offset": offset,
+                    "role": row.get("role", ""),
+                    "speaker": row.get("speaker", ""),
+                    "time": row.get("time", ""),
+                    "snippet": self._snippet(text, lowered.find(parts[0]), len(parts[0])),
+                })
+        finally:
+            for f in handles.values():
+                if not isinstance(f, Segment):
+                    f.close()
+        return result
+
+    def _read_row_at(self, handles: Dict, date_str: str, offset: int):
+        # handles: date -> open day file, or the Segment of an archived day (one block per hit, cached).
+        f = handles.get(date_str)
+        if f is None:
+            f = self._segment(date_str)
+            if f is None:
+                file = self._date_file(date_str)
+                if not file.exists():
+                    return None
+                f = file.open("rb")
+            handles[date_str] = f
+        if isinstance(f, Segment):
+            line = f.read_line_at(offset)
+        else:
+            f.seek(offset)
+            line = f.readline()
+        try:
+            row = json.loads(line.decode("utf-8"))
+        except Exception:
+            return None
+        return row if isinstance(row, dict) else None
+
+    def recall_rows_for_query(self, query: str, limit: int = 3) -> List[Dict]:
+        dates = self.index.get("dates", {})
+        query_tokens = self._extract_tokens(query)
+        picked = []
+        if query_tokens:
+            with self._lock:
+                picked = [d for _, d in self.recall.top_dates(query_tokens, limit) if d in dates]
+        # Top up with the most recent days, as the old unscored ranking did.
+        if len(picked) < limit:
+            for date_str in heapq.nlargest(limit, dates):
+                if date_str not in picked:
+                    picked.append(date_str)
+                if len(picked) >= limit:
+                    break
+
+        rows = []
+        for date_str in picked:
+            row = {"date": date_str}
+            if isinstance(dates.get(date_str), dict):
+                row.update(dates[date_str])
+            rows.append(row)
+        return rows
+
+    def _stats_for_date(self, date_str: str) -> Dict:
+        stats = self._day_stats.get(date_str)
+        if stats is None:
+            stats = self._new_day_stats()
+            with INDEX_REBUILD_SECONDS.time(index="day_stats"):
+                self._accumulate(stats, self.load_date_history(date_str))
+            self._day_stats[date_str] = stats
+        return stats
+
+    def _publish_index_for_date(self, date_str: str):
+        self.index.setdefault("dates", {})[date_str] = self._day_meta(self._day_stats[date_str])
+        self._dirty = True
+
+    def _sync_recall_index(self):
+        # Day files are append-only, so only bytes past the indexed size need reading. Archived days keep
+        # their original offsets and sizes, so they are only read when the index is rebuilt from scratch.
+        sizes = self._day_sizes()
+        if any(size < self.recall.sizes.get(date_str, 0) for date_str, size in sizes.items()):
+            self.recall.reset()
+        for date_str, size in sorted(sizes.items()):
+            indexed = self.recall.sizes.get(date_str, 0)
+            if size == indexed:
+                continue
+            for _, line in self._iter_day_lines(date_str, indexed):
+                try:
+                    row = json.loads(line.decode("utf-8", errors="replace"))
+                except Exception:
+                    continue
+                if isinstance(row, dict) and row.get("role") == "user":
+                    self.recall.add(date_str, self._extract_tokens(row.get("text", "")))
+            self.recall.mark_size(date_str, size)
+        self.recall.save()
+
+    def _sync_message_index(self):
+        for date_str in sorted(self._day_sizes()):
+            last = self.messages_index.last_offsets.get(date_str)
+            if last is not None and self._segment(date_str) is not None:
+                # Archived days are closed; an indexed one has nothing left to catch up on.
+                continue
+            lines = self._iter_day_lines(date_str, last or 0)
+            if last is not None:
+                next(lines, None)
+            for offset, line in lines:
+                try:
+                    row = json.loads(line.decode("utf-8"))
+                except Exception:
+                    row = None
+                if isinstance(row, dict):
+                    self.messages_index.add(date_str, offset, row.get("text", ""))
+        self.messages_index.save()
+
+    def _schedule_flush(self):
+        if self.flush_interval <= 0:
+            self.flush()
+            return
+        # Debounce: one pending write covers every append until it fires.
+        if self._flush_timer is None:
+            # Daemon: a pending write must not keep the process alive; close() and flush() are what make
+            # appends durable.
+            self._flush_timer = Timer(self.flush_interval, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
     def _save_index(self):
-        self.index_file.write_text(
+        # Write-then-rename so a crash never leaves a half-written index.json.
+        tmp = self.index_file.with_name(f".{self.index_file.name}.{os.getpid()}.tmp")
+        tmp.write_text(
             json.dumps(self.index, ensure_ascii=False, indent=2) + "\n",
             encoding="utf-8",
         )
-
+        os.replace(tmp, self.index_file)
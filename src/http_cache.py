@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+import gzip
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+# Bodies smaller than this are sent as they are; gzip framing would eat most of the gain.
+GZIP_MIN_BYTES = 1024
+# Dynamic JSON is compressed per response, so it trades ratio for speed; static assets are compressed once.
+JSON_GZIP_LEVEL = 5
+STATIC_GZIP_LEVEL = 9
+MAX_CACHED_FILE_BYTES = 4 * 1024 * 1024
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    # "gzip", "gzip;q=0.5", "*" count; "gzip;q=0" does not.
+    for part in (accept_encoding or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if coding.strip().lower() not in ("gzip", "*"):
+            continue
+        q = params.strip().lower()
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def encode_json_body(body: bytes, accept_encoding: str) -> Tuple[bytes, Dict[str, str]]:
+    # (body, extra headers) for an /api/* JSON response, gzip-compressed when large and accepted.
+    if len(body) < GZIP_MIN_BYTES:
+        return body, {}
+    if not accepts_gzip(accept_encoding):
+        return body, {"Vary": "Accept-Encoding"}
+    return gzip.compress(body, JSON_GZIP_LEVEL, mtime=0), {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+
+
+class StaticAsset:
+    __slots__ = ("content_type", "data", "gzip_data", "etag", "last_modified", "mtime", "mtime_ns", "size")
+
+    def __init__(self, data: bytes, content_type: str, mtime_ns: int):
+        self.content_type = content_type
+        self.data = data
+        self.mtime_ns = mtime_ns
+        self.mtime = mtime_ns // 1_000_000_000
+        self.size = len(data)
+        self.etag = '"' + hashlib.sha1(data).hexdigest()[:20] + '"'
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.gzip_data = None
+        if len(data) >= GZIP_MIN_BYTES and content_type.startswith(COMPRESSIBLE_TYPES):
+            packed = gzip.compress(data, STATIC_GZIP_LEVEL, mtime=0)
+            if len(packed) < len(data):
+                self.gzip_data = packed
+
+    def _not_modified(self, headers: Dict[str, str]) -> bool:
+        # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2); weak comparison either way.
+        if_none_match = headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in tags or self.etag in tags or self.etag[:-1] + '-gz"' in tags
+        if_modified_since = headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                return self.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def respond(self, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], bytes]:
+        # headers: request headers with lower-case names. Returns (status, response headers, body).
+        gzipped = self.gzip_data is not None and accepts_gzip(headers.get("accept-encoding", ""))
+        response = {
+            "Content-Type": self.content_type,
+            "ETag": self.etag[:-1] + '-gz"' if gzipped else self.etag,
+            "Last-Modified": self.last_modified,
+            # Assets are not fingerprinted, so browsers revalidate every time and mostly get a 304.
+            "Cache-Control": "no-cache",
+        }
+        if self.gzip_data is not None:
+            response["Vary"] = "Accept-Encoding"
+        if self._not_modified(headers):
+            return 304, response, b""
+        if gzipped:
+            response["Content-Encoding"] = "gzip"
+            return 200, response, self.gzip_data
+        return 200, response, self.data
+
+
+class StaticCache:
+    # web/ files kept in memory with their gzip variants; a file is re-read only when its mtime or size changes.
+    def __init__(self):
+        self._assets: Dict[Path, StaticAsset] = {}
+        self._lock = Lock()
+
+    def load(self, target: Path, content_type: str) -> Optional[StaticAsset]:
+        # None if the file vanished between the caller's check and the read.
+        try:
+            stat = target.stat()
+        except OSError:
+            return None
+        with self._lock:
+            asset = self._assets.get(target)
+        if asset and asset.mtime_ns == stat.st_mtime_ns and asset.size == stat.st_size:
+            return asset
+        try:
+            asset = StaticAsset(target.read_bytes(), content_type, stat.st_mtime_ns)
+        except OSError:
+            return None
+        if asset.size <= MAX_CACHED_FILE_BYTES:
+            with self._lock:
+                self._assets[target] = asset
+        return asset
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+import heapq
+import itertools
+import math
+import time
+from collections import OrderedDict
+from threading import Condition, Thread
+from typing import Callable, Dict, Optional
+from uuid import uuid4
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_KEEP_FINISHED = 500
+
+
+class QueueFull(RuntimeError):
+    def __init__(self, retry_after: int):
+        super().__init__("任务队列已满，请稍后重试")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, payload: Dict, priority: int):
+        self.id = uuid4().hex
+        self.payload = payload
+        self.priority = priority
+        self.status = "queued"
+        self.replies = []
+        self.partial: Dict[str, str] = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def snapshot(self) -> Dict:
+        data = {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "input": self.payload.get("text", ""),
+            "replies": list(self.replies),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if self.status == "running":
+            # Text streamed so far by advisors that have not finished yet.
+            done = {reply["speaker"] for reply in self.replies}
+            data["partial"] = {k: v for k, v in self.partial.items() if k not in done}
+        if self.result is not None:
+            data["result"] = self.result
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    # Bounded priority queue drained by a fixed set of worker threads; pending jobs cost no threads.
+    # run(payload, on_event) executes one round and returns its result; higher priority runs first.
+    def __init__(
+        self,
+        run: Callable[[Dict, Callable], Dict],
+        workers: int = DEFAULT_WORKERS,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        keep_finished: int = DEFAULT_KEEP_FINISHED,
+    ):
+        self.run = run
+        self.max_pending = max(1, max_pending)
+        self.keep_finished = max(1, keep_finished)
+        self._heap = []
+        self._order = itertools.count()
+        self._jobs: Dict[str, Job] = {}
+        self._finished: "OrderedDict[str, Job]" = OrderedDict()
+        self._running = 0
+        self._avg_duration = 0.0
+        self._closed = False
+        self._cond = Condition()
+        self._threads = [Thread(target=self._worker, daemon=True) for _ in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, payload: Dict, priority: int = 0) -> Job:
+        job = Job(payload, priority)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("任务队列已关闭")
+            if len(self._heap) >= self.max_pending:
+                raise QueueFull(self._retry_after())
+            heapq.heappush(self._heap, (-priority, next(self._order), job))
+            self._jobs[job.id] = job
+            self._cond.notify()
+        return job
+
+    def _retry_after(self) -> int:
+        # Caller holds self._cond: rough time for the workers to free one queue slot.
+        return max(1, math.ceil((self._avg_duration or 1.0) / len(self._threads)))
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._cond:
+            job = self._jobs.get(job_id) or self._finished.get(job_id)
+            return job.snapshot() if job else None
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "queued": len(self._heap),
+                "running": self._running,
+                "finished": len(self._finished),
+                "workers": len(self._threads),
+                "max_pending": self.max_pending,
+                "avg_duration_s": round(self._avg_duration, 3),
+            }
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                job = heapq.heappop(self._heap)[2]
+                job.status = "running"
+                job.started_at = time.time()
+                self._running += 1
+
+            def on_event(name: str, data: Dict, job=job):
+                with self._cond:
+                    if name == "delta":
+                        job.partial[data["speaker"]] = job.partial.get(data["speaker"], "") + data["delta"]
+                    elif name == "reply":
+                        job.replies.append(data)
+
+            try:
+                result = self.run(job.payload, on_event)
+                error = None
+            except Exception as exc:
+                result = None
+                error = str(exc)
+
+            with self._cond:
+                job.finished_at = time.time()
+                job.status = "failed" if error else "done"
+                job.error = error
+                if result is not None:
+                    job.result = result
+                    job.replies = list(result.get("replies", job.replies))
+                job.partial = {}
+                self._running -= 1
+                duration = job.finished_at - job.started_at
+                self._avg_duration = duration if not self._avg_duration else 0.8 * self._avg_duration + 0.2 * duration
+                self._jobs.pop(job.id, None)
+                self._finished[job.id] = job
+                while len(self._finished) > self.keep_finished:
+                    self._finished.popitem(last=False)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for _, _, job in self._heap:
+                job.status = "cancelled"
+            self._heap = []
+            self._cond.notify_all()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, List, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FAST_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], object] = {}
+        self._lock = Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}" for key, value in series]
+
+    def to_json(self) -> List[Dict]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return [{"labels": dict(zip(self.labels, key)), "value": value} for key, value in series]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket (not cumulative) counts plus an overflow slot, then sum and count.
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self._snapshot():
+            running = 0
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                running += bucket
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {running}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+    def to_json(self) -> List[Dict]:
+        rows = []
+        for key, (counts, total, count) in self._snapshot():
+            running, buckets = 0, {}
+            for bound, bucket in zip(self.buckets + (float("inf"),), counts):
+                running += bucket
+                buckets[_format_number(bound)] = running
+            rows.append({"labels": dict(zip(self.labels, key)), "count": count, "sum": total, "buckets": buckets})
+        return rows
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = Lock()
+
+    def _register(self, metric: _Metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render_prometheus(self) -> str:
+        # Prometheus text exposition format 0.0.4.
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> Dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: {"type": m.kind, "help": m.help, "series": m.to_json()} for m in metrics}
+
+
+class TimedLock:
+    # threading.Lock replacement for `with` blocks that records how long callers waited for and held it.
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = Lock()
+        self._acquired_at = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        started = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if acquired:
+            self._acquired_at = time.perf_counter()
+            LOCK_WAIT_SECONDS.observe(self._acquired_at - started, lock=self.name)
+        return acquired
+
+    def release(self):
+        held = time.perf_counter() - self._acquired_at
+        self._lock.release()
+        LOCK_HOLD_SECONDS.observe(held, lock=self.name)
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+REGISTRY = Registry()
+INVOKE_SECONDS = REGISTRY.histogram(
+    "warcouncil_invoke_seconds", "单次军师调用（invoke_model）耗时", ("alias", "transport", "outcome")
+)
+INVOKE_FAILURES = REGISTRY.counter("warcouncil_invoke_failures_total", "军师调用失败次数", ("alias", "reason"))
+SPAWN_SECONDS = REGISTRY.histogram(
+    "warcouncil_spawn_seconds", "CLI 进程启动耗时（stdin/arg 传输）", ("alias",), FAST_BUCKETS
+)
+RUN_SECONDS = REGISTRY.histogram("warcouncil_run_seconds", "CLI 进程从启动到退出的耗时", ("alias",))
+STDOUT_BYTES = REGISTRY.counter("warcouncil_stdout_bytes_total", "军师 CLI 输出到 stdout 的字节数", ("alias",))
+LOCK_WAIT_SECONDS = REGISTRY.histogram("warcouncil_lock_wait_seconds", "等待锁的耗时", ("lock",), FAST_BUCKETS)
+LOCK_HOLD_SECONDS = REGISTRY.histogram("warcouncil_lock_hold_seconds", "持有锁的耗时", ("lock",), FAST_BUCKETS)
+PROMPT_BUILD_SECONDS = REGISTRY.histogram(
+    "warcouncil_prompt_build_seconds", "每轮构建全部 prompt 的耗时", (), FAST_BUCKETS
+)
+RECALL_SECONDS = REGISTRY.histogram("warcouncil_recall_seconds", "每轮记忆召回耗时", (), FAST_BUCKETS)
+APPEND_SECONDS = REGISTRY.histogram(
+    "warcouncil_append_messages_seconds", "历史存储 append_messages 耗时", ("backend",), FAST_BUCKETS
+)
+INDEX_REBUILD_SECONDS = REGISTRY.histogram(
+    "warcouncil_index_rebuild_seconds", "历史索引重建/追赶耗时", ("index",), FAST_BUCKETS
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "warcouncil_http_request_seconds", "HTTP 请求处理耗时（SSE 为整轮时长）", ("method", "route", "status")
+)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict, deque
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+RECENT_WINDOW = 30
+SUMMARY_MAX_LINES = 60
+# Messages a prompt can reflect: the recent window in full plus one digest line per folded message.
+CONTEXT_SPAN = RECENT_WINDOW + SUMMARY_MAX_LINES
+DIGEST_CHARS = 80
+DEFAULT_PROMPT_CHARS = 24000
+DEFAULT_MAX_MESSAGE_CHARS = 4000
+TRUNCATED = "…（已截断）"
+CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+SENTENCE_END = re.compile(r"[。！？!?\n]|\.\s")
+PLACEHOLDER = re.compile(r"\{(system|alias|summary|history|notes|question)\}")
+RENDER_CACHE_SIZE = 1024
+SUMMARY_HEADER = "【更早会话摘要】"
+DEFAULT_TEMPLATE = "\n\n".join([
+    "【系统设定】\n{system}",
+    "【你的身份】\n你是军师「{alias}」。",
+    "{summary}【近期会话（节选）】\n按篇幅预算展示最近消息，过长发言已截断。",
+    "{history}",
+    "【往日相关记忆（按日期摘要）】\n如与当前问题相关，可据此回忆历史决策。",
+    "{notes}",
+    "【本轮主公问题】\n{question}",
+    "请直接给出回答。",
+])
+
+
+def approx_tokens(text: str) -> int:
+    # CJK characters are roughly one token each; other text roughly four characters per token.
+    cjk = len(CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def prompt_budget(model: Optional[Dict]) -> Dict:
+    # models.json per model: "prompt_budget": {"chars": 24000} or {"tokens": 6000}, plus
+    # "max_message_chars": 4000 for any single message quoted in the prompt. A bare number means chars.
+    raw = (model or {}).get("prompt_budget")
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        raw = {"chars": raw}
+    raw = raw if isinstance(raw, dict) else {}
+    unit, limit = "chars", DEFAULT_PROMPT_CHARS
+    try:
+        if raw.get("tokens") is not None:
+            unit, limit = "tokens", int(raw["tokens"])
+        elif raw.get("chars") is not None:
+            limit = int(raw["chars"])
+        max_message_chars = int(raw.get("max_message_chars", DEFAULT_MAX_MESSAGE_CHARS))
+    except (TypeError, ValueError):
+        unit, limit, max_message_chars = "chars", DEFAULT_PROMPT_CHARS, DEFAULT_MAX_MESSAGE_CHARS
+    return {"unit": unit, "limit": max(1, limit), "max_message_chars": max(1, max_message_chars)}
+
+
+def prompt_template(model: Optional[Dict]) -> str:
+    # models.json per model: "prompt_template" as a string or a list of lines. Placeholders: {system},
+    # {alias}, {summary}, {history}, {notes}, {question}; any other braces are left as they are.
+    raw = (model or {}).get("prompt_template")
+    if isinstance(raw, list):
+        raw = "\n".join(str(line) for line in raw)
+    return raw if isinstance(raw, str) and raw.strip() else DEFAULT_TEMPLATE
+
+
+def fill_template(template: str, fields: Dict[str, str]) -> str:
+    return PLACEHOLDER.sub(lambda m: fields[m.group(1)], template)
+
+
+def measure(text: str, unit: str) -> int:
+    return approx_tokens(text) if unit == "tokens" else len(text)
+
+
+def truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return text[:max(0, limit - len(TRUNCATED))] + TRUNCATED
+
+
+def render_line(message: Dict, max_chars: int) -> str:
+    text = truncate(str(message.get("text", "")), max_chars)
+    return f"[{message.get('time', '')}] {message.get('speaker', '未知')}({message.get('role', '')}): {text}"
+
+
+def digest(message: Dict) -> str:
+    # One short line per message: its first sentence, capped at DIGEST_CHARS.
+    text = " ".join(str(message.get("text", "")).split())
+    match = SENTENCE_END.search(text)
+    if match and match.end() <= DIGEST_CHARS:
+        text = text[:match.end()].strip()
+    text = truncate(text, DIGEST_CHARS)
+    return f"{message.get('speaker', '未知')}: {text}"
+
+
+def context_digest(messages, question: str) -> str:
+    # Identifies the history a question is asked against, for reply caching and call coalescing. Timestamps
+    # are ignored, and the round's own question plus any identical asks right before it (with the replies
+    # they got) are dropped, so re-asking a question or retrying after a refresh sees the same context.
+    rows = list(messages)
+    while rows:
+        i = len(rows) - 1
+        while i >= 0 and rows[i].get("role") != "user":
+            i -= 1
+        if i < 0 or rows[i].get("text") != question:
+            break
+        del rows[i:]
+    h = hashlib.sha256()
+    for row in rows[-CONTEXT_SPAN:]:
+        h.update(json.dumps([row.get("role", ""), row.get("speaker", ""), row.get("text", "")], ensure_ascii=False)
+                 .encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+class RollingSummary:
+    # Digests of messages that scrolled out of the recent window, maintained one message at a time as
+    # the session grows. Only the newest SUMMARY_MAX_LINES digests are kept; older ones are counted.
+    def __init__(self):
+        self.lines = deque(maxlen=SUMMARY_MAX_LINES)
+        self.folded = 0
+
+    def push(self, history):
+        # Called after each append: folds the message that just left the window.
+        if len(history) > RECENT_WINDOW:
+            self.lines.append(digest(history[-RECENT_WINDOW - 1]))
+            self.folded += 1
+
+    def skip(self, count: int):
+        # Messages that were never loaded (e.g. the start of a long day) count as folded without a digest.
+        self.folded += max(0, count)
+
+    def snapshot(self) -> Tuple[List[str], int]:
+        # (digest lines, number of folded messages whose digests were dropped). Everything after the
+        # folded messages, at most RECENT_WINDOW of them, is what fit_history expects as `rows`.
+        return list(self.lines), self.folded - len(self.lines)
+
+
+class RenderCache:
+    # Rendered lines and digests of committed messages, keyed by seq, reused across rounds of a session
+    # so each message is formatted once rather than once per advisor per turn.
+    def __init__(self, size: int = RENDER_CACHE_SIZE):
+        self.size = size
+        self._items: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = Lock()
+
+    def _get(self, key, message: Dict, render):
+        if not isinstance(message.get("seq"), int):
+            return render()
+        key = (message["seq"],) + key
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                return value
+        value = render()
+        with self._lock:
+            self._items[key] = value
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return value
+
+    def line(self, message: Dict, max_chars: int) -> str:
+        return self._get(("line", max_chars), message, lambda: render_line(message, max_chars))
+
+    def digest(self, message: Dict) -> str:
+        return self._get(("digest",), message, lambda: digest(message))
+
+
+def fit_history(
+    rows, summary, budget: Dict, available: int, cache: Optional[RenderCache] = None
+) -> Tuple[List[str], List[str]]:
+    # Splits `available` units between the newest messages (each capped at max_message_chars) and
+    # digest lines for everything older. Returns (recent lines, summary lines), both oldest first.
+    # With a summary, `rows` start right after the messages it folded.
+    unit, max_chars = budget["unit"], budget["max_message_chars"]
+    cache = cache or RenderCache(0)
+    window = rows[-RECENT_WINDOW:]
+    recent = []
+    overflow = len(window)
+    for item in reversed(window):
+        line = cache.line(item, max_chars)
+        cost = measure(line, unit) + 1
+        if cost > available:
+            break
+        recent.append(line)
+        available -= cost
+        overflow -= 1
+    recent.reverse()
+
+    lines, dropped = summary if summary else ([], 0)
+    # Rows appended after the snapshot (earlier replies in a sequential round) may push messages out
+    # of the window that the summary has not folded yet.
+    unfolded = rows[:len(rows) - len(window)]
+    older = list(lines) + [cache.digest(item) for item in unfolded] + [cache.digest(item) for item in window[:overflow]]
+    kept = []
+    for line in reversed(older):
+        cost = measure(line, unit) + 1
+        if cost > available:
+            break
+        kept.append(line)
+        available -= cost
+    kept.reverse()
+    omitted = dropped + len(older) - len(kept)
+    if kept and omitted:
+        kept.insert(0, f"（更早 {omitted} 条已省略）")
+    return [f"{i}. {line}" for i, line in enumerate(recent, start=1)], kept
+
+
+class RoundContext:
+    # What every advisor of one round shares: question, history snapshot, rolling summary and recalled
+    # notes. History is fitted once per distinct budget, so advisors only differ in the template fill.
+    def __init__(
+        self, system: str, content: str, rows, summary, notes: str, cache: Optional[RenderCache] = None,
+        context: str = "", context_notes: Optional[str] = None, session: str = "",
+    ):
+        # context: context_digest() of the session history, which cache_text() uses in place of the
+        # rendered history; context_notes: the recalled notes that history does not already cover;
+        # session: id of the owning session, so concurrent calls are only coalesced within it.
+        self.system = system
+        self.session = session
+        self.content = content
+        self.context = context
+        self.context_notes = context_notes
+        self.rows = rows
+        self.summary = summary
+        self.notes = notes or "(暂无历史摘要)"
+        self.cache = cache or RenderCache(0)
+        self.build_s = 0.0
+        self._fitted: Dict[tuple, Tuple[str, str]] = {}
+        self._lock = Lock()
+
+    def prompt(self, alias: str, model: Optional[Dict] = None, extra_rows=()) -> str:
+        # extra_rows: replies given earlier in a sequential round, shown after the snapshot.
+        started = time.perf_counter()
+        budget = prompt_budget(model)
+        template = prompt_template(model)
+        fields = {
+            "system": self.system,
+            "alias": alias,
+            "summary": "",
+            "history": "",
+            "notes": self.notes,
+            "question": self.content,
+        }
+        fixed = measure(fill_template(template, fields) + SUMMARY_HEADER, budget["unit"]) + 8
+        key = (budget["unit"], budget["limit"] - fixed, budget["max_message_chars"], len(extra_rows))
+        with self._lock:
+            fitted = self._fitted.get(key)
+        if fitted is None:
+            rows = self.rows + list(extra_rows) if extra_rows else self.rows
+            recent, older = fit_history(rows, self.summary, budget, key[1], self.cache)
+            fitted = (
+                f"{SUMMARY_HEADER}\n" + "\n".join(older) + "\n\n" if older else "",
+                "\n".join(recent) if recent else "(暂无历史)",
+            )
+            with self._lock:
+                self._fitted[key] = fitted
+        fields["summary"], fields["history"] = fitted
+        text = fill_template(template, fields)
+        with self._lock:
+            self.build_s += time.perf_counter() - started
+        return text
+
+    def cache_text(self, alias: str, model: Optional[Dict] = None, extra_rows=()) -> str:
+        # What the prompt depends on, without the per-message timestamps and the round's own history line
+        # that make every rendered prompt unique: the template filled around the context digest, the budget,
+        # and the replies given earlier in a sequential round.
+        fields = {
+            "system": self.system,
+            "alias": alias,
+            "summary": "",
+            "history": self.context,
+            "notes": self.notes if self.context_notes is None else self.context_notes,
+            "question": self.content,
+        }
+        earlier = [[row.get("speaker", ""), row.get("text", "")] for row in extra_rows]
+        return json.dumps(
+            [fill_template(prompt_template(model), fields), prompt_budget(model), earlier], ensure_ascii=False
+        )
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Optional
+
+DEFAULT_TTL_S = 600
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_DISK_MAX_ENTRIES = 1024
+DISK_PRUNE_EVERY = 64
+COUNTERS = ("hits", "disk_hits", "misses", "stores", "evictions", "bypass")
+
+
+def cache_options(model) -> Optional[Dict]:
+    # models.json: "cache": {"ttl_s": 600, "max_entries": 128, "disk": false}; absent or false disables it.
+    options = model.get("cache")
+    if options is True:
+        options = {}
+    if not isinstance(options, dict) or options.get("enabled") is False:
+        return None
+    try:
+        ttl_s = float(options.get("ttl_s", DEFAULT_TTL_S))
+    except (TypeError, ValueError):
+        ttl_s = float(DEFAULT_TTL_S)
+    try:
+        max_entries = int(options.get("max_entries", DEFAULT_MAX_ENTRIES))
+    except (TypeError, ValueError):
+        max_entries = DEFAULT_MAX_ENTRIES
+    return {"ttl_s": ttl_s, "max_entries": max(1, max_entries), "disk": bool(options.get("disk", False))}
+
+
+class ReplyCache:
+    def __init__(self, disk_dir: Path, disk_max_entries: int = DEFAULT_DISK_MAX_ENTRIES):
+        self.disk_dir = disk_dir
+        self.disk_max_entries = disk_max_entries
+        self._entries: Dict[str, OrderedDict] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+        self._lock = Lock()
+        self._disk_puts = 0
+
+    @staticmethod
+    def make_key(model, prompt: str) -> str:
+        ident = [
+            model.get("alias", ""),
+            model.get("transport", "mock"),
+            model.get("cmd", ""),
+            [str(x) for x in model.get("args", [])],
+            hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        ]
+        return hashlib.sha256(json.dumps(ident, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _count(self, alias: str, name: str):
+        stats = self._stats.setdefault(alias, dict.fromkeys(COUNTERS, 0))
+        stats[name] += 1
+
+    def note_bypass(self, alias: str):
+        with self._lock:
+            self._count(alias, "bypass")
+
+    def get(self, alias: str, key: str, options: Dict) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entries = self._entries.setdefault(alias, OrderedDict())
+            hit = entries.get(key)
+            if hit is not None:
+                expires_at, text = hit
+                if expires_at > now:
+                    entries.move_to_end(key)
+                    self._count(alias, "hits")
+                    return text
+                del entries[key]
+
+        text = self._disk_get(key, now) if options["disk"] else None
+        with self._lock:
+            if text is None:
+                self._count(alias, "misses")
+                return None
+            self._count(alias, "disk_hits")
+        self._remember(alias, key, text, now + options["ttl_s"], options)
+        return text
+
+    def put(self, alias: str, key: str, text: str, options: Dict):
+        expires_at = time.time() + options["ttl_s"]
+        self._remember(alias, key, text, expires_at, options)
+        with self._lock:
+            self._count(alias, "stores")
+        if options["disk"]:
+            self._disk_put(alias, key, text, expires_at)
+
+    def _remember(self, alias: str, key: str, text: str, expires_at: float, options: Dict):
+        with self._lock:
+            entries = self._entries.setdefault(alias, OrderedDict())
+            entries[key] = (expires_at, text)
+            entries.move_to_end(key)
+            while len(entries) > options["max_entries"]:
+                entries.popitem(last=False)
+                self._count(alias, "evictions")
+
+    def _disk_file(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        file = self._disk_file(key)
+        try:
+            data = json.loads(file.read_text(encoding="utf-8"))
+        except Exception:
+            return None
+        if not isinstance(data, dict) or float(data.get("expires_at", 0)) <= now:
+            file.unlink(missing_ok=True)
+            return None
+        text = data.get("text")
+        return text if isinstance(text, str) else None
+
+    def _disk_put(self, alias: str, key: str, text: str, expires_at: float):
+        self.disk_dir.mkdir(parents=True, exist_ok=True)
+        file = self._disk_file(key)
+        tmp = file.with_name(f".{file.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"alias": alias, "expires_at": expires_at, "text": text}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, file)
+        with self._lock:
+            self._disk_puts += 1
+            prune = self._disk_puts % DISK_PRUNE_EVERY == 0
+        if prune:
+            self._disk_prune()
+
+    def _disk_prune(self):
+        files = []
+        for file in self.disk_dir.glob("*.json"):
+            try:
+                files.append((file.stat().st_mtime, file))
+            except OSError:
+                continue
+        files.sort()
+        for _, file in files[:max(0, len(files) - self.disk_max_entries)]:
+            file.unlink(missing_ok=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            per_alias = {alias: dict(v) for alias, v in self._stats.items()}
+            sizes = {alias: len(v) for alias, v in self._entries.items()}
+        total = dict.fromkeys(COUNTERS, 0)
+        for alias, counters in per_alias.items():
+            counters["entries"] = sizes.get(alias, 0)
+            for name in total:
+                total[name] += counters[name]
+        lookups = total["hits"] + total["disk_hits"] + total["misses"]
+        total["hit_ratio"] = round((total["hits"] + total["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return {"total": total, "models": per_alias}
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+import math
+import os
+import signal
+import time
+from collections import deque
+from threading import Lock
+from typing import Dict, Optional
+
+LATENCY_WINDOW = 200
+DEFAULT_HEDGE_PERCENTILE = 95.0
+DEFAULT_HEDGE_MIN_SAMPLES = 20
+DEFAULT_BREAKER_FAILURES = 3
+DEFAULT_BREAKER_RESET_S = 30.0
+
+
+class CallCancelled(RuntimeError):
+    pass
+
+
+def resilience_options(model) -> Dict:
+    # models.json per model:
+    #   "timeout_s": 120
+    #   "hedge": {"percentile": 95, "min_samples": 20}
+    #   "breaker": {"failures": 3, "reset_s": 30}
+    timeout_s = model.get("timeout_s")
+    try:
+        timeout_s = float(timeout_s) if timeout_s is not None else None
+    except (TypeError, ValueError):
+        timeout_s = None
+    if timeout_s is not None and timeout_s <= 0:
+        timeout_s = None
+
+    hedge = model.get("hedge")
+    if hedge is True:
+        hedge = {}
+    if isinstance(hedge, dict):
+        hedge = {
+            "percentile": min(99.9, max(1.0, float(hedge.get("percentile", DEFAULT_HEDGE_PERCENTILE)))),
+            "min_samples": max(1, int(hedge.get("min_samples", DEFAULT_HEDGE_MIN_SAMPLES))),
+        }
+    else:
+        hedge = None
+
+    breaker = model.get("breaker")
+    if breaker is True:
+        breaker = {}
+    if isinstance(breaker, dict):
+        breaker = {
+            "failures": max(1, int(breaker.get("failures", DEFAULT_BREAKER_FAILURES))),
+            "reset_s": max(0.0, float(breaker.get("reset_s", DEFAULT_BREAKER_RESET_S))),
+        }
+    else:
+        breaker = None
+    return {"timeout_s": timeout_s, "hedge": hedge, "breaker": breaker}
+
+
+def kill_process_tree(proc):
+    # CLIs are started in their own session, so the whole group goes (shell wrappers, node children...).
+    # Works for subprocess.Popen and asyncio subprocesses alike.
+    try:
+        poll = getattr(proc, "poll", None)
+        if (poll() if poll else proc.returncode) is not None:
+            return
+        if os.name == "posix" and os.getpgid(proc.pid) == proc.pid:
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (OSError, ProcessLookupError):
+        pass
+
+
+class CancelToken:
+    # Processes registered on a token are killed when it is cancelled; child tokens are cancelled with it.
+    def __init__(self):
+        self.cancelled = False
+        self._procs = []
+        self._children = []
+        self._lock = Lock()
+
+    def register(self, proc):
+        with self._lock:
+            if not self.cancelled:
+                self._procs.append(proc)
+                return
+        kill_process_tree(proc)
+
+    def unregister(self, proc):
+        with self._lock:
+            if proc in self._procs:
+                self._procs.remove(proc)
+
+    def child(self) -> "CancelToken":
+        token = CancelToken()
+        with self._lock:
+            if not self.cancelled:
+                self._children.append(token)
+                return token
+        token.cancel()
+        return token
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            procs, self._procs = self._procs, []
+            children, self._children = self._children, []
+        for proc in procs:
+            kill_process_tree(proc)
+        for child in children:
+            child.cancel()
+
+
+class LatencyTracker:
+    # Recent successful call durations per alias, used to pick the hedging delay.
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[str, deque] = {}
+        self._lock = Lock()
+
+    def record(self, alias: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(alias, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, alias: str, pct: float, min_samples: int) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get(alias, ()))
+        if len(samples) < min_samples:
+            return None
+        rank = max(0, math.ceil(pct / 100 * len(samples)) - 1)
+        return samples[rank]
+
+
+class CircuitBreaker:
+    # closed -> open after N consecutive failures; after reset_s one probe call is let through (half-open).
+    # A successful probe closes the circuit, a failed one re-opens it.
+    def __init__(self):
+        self._state: Dict[str, Dict] = {}
+        self._lock = Lock()
+
+    def _entry(self, alias: str) -> Dict:
+        return self._state.setdefault(alias, {"state": "closed", "failures": 0, "opened_at": 0.0})
+
+    def allow(self, alias: str, options: Dict) -> bool:
+        with self._lock:
+            entry = self._entry(alias)
+            if entry["state"] == "closed":
+                return True
+            if entry["state"] == "open" and time.monotonic() - entry["opened_at"] >= options["reset_s"]:
+                entry["state"] = "half_open"
+                return True
+            return False
+
+    def retry_in(self, alias: str, options: Dict) -> float:
+        with self._lock:
+            entry = self._entry(alias)
+            return max(0.0, options["reset_s"] - (time.monotonic() - entry["opened_at"]))
+
+    def record(self, alias: str, ok: bool, options: Dict):
+        with self._lock:
+            entry = self._entry(alias)
+            if ok:
+                entry.update(state="closed", failures=0)
+                return
+            entry["failures"] += 1
+            if entry["state"] == "half_open" or entry["failures"] >= options["failures"]:
+                entry.update(state="open", opened_at=time.monotonic())
+
+    def abandon(self, alias: str):
+        # A cancelled probe proves nothing; let the next call probe again.
+        with self._lock:
+            entry = self._entry(alias)
+            if entry["state"] == "half_open":
+                entry["state"] = "open"
+                entry["opened_at"] = 0.0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {alias: {"state": v["state"], "failures": v["failures"]} for alias, v in self._state.items()}
@@ -1,11 +1,24 @@
 #!/usr/bin/env python3
+import argparse
+import asyncio
 import json
+import queue
+import time
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
+from threading import Thread
 from urllib.parse import parse_qs, urlparse
-import shlex
 
-from war_council_core import WarCouncil
+try:
+    from api_routes import ApiRoutes, route_label
+    from job_queue import JobQueue
+    from metrics import HTTP_SECONDS
+    from war_council_core import WarCouncil
+except ImportError:
+    from .api_routes import ApiRoutes, route_label
+    from .job_queue import JobQueue
+    from .metrics import HTTP_SECONDS
+    from .war_council_core import WarCouncil
 
 ROOT = Path.cwd()
 WEB_DIR = ROOT / "web"
@@ -15,37 +28,124 @@ PORT = 8765
 council = WarCouncil(models_file=ROOT / "models.json")
 
 
+def _run_job(payload, on_event):
+    return council.chat(
+        payload["text"],
+        collaborate=payload.get("collaborate", False),
+        on_event=on_event,
+        use_cache=not payload.get("no_cache", False),
+        session=payload.get("session"),
+    )
+
+
+def _create_jobs() -> JobQueue:
+    # models.json: "jobs": {"workers": 2, "max_pending": 1000, "keep_finished": 500}
+    options = council.config.get("jobs") if isinstance(council.config.get("jobs"), dict) else {}
+    return JobQueue(
+        _run_job,
+        workers=int(options.get("workers", 2)),
+        max_pending=int(options.get("max_pending", 1000)),
+        keep_finished=int(options.get("keep_finished", 500)),
+    )
+
+
+jobs = _create_jobs()
+routes = ApiRoutes(council, jobs, WEB_DIR)
+
+
 class Handler(BaseHTTPRequestHandler):
-    def _send_json(self, payload, status=200):
-        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    status = 0
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def _timed(self, handle):
+        started = time.perf_counter()
+        try:
+            handle()
+        finally:
+            route = route_label(urlparse(self.path).path)
+            HTTP_SECONDS.observe(time.perf_counter() - started, method=self.command, route=route, status=self.status)
+
+    def _send_body(self, status: int, content_type: str, data: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, payload, status=200, headers=None):
+        body, encoding = routes.json_body(payload, self.headers.get("Accept-Encoding", ""))
         self.send_response(status)
         self.send_header("Content-Type", "application/json; charset=utf-8")
         self.send_header("Content-Length", str(len(body)))
+        for name, value in {**(headers or {}), **encoding}.items():
+            self.send_header(name, value)
         self.end_headers()
         self.wfile.write(body)
 
-    def _send_file(self, file_path: Path):
-        if not file_path.exists() or not file_path.is_file():
-            self.send_error(404, "Not Found")
+    def _send_file(self, path: str):
+        request_headers = {name.lower(): value for name, value in self.headers.items()}
+        status, headers, data = routes.static_file(path, request_headers)
+        if status in (403, 404):
+            self.send_error(status, "Forbidden" if status == 403 else "Not Found")
+            return
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_chat(self, text: str, collaborate, since=None, epoch=None, use_cache: bool = True, session=None):
+        events = queue.Queue()
+
+        def run():
+            try:
+                council.chat(
+                    text,
+                    collaborate=collaborate,
+                    on_event=lambda name, data: events.put((name, data)),
+                    since=since,
+                    epoch=epoch,
+                    use_cache=use_cache,
+                    session=session,
+                )
+            except ValueError as exc:
+                events.put(("error", {"error": str(exc)}))
+            except Exception as exc:
+                events.put(("error", {"error": f"军议失败：{exc}"}))
+            finally:
+                events.put(None)
+
+        Thread(target=run, daemon=True).start()
+
+        # Validation errors surface before "start"; answer those as plain JSON.
+        first = events.get()
+        if first is None or first[0] == "error":
+            payload = first[1] if first else {"error": "军议未开始"}
+            self._send_json(payload, status=400)
             return
 
-        suffix = file_path.suffix.lower()
-        content_type = "text/plain; charset=utf-8"
-        if suffix == ".html":
-            content_type = "text/html; charset=utf-8"
-        elif suffix == ".js":
-            content_type = "application/javascript; charset=utf-8"
-        elif suffix == ".css":
-            content_type = "text/css; charset=utf-8"
-        elif suffix == ".json":
-            content_type = "application/json; charset=utf-8"
-
-        data = file_path.read_bytes()
         self.send_response(200)
-        self.send_header("Content-Type", content_type)
-        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
         self.end_headers()
-        self.wfile.write(data)
+
+        item = first
+        while item is not None:
+            name, data = item
+            chunk = f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+            try:
+                self.wfile.write(chunk.encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                # The round keeps running and is still committed to history.
+                return
+            item = events.get()
 
     def _read_json(self):
         length = int(self.headers.get("Content-Length", "0"))
@@ -55,45 +155,33 @@ class Handler(BaseHTTPRequestHandler):
         return json.loads(raw.decode("utf-8"))
 
     def do_GET(self):
-        parsed = urlparse(self.path)
-        path = parsed.path
+        self._timed(self._get)
 
-        if path == "/api/models":
-            self._send_json({"models": council.get_models()})
-            return
+    def do_POST(self):
+        self._timed(self._post)
 
-        if path == "/api/history":
-            self._send_json({"history": council.get_history()})
-            return
+    def _get(self):
+        parsed = urlparse(self.path)
+        path = parsed.path
+        params = parse_qs(parsed.query)
 
-        if path == "/api/memory/dates":
-            query = parse_qs(parsed.query).get("q", [""])[0]
-            if query:
-                self._send_json({"dates": council.search_memory_dates(query)})
-            else:
-                self._send_json({"dates": council.list_memory_dates()})
+        if path == "/api/chat/stream":
+            self._stream_chat(**routes.stream_request(params))
             return
 
-        if path == "/api/memory/date":
-            date_value = parse_qs(parsed.query).get("date", [""])[0]
-            if not date_value:
-                self._send_json({"error": "缺少 date 参数"}, status=400)
-                return
-            self._send_json({"date": date_value, "history": council.get_date_history(date_value)})
+        if path == "/api/metrics":
+            self._send_body(*routes.metrics(params))
             return
 
-        if path == "/":
-            self._send_file(WEB_DIR / "index.html")
+        result = routes.get(path, params)
+        if result is not None:
+            status, payload, headers = result
+            self._send_json(payload, status, headers)
             return
 
-        safe = path.lstrip("/")
-        target = (WEB_DIR / safe).resolve()
-        if not str(target).startswith(str(WEB_DIR.resolve())):
-            self.send_error(403, "Forbidden")
-            return
-        self._send_file(target)
+        self._send_file(path)
 
-    def do_POST(self):
+    def _post(self):
         parsed = urlparse(self.path)
         path = parsed.path
 
@@ -103,49 +191,56 @@ class Handler(BaseHTTPRequestHandler):
             self._send_json({"error": "JSON 格式错误"}, status=400)
             return
 
-        if path == "/api/models":
-            try:
-                alias = str(payload.get("alias", "")).strip()
-                transport = str(payload.get("transport", "")).strip()
-                command = str(payload.get("command", "")).strip()
-                tokens = shlex.split(command) if command else []
-                model = council.add_model(alias, transport, tokens)
-                self._send_json({"model": model, "models": council.get_models()})
-            except ValueError as exc:
-                self._send_json({"error": str(exc)}, status=400)
-            return
-
-        if path == "/api/chat":
-            text = str(payload.get("text", ""))
-            collaborate = bool(payload.get("collaborate", False))
-            try:
-                result = council.chat(text, collaborate=collaborate)
-                self._send_json(result)
-            except ValueError as exc:
-                self._send_json({"error": str(exc)}, status=400)
-            return
-
-        if path == "/api/reset":
-            council.reset_history()
-            self._send_json({"ok": True, "history": []})
+        result = routes.post(path, payload)
+        if result is None:
+            self.send_error(404, "Not Found")
             return
-
-        self.send_error(404, "Not Found")
+        status, payload, headers = result
+        self._send_json(payload, status, headers)
 
     def log_message(self, fmt, *args):
         return
 
 
-def main():
-    WEB_DIR.mkdir(parents=True, exist_ok=True)
-    server = ThreadingHTTPServer((HOST, PORT), Handler)
-    print(f"War Council Web 已启动: http://{HOST}:{PORT}")
+def serve_threaded(host: str = HOST, port: int = PORT):
+    server = ThreadingHTTPServer((host, port), Handler)
+    print(f"War Council Web 已启动: http://{host}:{port}")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         pass
     finally:
         server.server_close()
+
+
+def serve_async(host: str = HOST, port: int = PORT):
+    try:
+        from async_server import serve
+    except ImportError:
+        from .async_server import serve
+    print(f"War Council Web 已启动（asyncio）: http://{host}:{port}")
+    try:
+        asyncio.run(serve(routes, host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="军议 Web 服务")
+    parser.add_argument("--mode", choices=["thread", "async"], default="thread", help="thread=每连接一线程，async=单事件循环")
+    parser.add_argument("--host", default=HOST, help=f"监听地址，默认 {HOST}")
+    parser.add_argument("--port", type=int, default=PORT, help=f"监听端口，默认 {PORT}")
+    args = parser.parse_args()
+
+    WEB_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        if args.mode == "async":
+            serve_async(args.host, args.port)
+        else:
+            serve_threaded(args.host, args.port)
+    finally:
+        jobs.close()
+        council.close()
         print("War Council Web 已停止")
 
 
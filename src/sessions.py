@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+import json
+import os
+import re
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+try:
+    from metrics import TimedLock
+    from prompt_context import RECENT_WINDOW, SUMMARY_MAX_LINES, RenderCache, RollingSummary
+except ImportError:
+    from .metrics import TimedLock
+    from .prompt_context import RECENT_WINDOW, SUMMARY_MAX_LINES, RenderCache, RollingSummary
+
+DEFAULT_SESSION = "default"
+DEFAULT_MAX_LOADED = 64
+DEFAULT_MEMORY_BUDGET_MB = 64
+DEFAULT_HISTORY_WINDOW = 256
+# The window must cover the prompt's recent messages plus enough older ones to seed its summary.
+MIN_HISTORY_WINDOW = RECENT_WINDOW + SUMMARY_MAX_LINES + 1
+MESSAGE_OVERHEAD = 120
+SESSION_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+FIELDS = ("role", "speaker", "text", "time", "seq")
+_MISSING = object()
+
+
+def session_id(value: Optional[str]) -> str:
+    sid = (value or "").strip() or DEFAULT_SESSION
+    if not SESSION_ID.match(sid):
+        raise ValueError("会话 id 只能包含字母、数字、下划线和连字符（最长 64）")
+    return sid
+
+
+def _pack_time(value):
+    # UTC ISO timestamps (what now_iso() writes) become integer microseconds since the epoch; anything
+    # that would not format back to the identical string is kept as it is.
+    if not isinstance(value, str) or not value.endswith("+00:00"):
+        return value
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        return value
+    packed = (moment - EPOCH) // timedelta(microseconds=1)
+    return packed if _unpack_time(packed) == value else value
+
+
+def _unpack_time(value) -> str:
+    if isinstance(value, int):
+        return (EPOCH + timedelta(microseconds=value)).isoformat()
+    return value if isinstance(value, str) else ""
+
+
+def _seq(row: Dict) -> int:
+    # Rows written before seq existed sort first.
+    seq = row.get("seq")
+    return seq if isinstance(seq, int) else 0
+
+
+class Message:
+    # Compact in-memory record of one history message. Speaker and role strings are interned, so a
+    # long day shares one copy of each; the dict form is rebuilt only at API and storage boundaries.
+    # Supports the read-only dict access the prompt code uses (msg["text"], msg.get("speaker")).
+    __slots__ = ("role", "speaker", "text", "ts", "seq", "extra")
+
+    def __init__(self, data: Dict):
+        self.role = sys.intern(str(data.get("role", "")))
+        self.speaker = sys.intern(str(data.get("speaker", "")))
+        self.text = str(data.get("text", ""))
+        self.ts = _pack_time(data.get("time", ""))
+        self.seq = data.get("seq")
+        extra = {k: v for k, v in data.items() if k not in FIELDS}
+        self.extra = extra or None
+
+    def get(self, key: str, default=None):
+        if key == "time":
+            return _unpack_time(self.ts)
+        if key in FIELDS:
+            return getattr(self, key)
+        return self.extra.get(key, default) if self.extra else default
+
+    def __getitem__(self, key: str):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def to_dict(self) -> Dict:
+        data = {"role": self.role, "speaker": self.speaker, "text": self.text, "time": _unpack_time(self.ts)}
+        if self.extra:
+            data.update(self.extra)
+        data["seq"] = self.seq
+        return data
+
+    def size(self) -> int:
+        return sys.getsizeof(self.text) + MESSAGE_OVERHEAD
+
+
+class Session:
+    # One conversation: the newest `window` messages as a ring buffer with seq cursors, its own lock and
+    # its own history store. Older messages stay in the store and are paged in by load_older().
+    def __init__(self, sid: str, store, state_file: Path, window: int = DEFAULT_HISTORY_WINDOW):
+        self.id = sid
+        self.store = store
+        self.state_file = state_file
+        self.lock = TimedLock("session")
+        self.window = max(MIN_HISTORY_WINDOW, window)
+        self.history = deque()
+        self.seq = 0
+        self.floor = 0
+        self.older = 0
+        self.epoch = uuid4().hex[:12]
+        self.size = 0
+        self.active = 0
+        self.summary = RollingSummary()
+        self.render_cache = RenderCache()
+        if not self._restore():
+            # Only the tail of today is read; the summary counts what was skipped.
+            page = store.load_today_tail(self.window)
+            skipped = page["total"] - len(page["history"])
+            self.older = skipped
+            self.summary.skip(skipped)
+            for item in page["history"]:
+                self.append(item)
+
+    def _restore(self) -> bool:
+        # State saved on eviction keeps cursors valid; it only applies to the day it was written.
+        if not self.state_file.exists():
+            return False
+        try:
+            state = json.loads(self.state_file.read_text(encoding="utf-8"))
+        except Exception:
+            return False
+        if not isinstance(state, dict) or state.get("date") != datetime.now().strftime("%Y-%m-%d"):
+            return False
+        self.epoch = str(state.get("epoch") or self.epoch)
+        self.floor = int(state.get("floor") or 0)
+        self.older = int(state.get("older") or 0)
+        self.summary.skip(self.older)
+        for item in state.get("history") or []:
+            if isinstance(item, dict):
+                self.append(item)
+        self.seq = max(self.seq, int(state.get("seq") or 0))
+        return True
+
+    def append(self, message: Dict):
+        # Caller holds self.lock. seq only grows, even across resets, so clients can ask for deltas.
+        # A new message gets its seq set in place, since callers also store and return it; a stored row
+        # keeps the seq it was written with, so cursors keep matching the day file.
+        seq = message.get("seq")
+        if isinstance(seq, int):
+            self.seq = max(self.seq, seq)
+        else:
+            self.seq += 1
+            message["seq"] = self.seq
+        record = Message(message)
+        self.history.append(record)
+        self.size += record.size()
+        self.summary.push(self.history)
+        if len(self.history) > self.window:
+            self.size -= self.history.popleft().size()
+            self.older += 1
+
+    def messages(self) -> List[Dict]:
+        return [item.to_dict() for item in self.history]
+
+    def prompt_rows(self) -> List[Message]:
+        # The messages the rolling summary has not folded yet: the newest RECENT_WINDOW.
+        return list(islice(self.history, max(0, len(self.history) - RECENT_WINDOW), None))
+
+    def delta(self, since: Optional[int], epoch: Optional[str]) -> Dict:
+        # A different epoch means a restart or reset happened since the client's cursor, and a cursor
+        # older than the buffer cannot be continued; both get the whole buffer.
+        oldest = self.history[0].seq if self.history else self.seq + 1
+        if since is None or since > self.seq or (epoch and epoch != self.epoch) or since < oldest - 1:
+            messages, full = self.messages(), True
+        else:
+            messages, full = [], False
+            for item in reversed(self.history):
+                if item.seq <= since:
+                    break
+                messages.append(item.to_dict())
+            messages.reverse()
+        return {"messages": messages, "cursor": self.seq, "epoch": self.epoch, "full": full, "older": self.older}
+
+    def load_older(self, before: Optional[int] = None, limit: int = 50) -> Dict:
+        # Messages older than seq `before` (default: the oldest in memory), read from the store's day file
+        # of that message. Only messages after the last reset are returned, and only from that day.
+        if before is None:
+            before = self.history[0].seq if self.history else self.seq + 1
+        anchor = next((item for item in self.history if item.seq >= before), None)
+        stamp = anchor.get("time") if anchor else ""
+        date_str = stamp[:10] if len(stamp) >= 10 else datetime.now().strftime("%Y-%m-%d")
+        total = self.store.load_date_tail(date_str, 1)["total"]
+
+        def seq_at(index: int) -> int:
+            rows = self.store.load_date_page(date_str, index, 1)["history"]
+            return _seq(rows[0]) if rows else 0
+
+        # Day files are append-only in seq order, so the first row at or past `before` is a binary search.
+        lo, hi = 0, total
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if seq_at(mid) < before:
+                lo = mid + 1
+            else:
+                hi = mid
+        start = max(0, lo - max(1, limit))
+        rows = self.store.load_date_page(date_str, start, lo - start)["history"] if lo > start else []
+        seqs = [_seq(row) for row in rows]
+        if any(a >= b for a, b in zip(seqs, seqs[1:])) or (seqs and seqs[-1] >= before):
+            # Files written while overlapping rounds stored a round's rows at its end are not in seq
+            # order; for those the day is filtered and sorted instead.
+            return self._load_older_unordered(date_str, before, limit)
+        messages = [row for row in rows if _seq(row) > self.floor or not self.floor]
+        more = start > 0 and len(messages) == len(rows) and (not self.floor or seq_at(start - 1) > self.floor)
+        return {"messages": messages, "before": before, "more": more}
+
+    def _load_older_unordered(self, date_str: str, before: int, limit: int) -> Dict:
+        rows = sorted(
+            (
+                row for row in self.store.load_date_history(date_str)
+                if _seq(row) < before and (_seq(row) > self.floor or not self.floor)
+            ),
+            key=_seq,
+        )
+        limit = max(1, limit)
+        return {"messages": rows[-limit:], "before": before, "more": len(rows) > limit}
+
+    def reset(self) -> Dict:
+        self.history = deque()
+        self.size = 0
+        self.floor = self.seq
+        self.older = 0
+        self.summary = RollingSummary()
+        self.epoch = uuid4().hex[:12]
+        return {"cursor": self.seq, "epoch": self.epoch, "older": 0}
+
+    def save_state(self):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_file.with_name(f".{self.state_file.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "floor": self.floor,
+            "older": self.older,
+            "history": self.messages(),
+        }, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.state_file)
+
+
+class SessionManager:
+    # Loaded sessions are kept in LRU order. Past max_loaded sessions or the memory budget (history plus
+    # store indexes), idle ones are written to data/sessions/<id>/state.json, their stores closed, and
+    # reloaded on next use. The default session is pinned. Stores are opened outside the manager lock;
+    # concurrent users of a session that is still loading wait on its future.
+    def __init__(
+        self,
+        create_store: Callable[[str], object],
+        state_dir: Path,
+        max_loaded: int = DEFAULT_MAX_LOADED,
+        memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+        history_window: int = DEFAULT_HISTORY_WINDOW,
+    ):
+        self.create_store = create_store
+        self.state_dir = state_dir
+        self.max_loaded = max(1, max_loaded)
+        self.history_window = history_window
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._lock = Lock()
+        self._evictions = 0
+        self.default = self._sessions[DEFAULT_SESSION] = self._open(DEFAULT_SESSION)
+
+    def _open(self, sid: str) -> Session:
+        # Reads the store's indexes and the tail of today: called without self._lock.
+        return Session(sid, self.create_store(sid), self.state_dir / sid / "state.json", self.history_window)
+
+    def acquire(self, sid: Optional[str] = None) -> Session:
+        # Marks the session in use (never evicted) until release(); may block on disk while it loads.
+        sid = session_id(sid)
+        while True:
+            with self._lock:
+                session = self._sessions.get(sid)
+                if session is not None:
+                    self._sessions.move_to_end(sid)
+                    session.active += 1
+                    return session
+                loading = self._loading.get(sid)
+                leader = loading is None
+                if leader:
+                    loading = self._loading[sid] = Future()
+            if not leader:
+                # A load or unload of the same id is in progress; a loader's error is raised here. Afterwards
+                # the session is picked up, or opened again, above.
+                loading.result()
+                continue
+            try:
+                session = self._open(sid)
+            except BaseException as exc:
+                with self._lock:
+                    del self._loading[sid]
+                loading.set_exception(exc)
+                raise
+            with self._lock:
+                del self._loading[sid]
+                self._sessions[sid] = session
+                session.active += 1
+            loading.set_result(session)
+            return session
+
+    def release(self, session: Session):
+        # Eviction is attempted when a session is released; victims are written out after the lock is dropped.
+        with self._lock:
+            session.active -= 1
+            victims = self._evict()
+        self._unload(victims)
+
+    @contextmanager
+    def use(self, sid: Optional[str] = None):
+        session = self.acquire(sid)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    @staticmethod
+    def _footprint(session: Session) -> int:
+        return session.size + session.store.memory_bytes()
+
+    def _evict(self) -> List[tuple]:
+        # Caller holds self._lock. Picks idle sessions to unload and parks a future under their id, so
+        # acquire() waits for the state to be written before it opens the session again.
+        total = sum(self._footprint(s) for s in self._sessions.values())
+        victims = []
+        for sid in list(self._sessions):
+            if len(self._sessions) <= self.max_loaded and total <= self.memory_budget:
+                break
+            session = self._sessions[sid]
+            if session is self.default or session.active:
+                continue
+            total -= self._footprint(session)
+            del self._sessions[sid]
+            unloading = self._loading[sid] = Future()
+            victims.append((sid, session, unloading))
+            self._evictions += 1
+        return victims
+
+    def _unload(self, victims: List[tuple]):
+        # Called without self._lock: saving state and closing a store flush files to disk.
+        for sid, session, unloading in victims:
+            try:
+                with session.lock:
+                    session.save_state()
+                    session.store.close()
+            finally:
+                with self._lock:
+                    del self._loading[sid]
+                unloading.set_result(None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            loading, evictions = len(self._loading), self._evictions
+        return {
+            "loaded": len(sessions),
+            "bytes": sum(s.size for s in sessions),
+            "index_bytes": sum(s.store.memory_bytes() for s in sessions),
+            "loading": loading,
+            "max_loaded": self.max_loaded,
+            "memory_budget": self.memory_budget,
+            "evictions": evictions,
+        }
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            if session is not self.default:
+                session.save_state()
+            session.store.close()
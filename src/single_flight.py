@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import asyncio
+from threading import Event, Lock
+from typing import Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.error = None
+
+
+class _LeaderCancelled(Exception):
+    # Set on a shared future when its leader was cancelled; followers run the call again themselves.
+    pass
+
+
+class SingleFlight:
+    # Concurrent callers with the same key share one execution of fn and all receive its outcome.
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._async_calls: Dict[Hashable, asyncio.Future] = {}
+        self._lock = Lock()
+        self._stats = {"executions": 0, "shared": 0, "retried": 0}
+
+    def do(self, key: Hashable, fn: Callable, retry_on: Tuple[type, ...] = ()) -> Tuple[object, bool]:
+        # retry_on: errors that belong to the leader alone (e.g. its own cancellation); followers that
+        # see one run fn again instead of failing with it.
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                    self._stats["executions"] += 1
+                else:
+                    self._stats["shared"] += 1
+            if leader:
+                break
+            call.done.wait()
+            if call.error is None:
+                return call.result, True
+            if not isinstance(call.error, retry_on):
+                raise call.error
+            with self._lock:
+                self._stats["retried"] += 1
+
+        try:
+            call.result = fn()
+        except Exception as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    async def do_async(self, key: Hashable, fn: Callable) -> Tuple[object, bool]:
+        # Event-loop twin of do(); fn returns an awaitable. Followers are shielded, so one of them
+        # being cancelled does not cancel the shared call.
+        while True:
+            with self._lock:
+                future = self._async_calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._async_calls[key] = asyncio.get_running_loop().create_future()
+                    self._stats["executions"] += 1
+                else:
+                    self._stats["shared"] += 1
+            if leader:
+                break
+            try:
+                return await asyncio.shield(future), True
+            except _LeaderCancelled:
+                with self._lock:
+                    self._stats["retried"] += 1
+
+        try:
+            result = await fn()
+        except BaseException as exc:
+            # A cancelled leader hands the call to its followers instead of cancelling or failing them.
+            error = exc if isinstance(exc, Exception) else _LeaderCancelled()
+            future.set_exception(error)
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._async_calls.pop(key, None)
+        future.set_result(result)
+        return result, False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls) + len(self._async_calls)}
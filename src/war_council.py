@@ -1,14 +1,19 @@
 #!/usr/bin/env python3
+import argparse
+
+from sessions import DEFAULT_SESSION, session_id
 from war_council_core import WarCouncil
 
 
 def print_help():
     print("\n可用命令：")
     print("  @代号 内容               与指定军师对话，可一次@多个")
-    print("  /c 内容                  全体军师协作讨论（顺序发言）")
+    print("  /c 内容                  全体军师协作讨论（顺序发言；--quorum/--deadline-ms 时先到先答）")
     print("  /models                  查看已注册军师")
-    print("  /add 代号 传输 命令...    动态添加军师；传输=mock|stdin|arg")
+    print("  /refresh                 重新解析军师命令路径（安装或升级 CLI 后使用）")
+    print("  /add 代号 传输 命令...    动态添加军师；传输=mock|stdin|arg|session")
     print("  /history                 查看会话历史")
+    print("  /session [名称]          查看或切换会话（各会话历史独立）")
     print("  /help                    查看帮助")
     print("  /exit                    退出\n")
 
@@ -25,19 +30,38 @@ def show_models(models):
         else:
             args = " ".join(model.get("args", []))
             command = f"{model.get('cmd', '')} {args}".strip()
+            command += f" [{model['resolved_cmd']}]" if model.get("resolved_cmd") else " [未找到命令]"
         print(f"{i}. {model.get('alias', '未知')} | {transport} | {command}")
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="军议 AI 聊天工具")
+    parser.add_argument("--quorum", type=int, default=None, help="/c 协作时收到 k 位军师回复即结束本轮")
+    parser.add_argument("--deadline-ms", type=int, default=None, help="/c 协作本轮最长等待毫秒数，超时未答者被中止")
+    return parser.parse_args(argv)
+
+
 def main():
+    args = parse_args()
+    collaborate = True
+    if args.quorum is not None or args.deadline_ms is not None:
+        collaborate = {"quorum": args.quorum, "deadline_ms": args.deadline_ms}
     council = WarCouncil()
+    try:
+        run_loop(council, collaborate)
+    finally:
+        council.close()
 
+
+def run_loop(council: WarCouncil, collaborate=True):
     print("军议系统已启动。主公，请下令。")
     print("提示：使用 @代号 进行点名，例如：@诸葛亮 给我一份三步计划")
     print_help()
+    session = None
 
     while True:
         try:
-            line = input("主公> ").strip()
+            line = input(f"主公[{session}]> " if session else "主公> ").strip()
         except (EOFError, KeyboardInterrupt):
             print("\n军议结束。")
             return
@@ -57,8 +81,27 @@ def main():
             show_models(council.get_models())
             continue
 
+        if line == "/refresh":
+            show_models(council.refresh_models())
+            continue
+
         if line == "/history":
-            print(council.render_history())
+            print(council.render_history(council.get_history(session)))
+            continue
+
+        if line == "/session" or line.startswith("/session "):
+            name = line[len("/session"):].strip()
+            if not name:
+                print(f"当前会话：{session or '默认'}")
+                continue
+            try:
+                session = session_id(name)
+            except ValueError as exc:
+                print(str(exc))
+                continue
+            if session == DEFAULT_SESSION:
+                session = None
+            print(f"已切换到会话：{session or '默认'}")
             continue
 
         if line.startswith("/add "):
@@ -71,15 +114,17 @@ def main():
 
         if line.startswith("/c "):
             try:
-                result = council.chat(line[3:].strip(), collaborate=True)
+                result = council.chat(line[3:].strip(), collaborate=collaborate, session=session)
                 for reply in result["replies"]:
                     print(f"\n{reply['speaker']}> {reply['text']}\n")
+                if result.get("cut_off"):
+                    print(f"（未及发言：{'、'.join(result['cut_off'])}）\n")
             except ValueError as exc:
                 print(str(exc))
             continue
 
         try:
-            result = council.chat(line, collaborate=False)
+            result = council.chat(line, collaborate=False, session=session)
             for reply in result["replies"]:
                 print(f"\n{reply['speaker']}> {reply['text']}\n")
         except ValueError as exc:
@@ -1,17 +1,61 @@
 #!/usr/bin/env python3
+import asyncio
 import json
+import queue
 import re
 import shutil
 import shlex
 import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 from pathlib import Path
-from threading import Lock
-from typing import List, Optional
+from threading import Lock, Thread, Timer
+from typing import Callable, Dict, List, Optional
 try:
+    from async_cli import run_streaming_async
+    from cli_output import (
+        DEFAULT_MAX_LINE_BYTES, DEFAULT_MAX_REPLY_BYTES, DEFAULT_MAX_STDERR_BYTES, READ_CHUNK_BYTES, CliOutputParser,
+        LineSplitter, TailBuffer, normalize_cli_output, open_spill, output_options,
+    )
+    from cmd_resolver import RESOLVED_FIELDS, CommandResolver
+    from history_archive import DEFAULT_CODEC, DEFAULT_INTERVAL, DEFAULT_KEEP_DAYS, ArchiveTask
+    from history_sqlite import SqliteHistoryStore
     from history_store import HistoryStore
+    from metrics import (
+        INVOKE_FAILURES, INVOKE_SECONDS, PROMPT_BUILD_SECONDS, RECALL_SECONDS, RUN_SECONDS, SPAWN_SECONDS,
+        STDOUT_BYTES, TimedLock,
+    )
+    from prompt_context import RoundContext, context_digest
+    from reply_cache import ReplyCache, cache_options
+    from resilience import (
+        CallCancelled, CancelToken, CircuitBreaker, LatencyTracker, kill_process_tree, resilience_options,
+    )
+    from sessions import DEFAULT_HISTORY_WINDOW, DEFAULT_SESSION, SessionManager
+    from single_flight import SingleFlight
+    from worker_pool import WorkerPools, WorkerTimeout
 except ImportError:
+    from .async_cli import run_streaming_async
+    from .cli_output import (
+        DEFAULT_MAX_LINE_BYTES, DEFAULT_MAX_REPLY_BYTES, DEFAULT_MAX_STDERR_BYTES, READ_CHUNK_BYTES, CliOutputParser,
+        LineSplitter, TailBuffer, normalize_cli_output, open_spill, output_options,
+    )
+    from .cmd_resolver import RESOLVED_FIELDS, CommandResolver
+    from .history_archive import DEFAULT_CODEC, DEFAULT_INTERVAL, DEFAULT_KEEP_DAYS, ArchiveTask
+    from .history_sqlite import SqliteHistoryStore
     from .history_store import HistoryStore
+    from .metrics import (
+        INVOKE_FAILURES, INVOKE_SECONDS, PROMPT_BUILD_SECONDS, RECALL_SECONDS, RUN_SECONDS, SPAWN_SECONDS,
+        STDOUT_BYTES, TimedLock,
+    )
+    from .prompt_context import RoundContext, context_digest
+    from .reply_cache import ReplyCache, cache_options
+    from .resilience import (
+        CallCancelled, CancelToken, CircuitBreaker, LatencyTracker, kill_process_tree, resilience_options,
+    )
+    from .sessions import DEFAULT_HISTORY_WINDOW, DEFAULT_SESSION, SessionManager
+    from .single_flight import SingleFlight
+    from .worker_pool import WorkerPools, WorkerTimeout
 
 SYSTEM_PROMPT = "\n".join([
     "你正在参加一场军议。",
@@ -20,15 +64,51 @@ SYSTEM_PROMPT = "\n".join([
     "请保持尊重，避免空话，输出聚焦结论和下一步。",
 ])
 
+DEFAULT_MAX_CONCURRENCY = 4
+TRANSPORTS = {"mock", "stdin", "arg", "session"}
+
+
+def _failure_reason(exc: BaseException) -> str:
+    if isinstance(exc, (CallCancelled, asyncio.CancelledError)):
+        return "cancelled"
+    if isinstance(exc, TimeoutError) or isinstance(exc.__cause__, (TimeoutError, WorkerTimeout)):
+        return "timeout"
+    return "error"
+
+
+def _observe_invoke(model, outcome: str, elapsed: float):
+    alias = model.get("alias", "未知")
+    INVOKE_SECONDS.observe(elapsed, alias=alias, transport=model.get("transport", "mock"), outcome=outcome)
+    if outcome in ("error", "timeout"):
+        INVOKE_FAILURES.inc(alias=alias, reason=outcome)
+
+
+def _observe_process(alias: str, stats: Dict):
+    # stats from _run_streaming/run_streaming_async; empty if the process never started.
+    if "spawn_s" in stats:
+        SPAWN_SECONDS.observe(stats["spawn_s"], alias=alias)
+        RUN_SECONDS.observe(stats["run_s"], alias=alias)
+        STDOUT_BYTES.inc(stats["stdout_bytes"], alias=alias)
+
 
 class WarCouncil:
     def __init__(self, models_file: Optional[Path] = None):
         self.models_file = models_file or (Path.cwd() / "models.json")
         self.memory_dir = Path.cwd() / "data" / "history"
-        self.lock = Lock()
-        self.store = HistoryStore(self.memory_dir)
+        self.debug_dir = Path.cwd() / "data" / "debug" / "cli"
+        # self.lock guards models/config; each session has its own lock for history.
+        self.lock = TimedLock("council")
+        self.config = {}
+        self.resolver = CommandResolver()
+        self._models_mtime = None
         self.models = self._bootstrap_models()
-        self.history = self.store.load_today_history()
+        self.sessions = self._create_sessions()
+        self.workers = WorkerPools(self.resolver)
+        self.reply_cache = ReplyCache(Path.cwd() / "data" / "cache" / "replies")
+        self.inflight = SingleFlight()
+        self.latency = LatencyTracker()
+        self.breakers = CircuitBreaker()
+        self.archiver = self._create_archiver()
 
     @staticmethod
     def now_iso() -> str:
@@ -48,14 +128,123 @@ class WarCouncil:
         file.write_text(json.dumps(data, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
 
     def _bootstrap_models(self):
-        existing = self.safe_read_json(self.models_file)
-        if existing and isinstance(existing.get("models"), list):
-            return existing["models"]
+        existing = self._load_models_file()
+        if existing is not None:
+            return existing
 
         models = [{"alias": "诸葛亮", "description": "内置演示模型", "transport": "mock", "cmd": "", "args": []}]
         self.write_json(self.models_file, {"models": models})
+        self._models_mtime = self._stat_models_file()
         return models
 
+    def _stat_models_file(self):
+        try:
+            return self.models_file.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _load_models_file(self):
+        # Reads models.json and resolves every model's cmd once; None if the file is missing or invalid.
+        mtime = self._stat_models_file()
+        existing = self.safe_read_json(self.models_file)
+        if not existing or not isinstance(existing.get("models"), list):
+            return None
+        self.config = {k: v for k, v in existing.items() if k != "models"}
+        self._models_mtime = mtime
+        return [self.resolver.annotate(m) for m in existing["models"] if isinstance(m, dict)]
+
+    def _reload_models_if_changed(self):
+        # Caller holds self.lock. A stat per round; models.json edits are picked up and re-resolved.
+        if self._stat_models_file() == self._models_mtime:
+            return
+        models = self._load_models_file()
+        if models is not None:
+            self.models = models
+
+    def refresh_models(self):
+        # Forgets the login-shell snapshot and cached paths, then reloads and re-resolves every model.
+        self.resolver.refresh()
+        with self.lock:
+            models = self._load_models_file()
+            if models is None:
+                models = [self.resolver.annotate(m) for m in self.models]
+            self.models = models
+            return list(self.models)
+
+    def _create_store(self, session: str = DEFAULT_SESSION):
+        # "history": {"backend": "sqlite", "path": "data/history.sqlite3"} switches storage backends.
+        # Named sessions keep their own store under data/sessions/<id>/.
+        options = self.config.get("history") if isinstance(self.config.get("history"), dict) else {}
+        backend = options.get("backend", "jsonl")
+        if backend not in ("jsonl", "sqlite"):
+            raise ValueError(f"未知的历史存储后端: {backend}")
+        if session != DEFAULT_SESSION:
+            root = Path.cwd() / "data" / "sessions" / session
+            if backend == "sqlite":
+                return SqliteHistoryStore(root / "history.sqlite3")
+            return HistoryStore(root / "history")
+        if backend == "sqlite":
+            return SqliteHistoryStore(Path.cwd() / options.get("path", "data/history.sqlite3"))
+        return HistoryStore(self.memory_dir)
+
+    def _create_archiver(self) -> Optional[ArchiveTask]:
+        # "history": {"archive": {"keep_days": 2, "codec": "gzip", "interval_s": 3600}} compacts closed JSONL
+        # day files of every session into compressed segments in the background; stores read both forms.
+        options = self.config.get("history") if isinstance(self.config.get("history"), dict) else {}
+        archive = options.get("archive")
+        if not isinstance(archive, dict) or options.get("backend", "jsonl") != "jsonl":
+            return None
+
+        def roots():
+            return [self.memory_dir, *sorted((Path.cwd() / "data" / "sessions").glob("*/history"))]
+
+        task = ArchiveTask(
+            roots,
+            keep_days=int(archive.get("keep_days", DEFAULT_KEEP_DAYS)),
+            codec=str(archive.get("codec", DEFAULT_CODEC)),
+            interval=float(archive.get("interval_s", DEFAULT_INTERVAL)),
+        )
+        task.start()
+        return task
+
+    def _create_sessions(self) -> SessionManager:
+        # "sessions": {"max_loaded": 64, "memory_budget_mb": 64, "history_window": 256} bounds sessions kept
+        # in memory and the messages each keeps; older messages are read back from its store on demand.
+        options = self.config.get("sessions") if isinstance(self.config.get("sessions"), dict) else {}
+        return SessionManager(
+            self._create_store,
+            Path.cwd() / "data" / "sessions",
+            max_loaded=int(options.get("max_loaded", 64)),
+            memory_budget_mb=float(options.get("memory_budget_mb", 64)),
+            history_window=int(options.get("history_window", DEFAULT_HISTORY_WINDOW)),
+        )
+
+    @property
+    def history(self):
+        return self.sessions.default.history
+
+    @property
+    def store(self):
+        return self.sessions.default.store
+
+    def _save_models(self):
+        # Resolved paths are machine-specific and recomputed on load, so they stay out of models.json.
+        models = [{k: v for k, v in m.items() if k not in RESOLVED_FIELDS} for m in self.models]
+        self.write_json(self.models_file, {**self.config, "models": models})
+        self._models_mtime = self._stat_models_file()
+
+    @property
+    def parallel_dispatch(self) -> bool:
+        return self.config.get("dispatch") == "parallel"
+
+    @property
+    def max_concurrency(self) -> int:
+        try:
+            value = int(self.config.get("max_concurrency", DEFAULT_MAX_CONCURRENCY))
+        except (TypeError, ValueError):
+            value = DEFAULT_MAX_CONCURRENCY
+        return max(1, value)
+
     def render_history(self, history_items=None):
         rows = self.history if history_items is None else history_items
         if not rows:
@@ -65,19 +254,18 @@ class WarCouncil:
             lines.append(f"{i}. [{item['time']}] {item['speaker']}({item['role']}): {item['text']}")
         return "\n".join(lines)
 
-    def build_prompt(self, alias: str, content: str):
-        recent = self.history[-30:]
-        notes = self.store.recall_notes_for_query(content, limit=3)
-        return "\n\n".join([
-            f"【系统设定】\n{SYSTEM_PROMPT}",
-            f"【你的身份】\n你是军师「{alias}」。",
-            "【近期会话（节选）】\n仅展示最近30条消息，避免上下文过长。",
-            self.render_history(recent),
-            "【往日相关记忆（按日期摘要）】\n如与当前问题相关，可据此回忆历史决策。",
-            notes or "(暂无历史摘要)",
-            f"【本轮主公问题】\n{content}",
-            "请直接给出回答。",
-        ])
+    def build_prompt(self, alias: str, content: str, history_items=None, notes=None, summary=None, model=None):
+        # One-off prompt outside a round; rounds share a RoundContext across their advisors instead.
+        with self.sessions.use() as sess, sess.lock:
+            if history_items is None:
+                history_items, summary = sess.prompt_rows(), sess.summary.snapshot()
+            cache = sess.render_cache
+        if notes is None:
+            notes = self.store.recall_notes_for_query(content, limit=3)
+        if model is None:
+            with self.lock:
+                model = next((m for m in self.models if m.get("alias") == alias), None)
+        return RoundContext(SYSTEM_PROMPT, content, history_items, summary, notes, cache).prompt(alias, model)
 
     def extract_mentions(self, line: str):
         aliases = [m.get("alias") for m in self.models if m.get("alias")]
@@ -89,219 +277,290 @@ class WarCouncil:
         content = re.sub(r"@([^\s@]+)", "", line).strip()
         return unique, content
 
-    def invoke_model(self, model, prompt: str) -> str:
+    def invoke_model(
+        self, model, prompt: str, on_delta: Optional[Callable[[str], None]] = None, token: Optional[CancelToken] = None
+    ) -> str:
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return self._invoke_model(model, prompt, on_delta, token)
+        except BaseException as exc:
+            outcome = _failure_reason(exc)
+            raise
+        finally:
+            _observe_invoke(model, outcome, time.perf_counter() - started)
+
+    def _invoke_model(self, model, prompt: str, on_delta=None, token: Optional[CancelToken] = None) -> str:
         transport = model.get("transport", "mock")
         alias = model.get("alias", "未知")
+        timeout_s = resilience_options(model)["timeout_s"]
 
         if transport == "mock":
-            marker = "【本轮主公问题】\n"
-            question = ""
-            if marker in prompt:
-                question = prompt.split(marker, 1)[1].split("\n\n", 1)[0].strip()
-            return f"【{alias}】主公，建议先定目标、再定约束、最后定执行路径。\n你的问题：{question}"
+            text = self._mock_reply(alias, prompt)
+            if on_delta:
+                on_delta(text)
+            return text
+
+        if transport == "session":
+            limits = output_options(model)
+            spill = self._spill_for(model, [model.get("cmd", "")]) if limits["spill"] else None
+            try:
+                raw = self.workers.request(model, prompt, timeout_s, token, limits, spill)
+            except WorkerTimeout as exc:
+                raise RuntimeError(f"模型 {alias} 调用超时（{timeout_s:g} 秒），已终止会话进程") from exc
+            except Exception as exc:
+                if token and token.cancelled:
+                    raise CallCancelled(f"模型 {alias} 调用已取消") from exc
+                raise
+            STDOUT_BYTES.inc(len(raw.encode("utf-8")), alias=alias)
+            text = self._normalize_cli_output(raw.strip(), limits["max_reply_bytes"])
+            if text and on_delta:
+                on_delta(text)
+            return text or f"模型 {alias} 未返回内容"
+
+        run_args, stdin_data, env = self._command_for(model, prompt)
+        parser, on_line, limits = self._output_sink(model, run_args, on_delta)
+        stats = {}
+        try:
+            returncode, stderr = self._run_streaming(
+                run_args, stdin_data, on_line, timeout_s, token, stats, env, limits
+            )
+        except FileNotFoundError as exc:
+            raise RuntimeError(self._missing_command(model)) from exc
+        except TimeoutError as exc:
+            raise RuntimeError(f"模型 {alias} 调用超时（{timeout_s:g} 秒），已终止进程") from exc
+        except CallCancelled as exc:
+            raise CallCancelled(f"模型 {alias} 调用已取消") from exc
+        finally:
+            _observe_process(alias, stats)
+
+        self._check_exit(model, returncode, stderr)
+        parser.dropped_lines = stats.get("dropped_lines", 0)
+        return parser.result() or f"模型 {alias} 未返回内容"
 
+    def _output_sink(self, model, run_args: List[str], on_delta=None):
+        # (parser, on_line, limits) for one stdin/arg call; with "output": {"spill": true} every raw line
+        # also goes to data/debug/cli/<alias>.log, which rotates instead of growing.
+        limits = output_options(model)
+        parser = CliOutputParser(limits["max_reply_bytes"])
+        spill = self._spill_for(model, run_args) if limits["spill"] else None
+
+        def on_line(line: str):
+            if spill:
+                spill(line)
+            piece = parser.feed(line)
+            if piece and on_delta:
+                on_delta(piece)
+
+        return parser, on_line, limits
+
+    def _spill_for(self, model, run_args: List[str]) -> Callable[[str], None]:
+        alias = model.get("alias", "未知")
+        name = re.sub(r"[^\w.-]", "_", alias) or "_"
+        return open_spill(self.debug_dir / f"{name}.log", f"{self.now_iso()} {alias} {run_args[0]}")
+
+    @staticmethod
+    def _mock_reply(alias: str, prompt: str) -> str:
+        marker = "【本轮主公问题】\n"
+        question = ""
+        if marker in prompt:
+            question = prompt.split(marker, 1)[1].split("\n\n", 1)[0].strip()
+        return f"【{alias}】主公，建议先定目标、再定约束、最后定执行路径。\n你的问题：{question}"
+
+    def _command_for(self, model, prompt: str):
+        # (run_args, stdin_data, env) for the stdin/arg transports. cmd resolves through the resolver's
+        # cache, so steady-state calls cost a stat rather than a login-shell spawn.
+        transport = model.get("transport", "mock")
+        alias = model.get("alias", "未知")
         cmd = model.get("cmd", "")
-        args = list(model.get("args", []))
         if not cmd:
             raise RuntimeError(f"模型 {alias} 缺少 cmd")
 
-        run_args = [cmd] + args
+        path, via = self.resolver.resolve(cmd)
+        run_args = [path or cmd] + list(model.get("args", []))
         stdin_data = None
         if transport == "arg":
             if "{prompt}" in run_args:
-                run_args = [prompt if token == "{prompt}" else token for token in run_args]
+                run_args = [prompt if part == "{prompt}" else part for part in run_args]
             else:
                 run_args.append(prompt)
         elif transport == "stdin":
             stdin_data = prompt
         else:
             raise RuntimeError(f"模型 {alias} transport 不支持: {transport}")
+        return run_args, stdin_data, self.resolver.env_for(via)
 
-        try:
-            proc = subprocess.run(
-                run_args,
-                input=stdin_data,
-                text=True,
-                capture_output=True,
-                check=False,
-            )
-        except FileNotFoundError:
-            # Fallback: try resolving command through login shell PATH.
-            shell_cmd = " ".join(shlex.quote(x) for x in run_args)
-            proc = subprocess.run(
-                ["/bin/zsh", "-lc", shell_cmd],
-                input=stdin_data if transport == "stdin" else None,
-                text=True,
-                capture_output=True,
-                check=False,
-            )
-
-        if proc.returncode != 0:
-            err = proc.stderr.strip() or "无错误信息"
-            hint = ""
-            if "command not found" in err or "No such file or directory" in err:
-                resolved = shutil.which(cmd)
-                if resolved:
-                    hint = f"；已检测到命令路径 {resolved}，请确认服务进程有权限执行"
-                else:
-                    hint = f"；未找到命令 {cmd}，请用绝对路径或先在终端确认 `{cmd}` 可执行"
-            raise RuntimeError(f"模型 {alias} 返回非0({proc.returncode})：{err}{hint}")
-
-        out = proc.stdout.strip()
-        text = self._normalize_cli_output(out)
-        return text or f"模型 {alias} 未返回内容"
+    @staticmethod
+    def _missing_command(model) -> str:
+        cmd = model.get("cmd", "")
+        return (
+            f"模型 {model.get('alias', '未知')} 未找到命令 {cmd}（已查找服务 PATH 与登录 shell PATH）；"
+            "请用绝对路径，或安装后调用 POST /api/models/refresh 重新解析"
+        )
 
-    def _normalize_cli_output(self, out: str) -> str:
-        if not out:
-            return ""
+    @staticmethod
+    def _check_exit(model, returncode: int, stderr: str):
+        if returncode == 0:
+            return
+        alias = model.get("alias", "未知")
+        cmd = model.get("cmd", "")
+        err = stderr.strip() or "无错误信息"
+        hint = ""
+        if "command not found" in err or "No such file or directory" in err:
+            resolved = model.get("resolved_cmd") or shutil.which(cmd)
+            if resolved:
+                hint = f"；已检测到命令路径 {resolved}，请确认服务进程有权限执行"
+            else:
+                hint = f"；未找到命令 {cmd}，请用绝对路径或先在终端确认 `{cmd}` 可执行"
+        raise RuntimeError(f"模型 {alias} 返回非0({returncode})：{err}{hint}")
 
-        lines = [line.strip() for line in out.splitlines() if line.strip()]
-        if not lines:
-            return ""
+    @staticmethod
+    def _run_streaming(
+        run_args: List[str],
+        stdin_data: Optional[str],
+        on_line: Callable[[str], None],
+        timeout: Optional[float] = None,
+        token: Optional[CancelToken] = None,
+        stats: Optional[Dict] = None,
+        env: Optional[Dict[str, str]] = None,
+        limits: Optional[Dict] = None,
+    ):
+        # The process is killed when `timeout` elapses (TimeoutError) or `token` is cancelled (CallCancelled).
+        # `stats`, if given, receives spawn_s, run_s, stdout_bytes and dropped_lines. `limits` (output_options)
+        # caps a single stdout line and the stderr kept for error messages; nothing else is buffered.
+        limits = limits or {}
+        started = time.perf_counter()
+        proc = subprocess.Popen(
+            run_args,
+            env=env,
+            stdin=subprocess.PIPE if stdin_data is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            start_new_session=True,
+        )
+        spawned = time.perf_counter()
+        stdout_bytes = 0
+        splitter = LineSplitter(limits.get("max_line_bytes", DEFAULT_MAX_LINE_BYTES))
+        stderr_tail = TailBuffer(limits.get("max_stderr_bytes", DEFAULT_MAX_STDERR_BYTES))
 
-        json_objs = []
-        for line in lines:
+        def feed_stdin():
             try:
-                obj = json.loads(line)
-                if isinstance(obj, dict):
-                    json_objs.append(obj)
-            except Exception:
+                proc.stdin.write(stdin_data.encode("utf-8"))
+            except (BrokenPipeError, OSError):
                 pass
+            finally:
+                try:
+                    proc.stdin.close()
+                except (BrokenPipeError, OSError):
+                    pass
+
+        def drain_stderr():
+            for chunk in iter(lambda: proc.stderr.read(READ_CHUNK_BYTES), b""):
+                stderr_tail.add(chunk)
+
+        # stdin and stderr are pumped on side threads so a chatty CLI cannot deadlock the stdout reader.
+        helpers = [Thread(target=drain_stderr, daemon=True)]
+        if stdin_data is not None:
+            helpers.append(Thread(target=feed_stdin, daemon=True))
+        for helper in helpers:
+            helper.start()
+        expired = []
+        timer = None
+        if timeout:
+            def expire():
+                expired.append(True)
+                kill_process_tree(proc)
+            timer = Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+        if token:
+            token.register(proc)
+        try:
+            for chunk in iter(lambda: proc.stdout.read(READ_CHUNK_BYTES), b""):
+                stdout_bytes += len(chunk)
+                for line in splitter.feed(chunk):
+                    on_line(line)
+            for line in splitter.close():
+                on_line(line)
+        finally:
+            proc.stdout.close()
+            proc.wait()
+            if stats is not None:
+                stats.update(
+                    spawn_s=spawned - started,
+                    run_s=time.perf_counter() - spawned,
+                    stdout_bytes=stdout_bytes,
+                    dropped_lines=splitter.dropped,
+                )
+            if timer:
+                timer.cancel()
+            if token:
+                token.unregister(proc)
+            for helper in helpers:
+                helper.join()
+            proc.stderr.close()
+        if expired:
+            raise TimeoutError(f"超过 {timeout:g} 秒")
+        if token and token.cancelled:
+            raise CallCancelled("调用已取消")
+        return proc.returncode, stderr_tail.text()
 
-        if not json_objs:
-            return out
-
-        pieces = []
-        for obj in json_objs:
-            text = self._extract_text_from_json_obj(obj)
-            if text:
-                pieces.append(text)
-
-        # Keep order but remove duplicates commonly seen in stream-json + final result events.
-        seen = set()
-        deduped = []
-        for p in pieces:
-            t = p.strip()
-            if not t or t in seen:
-                continue
-            seen.add(t)
-            deduped.append(t)
-
-        cleaned = "\n".join(deduped).strip()
-        return cleaned or out
-
-    def _extract_text_from_json_obj(self, obj):
-        if not isinstance(obj, dict):
-            return ""
-
-        event_type = obj.get("type")
-        if isinstance(event_type, str):
-            if event_type == "item.completed":
-                item = obj.get("item")
-                if isinstance(item, dict):
-                    item_type = item.get("type")
-                    # Ignore internal reasoning traces; only surface assistant-facing text.
-                    if item_type in {"reasoning", "tool_call", "tool_result"}:
-                        return ""
-                    if item_type in {"agent_message", "assistant_message", "message"}:
-                        return self._stringify_text_value(item.get("text") or item.get("content"))
-            if event_type in {"response.output_text.delta", "response.output_text"}:
-                return self._stringify_text_value(obj.get("delta") or obj.get("text") or obj.get("output_text"))
-            if event_type in {"thread.started", "turn.started", "turn.completed"}:
-                return ""
-            # Qwen stream-json events
-            if event_type == "assistant":
-                message = obj.get("message")
-                if isinstance(message, dict):
-                    return self._extract_message_content_text(message)
-                return ""
-            if event_type == "result":
-                return self._stringify_text_value(obj.get("result"))
-            if event_type == "system":
-                return ""
-
-        candidates = []
-        preferred_keys = ["output_text", "text", "message", "content", "delta", "result", "output", "final"]
-        for key in preferred_keys:
-            if key in obj:
-                value = obj.get(key)
-                text = self._stringify_text_value(value)
-                if text:
-                    candidates.append(text)
-
-        if candidates:
-            return "\n".join(candidates).strip()
-
-        return ""
-
-    def _extract_message_content_text(self, message):
-        content = message.get("content")
-        if not isinstance(content, list):
-            return ""
-
-        parts = []
-        for item in content:
-            if not isinstance(item, dict):
-                continue
-            item_type = item.get("type")
-            if item_type == "text":
-                text = self._stringify_text_value(item.get("text"))
-                if text:
-                    parts.append(text)
-            # Explicitly ignore thinking blocks from providers like Qwen/Codex.
-            if item_type == "thinking":
-                continue
-
-        return "\n".join(parts).strip()
-
-    def _stringify_text_value(self, value):
-        if value is None:
-            return ""
-        if isinstance(value, str):
-            return value.strip()
-        if isinstance(value, list):
-            parts = []
-            for item in value:
-                text = self._stringify_text_value(item)
-                if text:
-                    parts.append(text)
-            return "\n".join(parts).strip()
-        if isinstance(value, dict):
-            for key in ["text", "content", "message", "output_text", "delta"]:
-                if key in value:
-                    text = self._stringify_text_value(value.get(key))
-                    if text:
-                        return text
-            for nested in value.values():
-                text = self._stringify_text_value(nested)
-                if text:
-                    return text
-            return ""
-        return ""
+    def _normalize_cli_output(self, out: str, max_reply_bytes: int = DEFAULT_MAX_REPLY_BYTES) -> str:
+        return normalize_cli_output(out, max_reply_bytes)
 
     def get_models(self):
         with self.lock:
             return list(self.models)
 
-    def get_history(self):
-        with self.lock:
-            return list(self.history)
+    def get_history(self, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.messages()
 
-    def get_date_history(self, date_str: str):
-        with self.lock:
-            return self.store.load_date_history(date_str)
+    def get_history_since(self, since: Optional[int] = None, epoch: Optional[str] = None, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.delta(since, epoch)
 
-    def list_memory_dates(self):
-        with self.lock:
-            return self.store.list_dates()
+    def get_history_before(self, before: Optional[int] = None, limit: int = 50, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.load_older(before, limit)
 
-    def search_memory_dates(self, query: str):
-        with self.lock:
-            return self.store.search_dates(query)
+    def get_date_history(self, date_str: str, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.store.load_date_history(date_str)
 
-    def reset_history(self):
-        with self.lock:
-            self.history = []
+    def get_date_history_page(self, date_str: str, cursor: int = 0, limit: int = 100, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.store.load_date_page(date_str, cursor, limit)
+
+    def get_date_history_tail(self, date_str: str, limit: int = 100, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.store.load_date_tail(date_str, limit)
+
+    def list_memory_dates(self, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.store.list_dates()
+
+    def search_memory_dates(self, query: str, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.store.search_dates(query)
+
+    def search_memory_messages(self, query: str, session: Optional[str] = None, **filters):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.store.search_messages(query, **filters)
+
+    def get_session_stats(self):
+        return self.sessions.stats()
+
+    def close(self):
+        if self.archiver:
+            self.archiver.close()
+        self.workers.close()
+        self.sessions.close()
+
+    def reset_history(self, session: Optional[str] = None):
+        with self.sessions.use(session) as sess, sess.lock:
+            return sess.reset()
 
     def add_model_from_string(self, rest: str):
         try:
@@ -322,8 +581,8 @@ class WarCouncil:
         if not alias.strip():
             raise ValueError("代号不能为空")
 
-        if transport not in {"mock", "stdin", "arg"}:
-            raise ValueError("传输方式必须是 mock|stdin|arg")
+        if transport not in TRANSPORTS:
+            raise ValueError("传输方式必须是 mock|stdin|arg|session")
 
         if transport != "mock" and not command_tokens:
             raise ValueError("非mock模型必须提供命令")
@@ -331,51 +590,565 @@ class WarCouncil:
         cmd = "" if transport == "mock" else command_tokens[0]
         args = [] if transport == "mock" else command_tokens[1:]
 
-        new_model = {"alias": alias, "transport": transport, "cmd": cmd, "args": args}
+        new_model = self.resolver.annotate({"alias": alias, "transport": transport, "cmd": cmd, "args": args})
         with self.lock:
             idx = next((i for i, m in enumerate(self.models) if m.get("alias") == alias), -1)
             if idx >= 0:
                 self.models[idx] = new_model
             else:
                 self.models.append(new_model)
-            self.write_json(self.models_file, {"models": self.models})
+            self._save_models()
 
         return new_model
 
-    def chat(self, text: str, collaborate: bool = False):
+    def _ask_advisor(
+        self, alias: str, model, prompt: str, ctx: RoundContext, on_event=None, use_cache: bool = True, extra_rows=()
+    ):
+        return self._ask_advisor_outcome(alias, model, prompt, ctx, on_event, use_cache, None, extra_rows)[0]
+
+    def _ask_advisor_outcome(
+        self, alias: str, model, prompt: str, ctx: RoundContext, on_event=None, use_cache: bool = True, token=None,
+        extra_rows=(),
+    ):
+        # Returns (message, ok); message is None when `token` cut the advisor off.
+        on_delta = None
+        if on_event:
+            def on_delta(piece: str):
+                on_event("delta", {"speaker": alias, "delta": piece})
+        key = self.reply_cache.make_key(model, ctx.cache_text(alias, model, extra_rows))
+        # Concurrent rounds of one session asking the same advisor with the same context share one
+        # invocation; a leader cut off by its own token hands the call to the followers.
+        flight = (ctx.session, use_cache, key)
+        try:
+            reply_text, shared = self.inflight.do(
+                flight, lambda: self._invoke_cached(alias, model, prompt, key, on_delta, use_cache, token),
+                retry_on=(CallCancelled,),
+            )
+            if shared and on_delta:
+                on_delta(reply_text)
+            ok = True
+        except Exception as exc:
+            if token and token.cancelled:
+                return None, False
+            reply_text = f"调用失败：{exc}"
+            ok = False
+        message = {"role": "assistant", "speaker": alias, "text": reply_text, "time": self.now_iso()}
+        if on_event:
+            on_event("reply", message)
+        return message, ok
+
+    def _invoke_cached(self, alias: str, model, prompt: str, key: str, on_delta, use_cache: bool, token=None) -> str:
+        # key: reply-cache key of the call, from RoundContext.cache_text rather than the rendered prompt.
+        options = cache_options(model)
+        if not options:
+            return self._invoke_resilient(alias, model, prompt, on_delta, token)
+        if not use_cache:
+            self.reply_cache.note_bypass(alias)
+            return self._invoke_resilient(alias, model, prompt, on_delta, token)
+
+        cached = self.reply_cache.get(alias, key, options)
+        if cached is not None:
+            if on_delta:
+                on_delta(cached)
+            return cached
+        # Only successful replies are cached; failures raise past this point.
+        reply_text = self._invoke_resilient(alias, model, prompt, on_delta, token)
+        self.reply_cache.put(alias, key, reply_text, options)
+        return reply_text
+
+    def _invoke_resilient(self, alias: str, model, prompt: str, on_delta, token=None) -> str:
+        breaker, delay = self._resilience_gate(alias, model)
+        try:
+            if delay is None:
+                text = self._invoke_timed(alias, model, prompt, on_delta, token)
+            else:
+                text = self._invoke_hedged(alias, model, prompt, on_delta, token, delay)
+        except CallCancelled:
+            if breaker:
+                self.breakers.abandon(alias)
+            raise
+        except Exception:
+            if breaker:
+                self.breakers.record(alias, False, breaker)
+            raise
+        if breaker:
+            self.breakers.record(alias, True, breaker)
+        return text
+
+    def _resilience_gate(self, alias: str, model):
+        # Fails fast while the breaker is open; returns (breaker options, hedging delay or None).
+        options = resilience_options(model)
+        breaker, hedge = options["breaker"], options["hedge"]
+        if breaker and not self.breakers.allow(alias, breaker):
+            retry_in = self.breakers.retry_in(alias, breaker)
+            raise RuntimeError(f"模型 {alias} 暂不可用：连续失败已熔断，约 {retry_in:.0f} 秒后重试")
+        delay = None
+        if hedge and model.get("transport", "mock") != "mock":
+            delay = self.latency.percentile(alias, hedge["percentile"], hedge["min_samples"])
+        return breaker, delay
+
+    @staticmethod
+    def _stream_owner(on_delta):
+        # Hedged attempts share one stream: whichever attempt emits first owns it.
+        owner = []
+        owner_lock = Lock()
+
+        def forward_for(idx: int):
+            def forward(piece: str):
+                with owner_lock:
+                    if not owner:
+                        owner.append(idx)
+                    mine = owner[0] == idx
+                if mine and on_delta:
+                    on_delta(piece)
+            return forward
+        return forward_for
+
+    def _invoke_timed(self, alias: str, model, prompt: str, on_delta, token=None) -> str:
+        started = time.monotonic()
+        text = self.invoke_model(model, prompt, on_delta=on_delta, token=token)
+        self.latency.record(alias, time.monotonic() - started)
+        return text
+
+    def _invoke_hedged(self, alias: str, model, prompt: str, on_delta, token, delay: float) -> str:
+        # A second attempt starts once the first outlives the alias's latency percentile.
+        # The first success wins and the other attempt is killed; deltas come from whichever attempt streams first.
+        results = queue.Queue()
+        tokens = [token.child() if token else CancelToken() for _ in range(2)]
+        forward_for = self._stream_owner(on_delta)
+
+        def attempt(idx: int):
+            try:
+                results.put((idx, self._invoke_timed(alias, model, prompt, forward_for(idx), tokens[idx]), None))
+            except Exception as exc:
+                results.put((idx, None, exc))
+
+        Thread(target=attempt, args=(0,), daemon=True).start()
+        launched = 1
+        try:
+            first = results.get(timeout=delay)
+        except queue.Empty:
+            first = None
+            Thread(target=attempt, args=(1,), daemon=True).start()
+            launched = 2
+
+        errors = []
+        while True:
+            idx, text, error = first if first is not None else results.get()
+            first = None
+            if error is None:
+                for other, sub in enumerate(tokens):
+                    if other != idx:
+                        sub.cancel()
+                return text
+            errors.append(error)
+            if len(errors) >= launched:
+                raise errors[0]
+
+    def get_cache_stats(self):
+        return {**self.reply_cache.stats(), "inflight": self.inflight.stats()}
+
+    def _dispatch_sequential(self, targets, ctx: RoundContext, on_event=None, use_cache: bool = True):
+        # Each advisor sees the replies given earlier in the same round.
+        replies = []
+        for alias, model in targets:
+            prompt = ctx.prompt(alias, model, replies)
+            replies.append(self._ask_advisor(alias, model, prompt, ctx, on_event, use_cache, list(replies)))
+        return replies
+
+    def _dispatch_parallel(
+        self, targets, ctx: RoundContext, max_workers: int, on_event=None, use_cache: bool = True
+    ):
+        if not targets:
+            return []
+        prompts = [ctx.prompt(alias, model) for alias, model in targets]
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as pool:
+            futures = [
+                pool.submit(self._ask_advisor, alias, model, prompt, ctx, on_event, use_cache)
+                for (alias, model), prompt in zip(targets, prompts)
+            ]
+            # Collect in target order so history stays deterministic.
+            return [future.result() for future in futures]
+
+    def _dispatch_quorum(
+        self, targets, ctx: RoundContext, quorum: int, deadline_ms: Optional[int],
+        max_workers: int, on_event=None, use_cache: bool = True,
+    ):
+        # Returns once `quorum` advisors answered successfully or the deadline passed; the rest are killed.
+        if not targets:
+            return [], []
+        prompts = [ctx.prompt(alias, model) for alias, model in targets]
+        root = CancelToken()
+        deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+        pool = ThreadPoolExecutor(max_workers=min(max_workers, len(targets)))
+        try:
+            futures = [
+                pool.submit(self._ask_advisor_outcome, alias, model, prompt, ctx, on_event, use_cache, root.child())
+                for (alias, model), prompt in zip(targets, prompts)
+            ]
+            pending = set(futures)
+            answered = 0
+            while pending and answered < quorum:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    break
+                answered += sum(1 for future in done if future.result()[1])
+            root.cancel()
+        finally:
+            # Cut-off advisors are killed; their threads finish on their own.
+            pool.shutdown(wait=False, cancel_futures=True)
+
+        replies, cut_off = [], []
+        for (alias, _), future in zip(targets, futures):
+            message = future.result()[0] if future.done() and not future.cancelled() else None
+            if message is None:
+                cut_off.append(alias)
+            else:
+                replies.append(message)
+        return replies, cut_off
+
+    @staticmethod
+    def _quorum_options(collaborate) -> Optional[Dict]:
+        # collaborate may be a plain flag or {"quorum": k, "deadline_ms": n}.
+        if not isinstance(collaborate, dict):
+            return None
+        try:
+            quorum = int(collaborate["quorum"]) if collaborate.get("quorum") is not None else None
+            deadline_ms = int(collaborate["deadline_ms"]) if collaborate.get("deadline_ms") is not None else None
+        except (TypeError, ValueError):
+            raise ValueError("quorum 和 deadline_ms 必须是整数")
+        if quorum is not None and quorum < 1:
+            raise ValueError("quorum 必须大于 0")
+        if deadline_ms is not None and deadline_ms < 1:
+            raise ValueError("deadline_ms 必须大于 0")
+        if quorum is None and deadline_ms is None:
+            return None
+        return {"quorum": quorum, "deadline_ms": deadline_ms}
+
+    def chat(
+        self,
+        text: str,
+        collaborate: bool = False,
+        on_event=None,
+        since: Optional[int] = None,
+        epoch: Optional[str] = None,
+        use_cache: bool = True,
+        session: Optional[str] = None,
+    ):
+        # on_event(name, data) receives "start", "delta", "reply" and "done" events as the round progresses.
+        # With `since`, the result carries every message after that cursor; otherwise only this round's.
+        # collaborate={"quorum": k, "deadline_ms": n} ends the round after k replies or n milliseconds.
+        with self.sessions.use(session) as sess:
+            rnd = self._begin_round(sess, text, collaborate, on_event)
+            targets, ctx, quorum, max_workers = rnd["targets"], rnd["context"], rnd["quorum"], rnd["max_workers"]
+
+            cut_off = []
+            if quorum:
+                # Quorum rounds always run concurrently; waiting in sequence would defeat the early return.
+                k = min(quorum["quorum"] or len(targets), len(targets))
+                replies, cut_off = self._dispatch_quorum(
+                    targets, ctx, k, quorum["deadline_ms"], max_workers, on_event, use_cache
+                )
+            elif rnd["parallel"]:
+                replies = self._dispatch_parallel(targets, ctx, max_workers, on_event, use_cache)
+            else:
+                replies = self._dispatch_sequential(targets, ctx, on_event, use_cache)
+            return self._finish_round(sess, rnd, replies, cut_off, on_event, since, epoch)
+
+    def _begin_round(self, sess, text: str, collaborate, on_event=None) -> Dict:
         content = text.strip()
         if not content:
             raise ValueError("请输入要咨询的内容")
+        quorum = self._quorum_options(collaborate) if collaborate else None
 
+        # Locks are held only to snapshot and commit; advisor calls run unlocked.
         with self.lock:
+            self._reload_models_if_changed()
             if collaborate:
-                targets = [m.get("alias") for m in self.models if m.get("alias")]
+                aliases = [m.get("alias") for m in self.models if m.get("alias")]
             else:
-                targets, content = self.extract_mentions(content)
-                if not targets:
+                aliases, content = self.extract_mentions(content)
+                if not aliases:
                     raise ValueError("请使用 @代号 指定军师，或开启全体协作")
                 if not content:
                     raise ValueError("请输入要咨询的内容")
 
-            self.history.append({"role": "user", "speaker": "主公", "text": content, "time": self.now_iso()})
+            targets = []
+            for alias in aliases:
+                model = next((m for m in self.models if m.get("alias") == alias), None)
+                if model:
+                    targets.append((alias, dict(model)))
+            parallel = self.parallel_dispatch
+            max_workers = self.max_concurrency
+
+        with sess.lock:
+            user_message = {"role": "user", "speaker": "主公", "text": content, "time": self.now_iso()}
+            # Rows reach the day file in the order they get their seq, even when rounds overlap.
+            sess.append(user_message)
+            sess.store.append_messages([user_message])
+            snapshot = sess.prompt_rows()
+            summary = sess.summary.snapshot()
+            cache = sess.render_cache
+            # Memory recall runs once per round; every advisor's prompt reuses its result.
+            started = time.perf_counter()
+            recalled = sess.store.recall_rows_for_query(content, limit=3)
+            recall_s = time.perf_counter() - started
+            notes = sess.store.format_notes(recalled)
+            # Summaries of days the in-memory history reaches back to change with every message and add
+            # nothing the history itself lacks, so cache and coalescing keys leave them out.
+            first_day = str(sess.history[0].get("time", ""))[:10]
+            context = context_digest(sess.history, content)
+            context_notes = sess.store.format_notes([row for row in recalled if row.get("date", "") < first_day])
+
+        if on_event:
+            on_event("start", {"input": content, "targets": [alias for alias, _ in targets], "message": user_message})
+        return {
+            "content": content,
+            "targets": targets,
+            "user_message": user_message,
+            "context": RoundContext(
+                SYSTEM_PROMPT, content, snapshot, summary, notes, cache, context, context_notes, sess.id
+            ),
+            "recall_s": recall_s,
+            "quorum": quorum,
+            "parallel": parallel,
+            "max_workers": max_workers,
+        }
 
+    def _finish_round(self, sess, rnd: Dict, replies, cut_off, on_event=None, since=None, epoch=None) -> Dict:
+        content, targets, user_message = rnd["content"], rnd["targets"], rnd["user_message"]
+        round_messages = [user_message] + replies
+        if cut_off:
+            round_messages.append({
+                "role": "system",
+                "speaker": "军议",
+                "text": f"本轮已提前结束（{len(replies)}/{len(targets)} 位军师作答），未及发言：{'、'.join(cut_off)}",
+                "time": self.now_iso(),
+            })
+
+        with sess.lock:
+            for message in round_messages[1:]:
+                sess.append(message)
+            sess.store.append_messages(round_messages[1:])
+            if since is None:
+                delta = {"messages": round_messages, "cursor": sess.seq, "epoch": sess.epoch, "full": False}
+            else:
+                delta = sess.delta(since, epoch)
+
+        RECALL_SECONDS.observe(rnd["recall_s"])
+        PROMPT_BUILD_SECONDS.observe(rnd["context"].build_s)
+        timings = {
+            "recall_ms": round(rnd["recall_s"] * 1000, 3),
+            "prompt_build_ms": round(rnd["context"].build_s * 1000, 3),
+        }
+        result = {"input": content, "replies": replies, "cut_off": cut_off, "timings": timings, **delta}
+        if on_event:
+            on_event("done", result)
+        return result
+
+    # ---- asyncio path (server.py --mode async) ----
+
+    async def chat_async(
+        self,
+        text: str,
+        collaborate=False,
+        on_event=None,
+        since: Optional[int] = None,
+        epoch: Optional[str] = None,
+        use_cache: bool = True,
+        session: Optional[str] = None,
+    ):
+        # Same contract as chat(); stdin/arg advisors run as asyncio subprocesses on the caller's loop.
+        # on_event may be called from worker threads, so it must be thread-safe.
+        # Loading a session reads its store from disk, and releasing one may evict another: both stay off the loop.
+        sess = await asyncio.to_thread(self.sessions.acquire, session)
+        try:
+            return await self._chat_async(sess, text, collaborate, on_event, since, epoch, use_cache)
+        finally:
+            await asyncio.to_thread(self.sessions.release, sess)
+
+    async def _chat_async(self, sess, text: str, collaborate, on_event, since, epoch, use_cache: bool):
+        rnd = await asyncio.to_thread(self._begin_round, sess, text, collaborate, on_event)
+        targets, ctx, quorum = rnd["targets"], rnd["context"], rnd["quorum"]
+        semaphore = asyncio.Semaphore(rnd["max_workers"])
+
+        async def ask(alias: str, model, prompt: str, extra_rows=()):
+            async with semaphore:
+                return await self._ask_advisor_async(alias, model, prompt, ctx, on_event, use_cache, extra_rows)
+
+        cut_off = []
+        if quorum or rnd["parallel"]:
+            prompts = [ctx.prompt(alias, model) for alias, model in targets]
+            tasks = [
+                asyncio.ensure_future(ask(alias, model, prompt)) for (alias, model), prompt in zip(targets, prompts)
+            ]
+            if quorum:
+                k = min(quorum["quorum"] or len(targets), len(targets))
+                await self._await_quorum(tasks, k, quorum["deadline_ms"])
+            else:
+                await asyncio.gather(*tasks)
             replies = []
-            for alias in targets:
-                model = next((m for m in self.models if m.get("alias") == alias), None)
-                if not model:
-                    continue
+            for (alias, _), task in zip(targets, tasks):
+                if task.cancelled():
+                    cut_off.append(alias)
+                else:
+                    replies.append(task.result()[0])
+        else:
+            replies = []
+            for alias, model in targets:
+                prompt = ctx.prompt(alias, model, replies)
+                replies.append((await ask(alias, model, prompt, list(replies)))[0])
+        return await asyncio.to_thread(self._finish_round, sess, rnd, replies, cut_off, on_event, since, epoch)
 
-                prompt = self.build_prompt(alias, content)
-                try:
-                    reply_text = self.invoke_model(model, prompt)
-                except Exception as exc:
-                    reply_text = f"调用失败：{exc}"
+    @staticmethod
+    async def _await_quorum(tasks, quorum: int, deadline_ms: Optional[int]):
+        deadline = time.monotonic() + deadline_ms / 1000 if deadline_ms else None
+        pending = set(tasks)
+        answered = 0
+        while pending and answered < quorum:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                break
+            answered += sum(1 for task in done if task.result()[1])
+        for task in pending:
+            task.cancel()
+        if pending:
+            # Let cancellation reach the subprocesses before the round is committed.
+            await asyncio.wait(pending)
 
-                message = {"role": "assistant", "speaker": alias, "text": reply_text, "time": self.now_iso()}
-                self.history.append(message)
-                replies.append(message)
+    async def _ask_advisor_async(
+        self, alias: str, model, prompt: str, ctx: RoundContext, on_event=None, use_cache=True, extra_rows=()
+    ):
+        # Returns (message, ok) like _ask_advisor_outcome; a quorum cut-off arrives as CancelledError.
+        on_delta = None
+        if on_event:
+            def on_delta(piece: str):
+                on_event("delta", {"speaker": alias, "delta": piece})
+        key = self.reply_cache.make_key(model, ctx.cache_text(alias, model, extra_rows))
+        flight = (ctx.session, use_cache, key)
+        try:
+            reply_text, shared = await self.inflight.do_async(
+                flight, lambda: self._invoke_cached_async(alias, model, prompt, key, on_delta, use_cache)
+            )
+            if shared and on_delta:
+                on_delta(reply_text)
+            ok = True
+        except Exception as exc:
+            reply_text = f"调用失败：{exc}"
+            ok = False
+        message = {"role": "assistant", "speaker": alias, "text": reply_text, "time": self.now_iso()}
+        if on_event:
+            on_event("reply", message)
+        return message, ok
 
-            persisted = [self.history[-(1 + len(replies))]] + replies
-            self.store.append_messages(persisted)
+    async def _invoke_cached_async(self, alias: str, model, prompt: str, key: str, on_delta, use_cache: bool) -> str:
+        options = cache_options(model)
+        if options and not use_cache:
+            self.reply_cache.note_bypass(alias)
+            options = None
+        elif options:
+            cached = self.reply_cache.get(alias, key, options)
+            if cached is not None:
+                if on_delta:
+                    on_delta(cached)
+                return cached
+        reply_text = await self._invoke_resilient_async(alias, model, prompt, on_delta)
+        if options:
+            self.reply_cache.put(alias, key, reply_text, options)
+        return reply_text
+
+    async def _invoke_resilient_async(self, alias: str, model, prompt: str, on_delta) -> str:
+        breaker, delay = self._resilience_gate(alias, model)
+        try:
+            if delay is None:
+                text = await self._invoke_timed_async(alias, model, prompt, on_delta)
+            else:
+                text = await self._invoke_hedged_async(alias, model, prompt, on_delta, delay)
+        except asyncio.CancelledError:
+            if breaker:
+                self.breakers.abandon(alias)
+            raise
+        except Exception:
+            if breaker:
+                self.breakers.record(alias, False, breaker)
+            raise
+        if breaker:
+            self.breakers.record(alias, True, breaker)
+        return text
+
+    async def _invoke_timed_async(self, alias: str, model, prompt: str, on_delta) -> str:
+        started = time.monotonic()
+        text = await self.invoke_model_async(model, prompt, on_delta)
+        self.latency.record(alias, time.monotonic() - started)
+        return text
+
+    async def _invoke_hedged_async(self, alias: str, model, prompt: str, on_delta, delay: float) -> str:
+        forward_for = self._stream_owner(on_delta)
+        tasks = [asyncio.ensure_future(self._invoke_timed_async(alias, model, prompt, forward_for(0)))]
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            tasks.append(asyncio.ensure_future(self._invoke_timed_async(alias, model, prompt, forward_for(1))))
+        pending = set(tasks)
+        errors = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    errors.append(task.exception())
+            raise errors[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def invoke_model_async(self, model, prompt: str, on_delta: Optional[Callable[[str], None]] = None) -> str:
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await self._invoke_model_async(model, prompt, on_delta)
+        except BaseException as exc:
+            outcome = _failure_reason(exc)
+            raise
+        finally:
+            _observe_invoke(model, outcome, time.perf_counter() - started)
+
+    async def _invoke_model_async(self, model, prompt: str, on_delta=None) -> str:
+        transport = model.get("transport", "mock")
+        alias = model.get("alias", "未知")
+        timeout_s = resilience_options(model)["timeout_s"]
+
+        if transport == "mock":
+            text = self._mock_reply(alias, prompt)
+            if on_delta:
+                on_delta(text)
+            return text
+
+        if transport == "session":
+            # Session workers speak a blocking pipe protocol; run them on a thread and kill on cancel.
+            token = CancelToken()
+            try:
+                return await asyncio.to_thread(self._invoke_model, model, prompt, on_delta, token)
+            except asyncio.CancelledError:
+                token.cancel()
+                raise
+
+        run_args, stdin_data, env = self._command_for(model, prompt)
+        parser, on_line, limits = self._output_sink(model, run_args, on_delta)
+        stats = {}
+        try:
+            returncode, stderr = await run_streaming_async(
+                run_args, stdin_data, on_line, timeout_s, stats, env, limits
+            )
+        except FileNotFoundError as exc:
+            raise RuntimeError(self._missing_command(model)) from exc
+        except TimeoutError as exc:
+            raise RuntimeError(f"模型 {alias} 调用超时（{timeout_s:g} 秒），已终止进程") from exc
+        finally:
+            _observe_process(alias, stats)
 
-        return {"input": content, "replies": replies, "history": self.get_history()}
+        self._check_exit(model, returncode, stderr)
+        parser.dropped_lines = stats.get("dropped_lines", 0)
+        return parser.result() or f"模型 {alias} 未返回内容"
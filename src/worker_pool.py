@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+import json
+import os
+import subprocess
+from collections import deque
+from threading import Condition, Lock, Thread, Timer
+from typing import Callable, Dict, List, Optional
+try:
+    from cli_output import DEFAULT_MAX_LINE_BYTES, DEFAULT_MAX_STDERR_BYTES, READ_CHUNK_BYTES, LineSplitter, TailBuffer
+    from resilience import kill_process_tree
+except ImportError:
+    from .cli_output import DEFAULT_MAX_LINE_BYTES, DEFAULT_MAX_STDERR_BYTES, READ_CHUNK_BYTES, LineSplitter, TailBuffer
+    from .resilience import kill_process_tree
+
+DEFAULT_POOL_SIZE = 1
+DEFAULT_MAX_REQUESTS = 100
+
+
+class WorkerCrashed(RuntimeError):
+    pass
+
+
+class WorkerTimeout(RuntimeError):
+    pass
+
+
+# A long-lived advisor process speaking line-delimited JSON over stdin/stdout:
+#   request  {"id": 1, "prompt": "..."}
+#   response {"id": 1, "text": "..."} or {"id": 1, "error": "..."}
+# stdout is read in chunks through a LineSplitter, so no line holds more than max_line_bytes, and stderr
+# is drained into a TailBuffer that crash reports quote, as for the stdin/arg transports.
+class Worker:
+    def __init__(self, run_args: List[str], env: Optional[Dict[str, str]] = None, limits: Optional[Dict] = None):
+        limits = limits or {}
+        self.proc = subprocess.Popen(
+            run_args,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=0,
+            start_new_session=True,
+        )
+        self.served = 0
+        self._next_id = 0
+        self._splitter = LineSplitter(limits.get("max_line_bytes", DEFAULT_MAX_LINE_BYTES))
+        self._lines = deque()
+        self._stderr = TailBuffer(limits.get("max_stderr_bytes", DEFAULT_MAX_STDERR_BYTES))
+        self._stderr_lock = Lock()
+        self._stderr_thread = Thread(target=self._drain_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        try:
+            for chunk in iter(lambda: self.proc.stderr.read(READ_CHUNK_BYTES), b""):
+                with self._stderr_lock:
+                    self._stderr.add(chunk)
+        except (OSError, ValueError):
+            pass
+
+    def stderr_text(self) -> str:
+        with self._stderr_lock:
+            return self._stderr.text().strip()
+
+    def _readline(self) -> str:
+        # Next complete stdout line, or "" at EOF.
+        while not self._lines:
+            dropped = self._splitter.dropped
+            chunk = os.read(self.proc.stdout.fileno(), READ_CHUNK_BYTES)
+            if not chunk:
+                self._lines.extend(self._splitter.close())
+                return self._lines.popleft() if self._lines else ""
+            self._lines.extend(self._splitter.feed(chunk))
+            if self._splitter.dropped > dropped:
+                raise RuntimeError(f"会话进程单行输出超过 {self._splitter.max_line_bytes} 字节，已丢弃")
+        return self._lines.popleft()
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def request(
+        self, prompt: str, timeout: Optional[float] = None, on_line: Optional[Callable[[str], None]] = None
+    ) -> str:
+        # On timeout the worker is killed; the blocked readline then sees EOF.
+        expired = []
+        timer = None
+        if timeout:
+            def expire():
+                expired.append(True)
+                kill_process_tree(self.proc)
+            timer = Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+        try:
+            return self._request(prompt, expired, on_line)
+        finally:
+            if timer:
+                timer.cancel()
+
+    def _request(self, prompt: str, expired: List[bool], on_line=None) -> str:
+        self._next_id += 1
+        req_id = self._next_id
+        try:
+            request = json.dumps({"id": req_id, "prompt": prompt}, ensure_ascii=False) + "\n"
+            self.proc.stdin.write(request.encode("utf-8"))
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError, ValueError) as exc:
+            raise WorkerCrashed(f"写入失败：{exc}") from exc
+
+        while True:
+            try:
+                line = self._readline()
+            except (OSError, ValueError):
+                line = ""
+            if not line:
+                if expired:
+                    raise WorkerTimeout("调用超时，已终止会话进程")
+                try:
+                    code = self.proc.wait(timeout=1)
+                except subprocess.TimeoutExpired:
+                    code = None
+                self._stderr_thread.join(timeout=1)
+                err = self.stderr_text()
+                raise WorkerCrashed(f"进程已退出({code})" + (f"：{err}" if err else ""))
+            if on_line:
+                on_line(line)
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except Exception:
+                # Stray log output on stdout is tolerated and skipped.
+                continue
+            if not isinstance(obj, dict) or obj.get("id") != req_id:
+                continue
+            self.served += 1
+            if obj.get("error"):
+                raise RuntimeError(str(obj["error"]))
+            text = obj.get("text")
+            return text if isinstance(text, str) else ""
+
+    def close(self):
+        try:
+            if self.proc.stdin:
+                self.proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self.proc.terminate()
+            self.proc.wait(timeout=2)
+        except Exception:
+            self.proc.kill()
+        self.proc.stdout.close()
+
+
+class WorkerPool:
+    def __init__(
+        self, alias: str, run_args: List[str], pool_size: int, max_requests: int, env: Optional[Dict[str, str]] = None,
+        limits: Optional[Dict] = None,
+    ):
+        self.alias = alias
+        self.run_args = run_args
+        self.env = env
+        self.limits = limits
+        self.pool_size = max(1, pool_size)
+        self.max_requests = max(1, max_requests)
+        self._idle = deque()
+        self._count = 0
+        self._closed = False
+        self._cond = Condition()
+
+    def _spawn(self) -> Worker:
+        try:
+            return Worker(self.run_args, self.env, self.limits)
+        except OSError as exc:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise RuntimeError(f"模型 {self.alias} 会话进程启动失败：{exc}") from exc
+
+    def _acquire(self) -> Worker:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError(f"模型 {self.alias} 会话池已关闭")
+                while self._idle:
+                    worker = self._idle.popleft()
+                    if worker.alive():
+                        return worker
+                    worker.close()
+                    self._count -= 1
+                if self._count < self.pool_size:
+                    self._count += 1
+                    break
+                self._cond.wait()
+        return self._spawn()
+
+    def _release(self, worker: Worker):
+        recycle = self._closed or not worker.alive() or worker.served >= self.max_requests
+        if recycle:
+            worker.close()
+        with self._cond:
+            if recycle:
+                self._count -= 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def _discard(self, worker: Worker):
+        worker.close()
+        with self._cond:
+            self._count -= 1
+            self._cond.notify()
+
+    def request(self, prompt: str, timeout: Optional[float] = None, token=None, on_line=None) -> str:
+        # on_line receives every raw stdout line (output spill).
+        # A crashed worker is replaced once; a second crash is reported to the caller.
+        # Timeouts and cancellation kill the worker and are not retried.
+        for attempt in range(2):
+            worker = self._acquire()
+            if token:
+                token.register(worker.proc)
+            try:
+                text = worker.request(prompt, timeout, on_line)
+            except WorkerTimeout:
+                self._discard(worker)
+                raise
+            except WorkerCrashed as exc:
+                self._discard(worker)
+                if token and token.cancelled:
+                    raise
+                if attempt == 1:
+                    raise RuntimeError(f"模型 {self.alias} 会话进程异常：{exc}") from exc
+                continue
+            except Exception:
+                self._release(worker)
+                raise
+            finally:
+                if token:
+                    token.unregister(worker.proc)
+            self._release(worker)
+            return text
+        return ""
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._count -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.close()
+
+
+class WorkerPools:
+    def __init__(self, resolver=None):
+        # resolver: a CommandResolver mapping `cmd` to an absolute path and spawn environment.
+        self.resolver = resolver
+        self._pools: Dict[str, WorkerPool] = {}
+        self._specs: Dict[str, tuple] = {}
+        self._lock = Lock()
+
+    def _pool_for(self, model, limits: Optional[Dict] = None) -> WorkerPool:
+        alias = model.get("alias", "未知")
+        cmd = model.get("cmd", "")
+        if not cmd:
+            raise RuntimeError(f"模型 {alias} 缺少 cmd")
+        options = model.get("session") if isinstance(model.get("session"), dict) else {}
+        env = None
+        if self.resolver:
+            path, via = self.resolver.resolve(cmd)
+            cmd, env = path or cmd, self.resolver.env_for(via)
+        run_args = [cmd] + [str(x) for x in model.get("args", [])]
+        pool_size = int(options.get("pool_size", DEFAULT_POOL_SIZE))
+        max_requests = int(options.get("max_requests", DEFAULT_MAX_REQUESTS))
+        limits = dict(limits or {})
+        spec = (tuple(run_args), pool_size, max_requests, tuple(sorted(limits.items())))
+
+        stale = None
+        with self._lock:
+            pool = self._pools.get(alias)
+            if pool is None or self._specs.get(alias) != spec:
+                stale = pool
+                pool = WorkerPool(alias, run_args, pool_size, max_requests, env, limits)
+                self._pools[alias] = pool
+                self._specs[alias] = spec
+        if stale:
+            stale.close()
+        return pool
+
+    def request(
+        self, model, prompt: str, timeout: Optional[float] = None, token=None,
+        limits: Optional[Dict] = None, on_line=None,
+    ) -> str:
+        # limits: output_options(model); max_line_bytes and max_stderr_bytes bound each worker's buffers.
+        return self._pool_for(model, limits).request(prompt, timeout, token, on_line)
+
+    def close(self):
+        with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+            self._specs.clear()
+        for pool in pools:
+            pool.close()
@@ -64,13 +64,56 @@ function renderMessage(msg) {
   renderRichText(msg.text || '', item.querySelector('.msg-body'));
   messagesEl.appendChild(item);
   messagesEl.scrollTop = messagesEl.scrollHeight;
+  return item;
 }
 
 function renderHistory(history) {
   messagesEl.innerHTML = '';
+  if (historyState.older > 0) {
+    const more = document.createElement('button');
+    more.className = 'chip';
+    more.textContent = `加载更早消息（还有 ${historyState.older} 条）`;
+    more.addEventListener('click', () => loadOlderHistory().catch((err) => alert(err.message)));
+    messagesEl.appendChild(more);
+  }
   history.forEach(renderMessage);
 }
 
+const historyState = { items: [], cursor: null, epoch: null, older: 0 };
+
+async function loadOlderHistory() {
+  const first = historyState.items[0];
+  const params = new URLSearchParams({ limit: 50, before: first && first.seq !== undefined ? first.seq : '' });
+  const data = await api(`/api/history?${params.toString()}`);
+  const messages = data.messages || [];
+  historyState.items = messages.concat(historyState.items);
+  historyState.older = data.more ? Math.max(historyState.older - messages.length, 1) : 0;
+  const top = messagesEl.scrollHeight - messagesEl.scrollTop;
+  renderHistory(historyState.items);
+  messagesEl.scrollTop = messagesEl.scrollHeight - top;
+}
+
+function sinceParams() {
+  if (historyState.cursor === null) return {};
+  return { since: historyState.cursor, epoch: historyState.epoch };
+}
+
+function applyHistory(data) {
+  const messages = data.messages || data.history || [];
+  if (data.full || historyState.cursor === null || data.epoch !== historyState.epoch) {
+    historyState.items = messages.slice();
+  } else {
+    const known = new Set(historyState.items.map((m) => m.seq));
+    messages.forEach((m) => {
+      if (!known.has(m.seq)) historyState.items.push(m);
+    });
+  }
+  historyState.cursor = data.cursor ?? historyState.cursor;
+  historyState.epoch = data.epoch ?? historyState.epoch;
+  historyState.older = data.older ?? historyState.older;
+  renderHistory(historyState.items);
+}
+
 function formatMessageLine(m) {
   const time = (m.time || '').replace('T', ' ').slice(0, 19);
   return `[${time}] ${m.speaker || '未知'}(${m.role || 'unknown'}): ${m.text || ''}`;
@@ -104,11 +147,35 @@ async function loadMemoryDates(query = '') {
   renderMemoryDates(data.dates || []);
 }
 
-async function loadMemoryDetail(date) {
+const MEMORY_PAGE_SIZE = 100;
+
+async function loadMemoryDetail(date, cursor = 0) {
   if (!date) return;
-  const data = await api(`/api/memory/date?date=${encodeURIComponent(date)}`);
+  const params = new URLSearchParams({ date, cursor: String(cursor), limit: String(MEMORY_PAGE_SIZE) });
+  const data = await api(`/api/memory/date?${params.toString()}`);
   const lines = (data.history || []).map(formatMessageLine);
-  memoryDetailEl.textContent = lines.length ? lines.join('\n') : '该日期无聊天记录。';
+  if (cursor === 0) {
+    memoryDetailEl.textContent = lines.length ? lines.join('\n') : '该日期无聊天记录。';
+  } else {
+    memoryDetailEl.querySelector('.memory-more')?.remove();
+    memoryDetailEl.append(`\n${lines.join('\n')}`);
+  }
+  if (data.next_cursor !== null && data.next_cursor !== undefined) {
+    const more = document.createElement('button');
+    more.className = 'chip memory-more';
+    more.style.display = 'block';
+    more.style.marginTop = '6px';
+    more.textContent = `加载更多（${data.next_cursor}/${data.total}）`;
+    more.addEventListener('click', () => loadMemoryDetail(date, data.next_cursor).catch((err) => alert(err.message)));
+    memoryDetailEl.appendChild(more);
+  }
+}
+
+async function searchMemoryMessages(query) {
+  if (!query) return;
+  const data = await api(`/api/memory/search?q=${encodeURIComponent(query)}&limit=20`);
+  const lines = (data.results || []).map((r) => `[${r.date}] ${r.speaker || '未知'}(${r.role || 'unknown'}): ${r.snippet || ''}`);
+  memoryDetailEl.textContent = lines.length ? lines.join('\n') : '未找到包含该关键词的消息。';
 }
 
 function showThinking(collaborate) {
@@ -149,7 +216,57 @@ async function loadInitial() {
     loadMemoryDates()
   ]);
   renderChips(modelsData.models || []);
-  renderHistory(historyData.history || []);
+  applyHistory(historyData);
+}
+
+function streamChat(text, collaborate, pendingId) {
+  return new Promise((resolve, reject) => {
+    const params = new URLSearchParams({ text, collaborate: collaborate ? '1' : '0', ...sinceParams() });
+    const source = new EventSource(`/api/chat/stream?${params.toString()}`);
+    const bubbles = {};
+    let started = false;
+
+    const bubbleFor = (speaker) => {
+      if (!bubbles[speaker]) {
+        clearThinking(pendingId);
+        const item = renderMessage({ role: 'assistant', speaker, text: '' });
+        bubbles[speaker] = { item, text: '' };
+      }
+      return bubbles[speaker];
+    };
+
+    source.addEventListener('start', () => {
+      started = true;
+    });
+    source.addEventListener('delta', (e) => {
+      const data = JSON.parse(e.data);
+      const bubble = bubbleFor(data.speaker);
+      bubble.text = bubble.text ? `${bubble.text}\n${data.delta}` : data.delta;
+      renderRichText(bubble.text, bubble.item.querySelector('.msg-body'));
+      messagesEl.scrollTop = messagesEl.scrollHeight;
+    });
+    source.addEventListener('reply', (e) => {
+      const data = JSON.parse(e.data);
+      const bubble = bubbleFor(data.speaker);
+      bubble.text = data.text;
+      renderRichText(bubble.text, bubble.item.querySelector('.msg-body'));
+    });
+    source.addEventListener('done', (e) => {
+      source.close();
+      resolve(JSON.parse(e.data));
+    });
+    source.addEventListener('error', (e) => {
+      source.close();
+      if (e.data) {
+        reject(new Error(JSON.parse(e.data).error || '请求失败'));
+        return;
+      }
+      // Validation errors come back as plain 400 JSON; let the caller retry over POST.
+      const err = new Error(started ? '流式连接中断' : 'stream-unavailable');
+      err.fallback = !started;
+      reject(err);
+    });
+  });
 }
 
 async function sendChat() {
@@ -162,11 +279,18 @@ async function sendChat() {
   const pendingId = showThinking(collaborateEl.checked);
   try {
     sendBtn.disabled = true;
-    const data = await api('/api/chat', 'POST', {
-      text,
-      collaborate: collaborateEl.checked,
-    });
-    renderHistory(data.history || []);
+    let data;
+    try {
+      data = await streamChat(text, collaborateEl.checked, pendingId);
+    } catch (err) {
+      if (!err.fallback) throw err;
+      data = await api('/api/chat', 'POST', {
+        text,
+        collaborate: collaborateEl.checked,
+        ...sinceParams(),
+      });
+    }
+    applyHistory(data);
     await loadMemoryDates(memoryQueryEl.value.trim());
   } catch (err) {
     inputEl.value = text;
@@ -210,7 +334,8 @@ addModelBtn.addEventListener('click', async () => {
 
 memorySearchBtn.addEventListener('click', async () => {
   try {
-    await loadMemoryDates(memoryQueryEl.value.trim());
+    const query = memoryQueryEl.value.trim();
+    await Promise.all([loadMemoryDates(query), searchMemoryMessages(query)]);
   } catch (err) {
     alert(err.message);
   }
@@ -218,7 +343,11 @@ memorySearchBtn.addEventListener('click', async () => {
 
 resetBtn.addEventListener('click', async () => {
   try {
-    await api('/api/reset', 'POST', {});
+    const data = await api('/api/reset', 'POST', {});
+    historyState.items = [];
+    historyState.cursor = data.cursor ?? null;
+    historyState.epoch = data.epoch ?? null;
+    historyState.older = data.older ?? 0;
     renderHistory([]);
     await loadMemoryDates(memoryQueryEl.value.trim());
     memoryDetailEl.textContent = '选择日期后可查看当日完整聊天内容。';